@@ -0,0 +1,207 @@
+"""
+Pluggable inference backends for the kidney classification model.
+
+Every backend takes a float32 batch of shape (N, 128, 128, 3) and returns the
+(N, 4) class probabilities:
+
+- ``keras``: the saved Keras model (``.h5``) or its ``.npz`` weights (see
+  kidney_model.py) served through ``InferenceEngine``
+- ``tflite``: a TFLite flatbuffer run by the TFLite interpreter (XNNPACK on CPU)
+- ``onnx``: an ONNX graph run by ONNX Runtime
+
+TFLite and ONNX Runtime are imported lazily so a deployment only needs the
+runtime of the backend it actually uses. Convert ``kidney_model.h5`` into the
+other formats with ``export_model.py``.
+"""
+
+import hashlib
+import importlib
+import logging
+import os
+import threading
+from typing import Dict, Iterable, Optional, Type
+
+import numpy as np
+
+from kidney_model import INPUT_SHAPE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_PATHS = {
+    "keras": "kidney_model.h5",
+    "tflite": "kidney_model.tflite",
+    "onnx": "kidney_model.onnx",
+}
+
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", str(os.cpu_count() or 1)))
+
+
+def model_file_version(path: str) -> str:
+    """Short content hash identifying a model file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+class InferenceBackend:
+    """Base class for inference backends"""
+
+    name = "base"
+
+    def __init__(self, model_path: Optional[str] = None):
+        self.model_path = model_path or DEFAULT_MODEL_PATHS.get(self.name)
+        self.version = model_file_version(self.model_path) if os.path.exists(self.model_path) else "untrained"
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """Predict class probabilities for a float32 batch of shape (N, H, W, C)"""
+        raise NotImplementedError
+
+    def warmup(self):
+        """Run a dummy prediction so the first request pays no setup cost"""
+        self.predict(np.zeros((1,) + INPUT_SHAPE, dtype=np.float32))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(model_path={self.model_path!r}, version={self.version!r})"
+
+
+class KerasBackend(InferenceBackend):
+    """Keras model served through traced concrete functions"""
+
+    name = "keras"
+
+    def __init__(self, model_path: Optional[str] = None, model=None, batch_buckets: Iterable[int] = (1, 8, 32)):
+        super().__init__(model_path)
+        from inference_engine import InferenceEngine
+
+        if model is not None:
+            self.engine = InferenceEngine(model, batch_buckets=batch_buckets)
+            # Built in memory rather than loaded from model_path
+            self.version = "in-memory"
+        else:
+            self.engine = InferenceEngine.from_file(self.model_path, batch_buckets=batch_buckets)
+        self.model = self.engine.model
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return self.engine.predict(batch)
+
+    def warmup(self):
+        self.engine.warmup()
+
+
+def load_tflite_interpreter():
+    """Prefer a standalone interpreter package, fall back to TensorFlow's interpreter"""
+    for module in ("tflite_runtime.interpreter", "ai_edge_litert.interpreter"):
+        try:
+            return importlib.import_module(module).Interpreter
+        except ImportError:
+            continue
+    try:
+        import tensorflow as tf
+    except ImportError as e:
+        raise ImportError("The tflite backend needs tflite-runtime, ai-edge-litert or tensorflow installed") from e
+    return tf.lite.Interpreter
+
+
+class TFLiteBackend(InferenceBackend):
+    """
+    TFLite interpreter; the input tensor is resized to each batch size on demand.
+    Full-integer (INT8) models are supported: float inputs are quantized and
+    outputs dequantized with the tensors' scale and zero point.
+    """
+
+    name = "tflite"
+
+    def __init__(self, model_path: Optional[str] = None, num_threads: int = INFERENCE_THREADS, **_):
+        super().__init__(model_path)
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"TFLite model not found: {self.model_path}")
+        Interpreter = load_tflite_interpreter()
+        self.interpreter = Interpreter(model_path=self.model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+        # The interpreter holds mutable tensor buffers, so calls must not overlap
+        self._lock = threading.Lock()
+
+    def _resize(self, batch_size: int):
+        if batch_size == self._batch_size:
+            return
+        shape = [batch_size] + list(self._input["shape"][1:])
+        self.interpreter.resize_tensor_input(self._input["index"], shape)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    @property
+    def is_quantized(self) -> bool:
+        return self._input["dtype"] != np.float32
+
+    def _quantize(self, batch: np.ndarray) -> np.ndarray:
+        """Map float inputs onto a full-integer model's input tensor"""
+        scale, zero_point = self._input["quantization"]
+        info = np.iinfo(self._input["dtype"])
+        return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(self._input["dtype"])
+
+    def _dequantize(self, outputs: np.ndarray) -> np.ndarray:
+        scale, zero_point = self._output["quantization"]
+        if self._output["dtype"] == np.float32 or scale == 0:
+            return outputs.astype(np.float32)
+        return (outputs.astype(np.float32) - zero_point) * scale
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            self._resize(len(batch))
+            if self.is_quantized:
+                batch = self._quantize(batch)
+            self.interpreter.set_tensor(self._input["index"], batch)
+            self.interpreter.invoke()
+            return self._dequantize(self.interpreter.get_tensor(self._output["index"]))
+
+
+class OnnxBackend(InferenceBackend):
+    """ONNX Runtime session on the CPU execution provider"""
+
+    name = "onnx"
+
+    def __init__(self, model_path: Optional[str] = None, num_threads: int = INFERENCE_THREADS, **_):
+        super().__init__(model_path)
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"ONNX model not found: {self.model_path}")
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("The onnx backend needs onnxruntime installed (pip install onnxruntime)") from e
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.model_path, sess_options=options,
+                                            providers=["CPUExecutionProvider"])
+        self._input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        batch = np.asarray(batch, dtype=np.float32)
+        return self.session.run(None, {self._input_name: batch})[0]
+
+
+BACKENDS: Dict[str, Type[InferenceBackend]] = {
+    KerasBackend.name: KerasBackend,
+    TFLiteBackend.name: TFLiteBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+
+def create_backend(name: str, model_path: Optional[str] = None, **kwargs) -> InferenceBackend:
+    """Create the inference backend registered under ``name``"""
+    try:
+        backend_class = BACKENDS[name.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown inference backend '{name}'. Choose one of: {', '.join(BACKENDS)}")
+    backend = backend_class(model_path=model_path, **kwargs)
+    logger.info(f"Using {backend}")
+    return backend
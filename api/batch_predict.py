@@ -0,0 +1,121 @@
+"""
+Helpers for the /predict-batch endpoint.
+
+Uploads can be any mix of image files and zip/tar archives of images. Items are
+read one at a time, scored concurrently (so the batch scheduler can group them
+into large forward passes) and streamed back as NDJSON, one line per image, in
+completion order.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import tarfile
+import zipfile
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Tuple
+
+from fastapi import HTTPException, UploadFile
+
+from executors import run_in_pool
+from ingestion import MAX_UPLOAD_BYTES, upload_buffer
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff', '.webp')
+ZIP_EXTENSIONS = ('.zip',)
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+# Images decoded/scored at the same time per batch request
+BATCH_ENDPOINT_CONCURRENCY = int(os.getenv("BATCH_ENDPOINT_CONCURRENCY", "64"))
+
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ZIP_EXTENSIONS + TAR_EXTENSIONS)
+
+
+def iter_archive_images(fileobj, filename: str) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yield (member name, bytes) for every image inside a zip or tar archive.
+    Members larger than MAX_UPLOAD_BYTES are skipped without being extracted.
+    """
+    fileobj.seek(0)
+    if filename.lower().endswith(ZIP_EXTENSIONS):
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    if info.file_size > MAX_UPLOAD_BYTES:
+                        logger.warning(f"Skipping {filename}/{info.filename}: {info.file_size} bytes")
+                        continue
+                    yield f"{filename}/{info.filename}", archive.read(info)
+    else:
+        # Streaming mode reads members sequentially without seeking back
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                    if member.size > MAX_UPLOAD_BYTES:
+                        logger.warning(f"Skipping {filename}/{member.name}: {member.size} bytes")
+                        continue
+                    yield f"{filename}/{member.name}", archive.extractfile(member).read()
+
+
+async def iter_upload_images(files: List[UploadFile]) -> AsyncIterator[Tuple[str, bytes]]:
+    """Yield (name, bytes) for each uploaded image, expanding archives; file I/O runs on the pool"""
+    for upload in files:
+        filename = upload.filename or "upload"
+        if is_archive(filename):
+            members = iter_archive_images(upload.file, filename)
+            while True:
+                # The generator is only ever advanced by one pool thread at a time
+                item = await run_in_pool(next, members, None)
+                if item is None:
+                    break
+                yield item
+        else:
+            try:
+                data = await run_in_pool(upload_buffer, upload)
+            except HTTPException as e:
+                logger.warning(f"Skipping {filename}: {e.detail}")
+                continue
+            yield filename, data
+
+
+async def stream_predictions(items: AsyncIterator[Tuple[str, bytes]],
+                             predict_fn: Callable[[bytes, str], Awaitable[Dict[str, Any]]],
+                             concurrency: int = BATCH_ENDPOINT_CONCURRENCY) -> AsyncIterator[str]:
+    """Score items concurrently and yield one NDJSON line per image as each completes"""
+    slots = asyncio.Semaphore(max(1, concurrency))
+
+    async def score(index: int, name: str, data: bytes) -> Dict[str, Any]:
+        try:
+            result = await predict_fn(data, f"batch item: {name}")
+        except Exception as e:
+            logger.error(f"Error processing batch item {name}: {str(e)}")
+            result = {"error": f"Error processing image: {str(e)}"}
+        finally:
+            slots.release()
+        return dict(result, index=index, filename=name)
+
+    def to_line(task: asyncio.Task) -> str:
+        return json.dumps(task.result()) + "\n"
+
+    pending = set()
+    index = 0
+    try:
+        async for name, data in items:
+            await slots.acquire()
+            pending.add(asyncio.ensure_future(score(index, name, data)))
+            index += 1
+            finished = {task for task in pending if task.done()}
+            pending -= finished
+            for task in finished:
+                yield to_line(task)
+
+        while pending:
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                yield to_line(task)
+    finally:
+        # Client went away mid-stream: don't keep scoring for nobody
+        for task in pending:
+            task.cancel()
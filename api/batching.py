@@ -0,0 +1,200 @@
+"""
+Dynamic micro-batching for model inference.
+
+Requests that arrive close together are collected into a single batch (up to
+``max_batch_size`` images or ``max_wait_ms`` milliseconds, whichever comes
+first) and run through the model in one forward pass. Each caller gets back
+its own row of the prediction array, paired with the version of the model
+that produced it.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (in milliseconds) of the queue wait-time histogram buckets
+WAIT_TIME_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+def default_batch_buckets(max_batch_size: int) -> Tuple[int, ...]:
+    """Powers of two up to (and including) ``max_batch_size``"""
+    buckets = []
+    size = 1
+    while size < max_batch_size:
+        buckets.append(size)
+        size *= 2
+    buckets.append(max(1, max_batch_size))
+    return tuple(buckets)
+
+
+class BatchScheduler:
+    """Collects single-image requests and runs them through the model in batches"""
+
+    def __init__(self, predict_fn: Callable[[np.ndarray], Sequence[Tuple[np.ndarray, str]]],
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue: "queue.Queue[Tuple[np.ndarray, Future, float]]" = queue.Queue()
+        # Reused for every batch; only the worker thread touches it
+        self._input_buffer: Optional[np.ndarray] = None
+        self._worker = None
+        self._running = False
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.batches_run = 0
+        self.images_processed = 0
+        self.batch_size_counts: Dict[int, int] = {}
+        self.wait_time_counts = [0] * (len(WAIT_TIME_BUCKETS_MS) + 1)
+        self.wait_time_sum_ms = 0.0
+        self.wait_time_max_ms = 0.0
+
+    def start(self):
+        """Start the background worker thread"""
+        if self._running:
+            return
+        self._running = True
+        self._worker = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._worker.start()
+        logger.info(f"Batch scheduler started (max_batch_size={self.max_batch_size}, "
+                    f"max_wait_ms={self.max_wait * 1000:.1f})")
+
+    def stop(self):
+        """Stop the worker thread, failing any requests still queued"""
+        if not self._running:
+            return
+        self._running = False
+        self._queue.put(None)
+        self._worker.join(timeout=5)
+        self._worker = None
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            # False when the caller already cancelled it
+            if item is not None and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(RuntimeError("Batch scheduler stopped"))
+
+    @property
+    def queue_depth(self) -> int:
+        """Images waiting for a batch"""
+        return self._queue.qsize()
+
+    def submit(self, image: np.ndarray) -> Future:
+        """Queue one preprocessed image of shape (1, H, W, C) or (H, W, C), uint8 or float32"""
+        if not self._running:
+            raise RuntimeError("Batch scheduler is not running")
+        if image.ndim == 4:
+            image = image[0]
+        future: Future = Future()
+        self._queue.put((image, future, time.perf_counter()))
+        return future
+
+    async def predict(self, image: np.ndarray) -> Tuple[np.ndarray, str]:
+        """Await the prediction row for a single preprocessed image and the version of the model that made it"""
+        return await asyncio.wrap_future(self.submit(image))
+
+    def _collect_batch(self, first) -> List[Tuple[np.ndarray, Future, float]]:
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Shutdown sentinel: finish this batch, then let the loop exit
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _stack(self, batch: List[Tuple[np.ndarray, Future, float]]) -> np.ndarray:
+        """Copy (and cast to float32) the queued images into the reusable input buffer"""
+        shape = batch[0][0].shape
+        if self._input_buffer is None or self._input_buffer.shape[1:] != shape:
+            self._input_buffer = np.empty((self.max_batch_size,) + shape, dtype=np.float32)
+        inputs = self._input_buffer[:len(batch)]
+        for i, (image, _, _) in enumerate(batch):
+            inputs[i] = image
+        return inputs
+
+    def _run(self):
+        while self._running:
+            first = self._queue.get()
+            if first is None:
+                break
+            # A caller that went away (e.g. client disconnect) cancels its future. Marking the
+            # rest running drops those and makes the others impossible to cancel from here on,
+            # so setting their result below cannot race with a cancel.
+            batch = [item for item in self._collect_batch(first) if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                # Never let the worker die: every later request would wait forever
+                logger.exception(f"Batch delivery failed: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _run_batch(self, batch: List[Tuple[np.ndarray, Future, float]]):
+        started = time.perf_counter()
+        self._record(len(batch), [(started - enqueued) * 1000.0 for _, _, enqueued in batch])
+
+        try:
+            predictions = self.predict_fn(self._stack(batch))
+            if len(predictions) != len(batch):
+                raise RuntimeError(f"Model returned {len(predictions)} rows for a batch of {len(batch)} images")
+        except Exception as e:
+            logger.error(f"Batch inference failed: {e}")
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for row, (_, future, _) in zip(predictions, batch):
+            future.set_result(row)
+
+    def _record(self, batch_size: int, wait_times_ms: List[float]):
+        with self._stats_lock:
+            self.batches_run += 1
+            self.images_processed += batch_size
+            self.batch_size_counts[batch_size] = self.batch_size_counts.get(batch_size, 0) + 1
+            for wait_ms in wait_times_ms:
+                self.wait_time_counts[bisect_left(WAIT_TIME_BUCKETS_MS, wait_ms)] += 1
+                self.wait_time_sum_ms += wait_ms
+                self.wait_time_max_ms = max(self.wait_time_max_ms, wait_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of queue depth, batch-size histogram and wait-time metrics"""
+        with self._stats_lock:
+            buckets = [f"<={bound}" for bound in WAIT_TIME_BUCKETS_MS] + [f">{WAIT_TIME_BUCKETS_MS[-1]}"]
+            return {
+                "running": self._running,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": self.queue_depth,
+                "batches_run": self.batches_run,
+                "images_processed": self.images_processed,
+                "average_batch_size": (self.images_processed / self.batches_run) if self.batches_run else 0.0,
+                "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_size_counts.items())},
+                "wait_time_ms": {
+                    "histogram": dict(zip(buckets, self.wait_time_counts)),
+                    "average": (self.wait_time_sum_ms / self.images_processed) if self.images_processed else 0.0,
+                    "max": self.wait_time_max_ms,
+                },
+            }
@@ -0,0 +1,403 @@
+"""
+Benchmark suite: throughput, latency, CPU and memory of the prediction API.
+
+Generates synthetic uploads: CT-like grayscale scans, which pass validation and
+reach the model, and saturated colour photographs, which the validator
+rejects. They come at several resolutions and formats. Each upload is then
+sent as a raw ``POST /predict`` body to each app (``main`` and
+``main_optimized``), over each transport:
+
+- ``inprocess``: the ASGI app is called directly from an asyncio client in a
+  dedicated process, with no network or HTTP parsing
+- ``http``: the app runs under uvicorn and is driven by client threads over
+  keep-alive connections
+
+For every configuration (app, transport, image kind, resolution, format,
+concurrency) the suite reports throughput, mean/p50/p95/p99 latency, the CPU
+time used by the serving process and its peak RSS. The results are written as
+JSON; ``--compare`` prints the change against an earlier results file, e.g.
+one from the previous commit.
+
+Runs offline: unless ``--model`` is given, an untrained model is created
+with create_test_model.py (Keras backend), which exercises the whole pipeline.
+The prediction cache is disabled so every request reaches the model.
+
+Usage:
+    python benchmark_api.py --output results.json
+    python benchmark_api.py --transports inprocess --resolutions 512 --concurrency 1 16
+    python benchmark_api.py --output new.json --compare old.json
+"""
+
+import argparse
+import asyncio
+import http.client
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CONTENT_TYPES = {"jpeg": "image/jpeg", "png": "image/png"}
+
+
+def make_image(kind: str, resolution: int, seed: int) -> Image.Image:
+    """A square synthetic upload: a CT-like grayscale slice or a saturated colour photograph"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:resolution, 0:resolution] / resolution
+    if kind == "ct":
+        # Body outline, two kidneys and a spine over a dark background, plus scanner noise
+        body = ((x - 0.5) / 0.42) ** 2 + ((y - 0.5) / 0.34) ** 2 < 1
+        kidneys = [((x - cx) / 0.08) ** 2 + ((y - 0.55) / 0.12) ** 2 < 1 for cx in (0.32, 0.68)]
+        spine = ((x - 0.5) / 0.06) ** 2 + ((y - 0.68) / 0.06) ** 2 < 1
+        gray = np.where(body, 110.0, 15.0)
+        for kidney in kidneys:
+            gray[kidney] = 150 + 10 * rng.random()
+        gray[spine] = 230
+        gray += rng.normal(0, 12, gray.shape)
+        return Image.fromarray(np.clip(gray, 0, 255).astype(np.uint8)).convert("RGB")
+    # Large blocks of saturated colour: high colour variance and contrast
+    blocks = rng.integers(0, 2, size=(8, 8, 3)) * 255
+    cells = (np.minimum((y * 8).astype(int), 7), np.minimum((x * 8).astype(int), 7))
+    rgb = blocks[cells].astype(np.float64) + rng.normal(0, 6, (resolution, resolution, 3))
+    return Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8))
+
+
+def encode(image: Image.Image, image_format: str) -> bytes:
+    buffer = io.BytesIO()
+    if image_format == "jpeg":
+        image.save(buffer, format="JPEG", quality=90)
+    else:
+        image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def make_uploads(kind: str, resolution: int, image_format: str, variants: int) -> List[bytes]:
+    return [encode(make_image(kind, resolution, seed), image_format) for seed in range(variants)]
+
+
+def create_test_model(output_dir: str) -> str:
+    """Untrained test model from create_test_model.py, created in a subprocess to keep TensorFlow out of this one"""
+    subprocess.run([sys.executable, os.path.join(API_DIR, "create_test_model.py")], cwd=output_dir, check=True,
+                   stdout=subprocess.DEVNULL)
+    return os.path.join(output_dir, "kidney_model.h5")
+
+
+# Process measurements (Linux /proc; None elsewhere)
+
+def cpu_seconds(pid: int) -> Optional[float]:
+    """User plus system CPU time of a process, all threads included"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def reset_peak_rss(pid: int):
+    """Reset VmHWM, so the next peak_rss_mb covers only what runs after this"""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def summarize(latencies_ms: List[float], statuses: Dict[int, int], elapsed: float) -> Dict[str, Any]:
+    latencies = np.asarray(latencies_ms) if latencies_ms else np.zeros(1)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "requests": len(latencies_ms),
+        "errors": sum(count for status, count in statuses.items() if status != 200),
+        "status_codes": {str(status): count for status, count in sorted(statuses.items())},
+        "seconds": elapsed,
+        "throughput_rps": len(latencies_ms) / elapsed if elapsed else 0.0,
+        "latency_ms": {"mean": float(latencies.mean()), "p50": float(p50), "p95": float(p95),
+                       "p99": float(p99), "max": float(latencies.max())},
+    }
+
+
+# In-process transport: the ASGI app called directly
+
+async def asgi_post(app, path: str, body: bytes, content_type: str) -> int:
+    """POST body to an ASGI app and return the response status"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    status = 0
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()  # No disconnect while the request is served
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def drive_inprocess(app, uploads: List[bytes], content_type: str, concurrency: int,
+                          requests: int) -> Tuple[List[float], Dict[int, int]]:
+    latencies, statuses = [], {}
+    counter = iter(range(requests))
+
+    async def client():
+        for i in counter:
+            started = time.perf_counter()
+            status = await asgi_post(app, "/predict", uploads[i % len(uploads)], content_type)
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append((time.perf_counter() - started) * 1000.0)
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, statuses
+
+
+async def inprocess_session(session: Dict[str, Any]):
+    """Body of the in-process child: load the app once, then run every configuration of the session"""
+    sys.path.insert(0, API_DIR)
+    import importlib
+    module = importlib.import_module(session["app"])
+    async with module.app.router.lifespan_context(module.app):
+        while not module.model_ready.is_set():
+            if module.model_load_error:
+                raise RuntimeError(module.model_load_error)
+            await asyncio.sleep(0.1)
+        for config in session["configs"]:
+            uploads = make_uploads(config["kind"], config["resolution"], config["format"], session["variants"])
+            content_type = CONTENT_TYPES[config["format"]]
+            await drive_inprocess(module.app, uploads, content_type, config["concurrency"], session["warmup"])
+            reset_peak_rss(os.getpid())
+            cpu_started, started = time.process_time(), time.perf_counter()
+            latencies, statuses = await drive_inprocess(module.app, uploads, content_type, config["concurrency"],
+                                                        session["requests"])
+            elapsed = time.perf_counter() - started
+            result = dict(config, **summarize(latencies, statuses, elapsed))
+            result["cpu_seconds"] = time.process_time() - cpu_started
+            result["peak_rss_mb"] = peak_rss_mb(os.getpid())
+            print(json.dumps(result), flush=True)
+
+
+def run_inprocess(session: Dict[str, Any], env: Dict[str, str]) -> List[Dict[str, Any]]:
+    """Run a session in a fresh interpreter, so apps and configurations don't share state or memory peaks"""
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--session", json.dumps(session)],
+                            env=env, capture_output=True, text=True)
+    if output.returncode != 0:
+        raise RuntimeError(f"In-process session for {session['app']} failed:\n{output.stderr[-3000:]}")
+    return [json.loads(line) for line in output.stdout.splitlines() if line.startswith("{")]
+
+
+# HTTP transport: uvicorn and client threads
+
+def wait_until_ready(port: int, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("GET", "/ready")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"Server did not become ready within {timeout:.0f}s")
+
+
+def drive_http(port: int, uploads: List[bytes], content_type: str, concurrency: int,
+               requests: int) -> Tuple[List[float], Dict[int, int]]:
+    latencies, statuses, lock = [], {}, threading.Lock()
+    counter = iter(range(requests))
+
+    def client():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        for i in counter:  # Shared iterator: next() is atomic under the GIL
+            body = uploads[i % len(uploads)]
+            started = time.perf_counter()
+            try:
+                connection.request("POST", "/predict", body=body, headers={"Content-Type": content_type})
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+                status = 0
+            elapsed = (time.perf_counter() - started) * 1000.0
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    latencies.append(elapsed)
+        connection.close()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(client) for _ in range(concurrency)]:
+            future.result()
+    return latencies, statuses
+
+
+def run_http(session: Dict[str, Any], env: Dict[str, str], port: int, timeout: float) -> List[Dict[str, Any]]:
+    command = [sys.executable, "-m", "uvicorn", f"{session['app']}:app", "--app-dir", API_DIR, "--port", str(port),
+               "--log-level", "warning"]
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    results = []
+    try:
+        wait_until_ready(port, process, timeout)
+        for config in session["configs"]:
+            uploads = make_uploads(config["kind"], config["resolution"], config["format"], session["variants"])
+            content_type = CONTENT_TYPES[config["format"]]
+            drive_http(port, uploads, content_type, config["concurrency"], session["warmup"])
+            reset_peak_rss(process.pid)
+            cpu_started, started = cpu_seconds(process.pid), time.perf_counter()
+            latencies, statuses = drive_http(port, uploads, content_type, config["concurrency"], session["requests"])
+            elapsed = time.perf_counter() - started
+            cpu_finished = cpu_seconds(process.pid)
+            result = dict(config, **summarize(latencies, statuses, elapsed))
+            result["cpu_seconds"] = cpu_finished - cpu_started if cpu_started is not None else None
+            result["peak_rss_mb"] = peak_rss_mb(process.pid)
+            results.append(result)
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+    return results
+
+
+# Reporting
+
+CONFIG_KEYS = ("app", "transport", "kind", "resolution", "format", "concurrency")
+
+
+def config_key(result: Dict[str, Any]) -> tuple:
+    return tuple(result[key] for key in CONFIG_KEYS)
+
+
+def print_results(results: List[Dict[str, Any]], baseline: Optional[Dict[tuple, Dict[str, Any]]] = None):
+    print(f"\n{'app':<15} {'transport':<9} {'kind':<5} {'res':>5} {'fmt':<4} {'conc':>4} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'cpu %':>6} {'peak MB':>8} {'err':>4}"
+          + ("   vs baseline (req/s, p95)" if baseline else ""))
+    for result in results:
+        latency = result["latency_ms"]
+        cpu = result["cpu_seconds"]
+        cpu_percent = f"{100 * cpu / result['seconds']:.0f}" if cpu is not None and result["seconds"] else "-"
+        peak = f"{result['peak_rss_mb']:.0f}" if result["peak_rss_mb"] is not None else "-"
+        line = (f"{result['app']:<15} {result['transport']:<9} {result['kind']:<5} {result['resolution']:>5} "
+                f"{result['format']:<4} {result['concurrency']:>4} {result['throughput_rps']:>8.1f} "
+                f"{latency['p50']:>8.1f} {latency['p95']:>8.1f} {latency['p99']:>8.1f} {cpu_percent:>6} "
+                f"{peak:>8} {result['errors']:>4}")
+        previous = (baseline or {}).get(config_key(result))
+        if previous is not None and previous["throughput_rps"] and previous["latency_ms"]["p95"]:
+            line += (f"   {result['throughput_rps'] / previous['throughput_rps'] - 1:+.0%}, "
+                     f"{latency['p95'] / previous['latency_ms']['p95'] - 1:+.0%}")
+        print(line)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=API_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the prediction API in-process and over HTTP")
+    parser.add_argument("--apps", nargs="+", default=["main", "main_optimized"])
+    parser.add_argument("--transports", nargs="+", choices=["inprocess", "http"], default=["inprocess", "http"])
+    parser.add_argument("--kinds", nargs="+", choices=["ct", "photo"], default=["ct", "photo"])
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[256, 1024])
+    parser.add_argument("--formats", nargs="+", choices=sorted(CONTENT_TYPES), default=["jpeg", "png"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--requests", type=int, default=100, help="Measured requests per configuration")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests per configuration")
+    parser.add_argument("--variants", type=int, default=8, help="Distinct images per kind, resolution and format")
+    parser.add_argument("--model", help="Model file to serve (default: a generated test model)")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--session", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.session:
+        asyncio.run(inprocess_session(json.loads(args.session)))
+        return
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        if args.model:
+            model_path = os.path.abspath(args.model)
+        else:
+            print("Creating the test model...", flush=True)
+            model_path = create_test_model(model_dir)
+        env = dict(os.environ, MODEL_PATH=model_path, PREDICTION_CACHE_SIZE="0")
+        env.pop("MODEL_DIR", None)
+
+        configs = [{"kind": kind, "resolution": resolution, "format": image_format, "concurrency": concurrency}
+                   for kind in args.kinds for resolution in args.resolutions for image_format in args.formats
+                   for concurrency in args.concurrency]
+        results = []
+        for app in args.apps:
+            for transport in args.transports:
+                print(f"Benchmarking {app} ({transport}, {len(configs)} configurations)...", flush=True)
+                session = {"app": app, "configs": [dict(config, app=app, transport=transport) for config in configs],
+                           "requests": args.requests, "warmup": args.warmup, "variants": args.variants}
+                if transport == "inprocess":
+                    results.extend(run_inprocess(session, env))
+                else:
+                    results.extend(run_http(session, env, args.port, args.startup_timeout))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {config_key(result): result for result in json.load(f)["results"]}
+    print_results(results, baseline)
+
+    if args.output:
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "model": args.model or "create_test_model.py",
+            "backend": os.getenv("MODEL_BACKEND", "keras"),
+            "settings": {"requests": args.requests, "warmup": args.warmup, "variants": args.variants},
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Benchmark: full-resolution decode + float32 resize vs. draft JPEG decode + uint8 resize.
+
+Each (path, input size) case runs in a fresh subprocess so its peak RSS is
+measured in isolation.
+
+Usage:
+    python benchmark_decode.py
+    python benchmark_decode.py --sizes 1024x768 4000x3000 --iterations 20
+"""
+
+import argparse
+import io
+import json
+import resource
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from preprocessing import IMGSIZE, preprocess_image
+
+DEFAULT_SIZES = ("640x480", "1920x1080", "4000x3000", "6000x4000")
+
+
+def full_resolution_path(image_data: bytes) -> np.ndarray:
+    """The previous pipeline: decode at native size, float32 at native size, then resize"""
+    image = Image.open(io.BytesIO(image_data)).convert('RGB')
+    img_array = np.array(image, dtype=np.float32)[..., ::-1]
+    img_resized = cv2.resize(img_array, (IMGSIZE, IMGSIZE))
+    return np.expand_dims(img_resized, axis=0)
+
+
+def draft_path(image_data: bytes) -> np.ndarray:
+    """The current pipeline: draft decode, uint8 resize, float32 only at IMGSIZE"""
+    return preprocess_image(image_data)
+
+
+PATHS = {"full": full_resolution_path, "draft": draft_path}
+
+
+def make_jpeg(width: int, height: int) -> bytes:
+    """Smooth photographic-like content so JPEG sizes are realistic"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    gray = (127 + 60 * np.sin(x / 37.0) * np.cos(y / 53.0)).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(gray).convert('RGB').save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def reset_peak_rss():
+    """
+    Reset the kernel's peak-RSS counter (Linux 4.0+). A child inherits its
+    parent's high-water mark across fork/exec, which would hide its own peak.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def max_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_case(path_name: str, size: str, jpeg_path: str, iterations: int):
+    """Measure one case in this process and print the result as JSON"""
+    with open(jpeg_path, "rb") as f:
+        image_data = f.read()
+    reset_peak_rss()
+    baseline = max_rss_mb()
+    fn = PATHS[path_name]
+
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn(image_data)
+        latencies.append((time.perf_counter() - started) * 1000.0)
+
+    print(json.dumps({
+        "path": path_name,
+        "size": size,
+        "mean_ms": float(np.mean(latencies)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "peak_rss_delta_mb": max_rss_mb() - baseline,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare full-resolution and draft decoding")
+    parser.add_argument("--sizes", nargs="+", default=list(DEFAULT_SIZES), help="WIDTHxHEIGHT input sizes")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--case", nargs=3, metavar=("PATH", "SIZE", "FILE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        run_case(*args.case, iterations=args.iterations)
+        return
+
+    # Sanity check: both paths must produce nearly the same model input
+    sample = make_jpeg(1600, 1200)
+    difference = np.abs(full_resolution_path(sample) - draft_path(sample)).max()
+    print(f"Max input difference between paths at 1600x1200 (0-255 scale): {difference:.1f}\n")
+
+    print(f"{'size':>10} {'path':>6} {'mean ms':>9} {'p99 ms':>9} {'peak RSS +MB':>13}")
+    for size in args.sizes:
+        # The JPEG is generated here so building it does not count towards the child's peak RSS
+        width, height = (int(v) for v in size.split("x"))
+        with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as f:
+            f.write(make_jpeg(width, height))
+            jpeg_path = f.name
+
+        results = {}
+        for path_name in PATHS:
+            output = subprocess.run(
+                [sys.executable, __file__, "--case", path_name, size, jpeg_path, "--iterations", str(args.iterations)],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            results[path_name] = json.loads(output.strip().splitlines()[-1])
+            r = results[path_name]
+            print(f"{size:>10} {path_name:>6} {r['mean_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['peak_rss_delta_mb']:>13.1f}")
+        print(f"{'':>10} speedup {results['full']['mean_ms'] / results['draft']['mean_ms']:.1f}x")
+        os.remove(jpeg_path)
+
+
+if __name__ == "__main__":
+    main()
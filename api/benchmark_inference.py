@@ -0,0 +1,64 @@
+"""
+Microbenchmark: Keras ``model.predict`` vs. the traced ``InferenceEngine``.
+
+Usage:
+    python benchmark_inference.py                     # uses kidney_model.h5 if present
+    python benchmark_inference.py --model other.h5 --iterations 200
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from kidney_model import INPUT_SHAPE, create_kidney_model, load_model
+from inference_engine import InferenceEngine
+
+BATCH_SIZES = (1, 8, 32)
+
+
+def time_calls(fn, batch, iterations):
+    """Return per-call latencies in milliseconds"""
+    fn(batch)  # Warm-up call outside the measurement
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn(batch)
+        latencies.append((time.perf_counter() - started) * 1000.0)
+    return np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare model.predict against InferenceEngine")
+    parser.add_argument("--model", default="kidney_model.h5", help="Saved model (an untrained one is built if missing)")
+    parser.add_argument("--iterations", type=int, default=100)
+    args = parser.parse_args()
+
+    if os.path.exists(args.model):
+        model = load_model(args.model)
+        print(f"Loaded {args.model}")
+    else:
+        model = create_kidney_model()
+        print(f"{args.model} not found, benchmarking an untrained model")
+
+    engine = InferenceEngine(model, batch_buckets=BATCH_SIZES)
+    engine.warmup()
+
+    print(f"\n{'batch':>5} {'path':<16} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'img/s':>9}")
+    for batch_size in BATCH_SIZES:
+        batch = np.random.random((batch_size,) + INPUT_SHAPE).astype(np.float32)
+
+        keras_ms = time_calls(lambda x: model.predict(x, verbose=False), batch, args.iterations)
+        engine_ms = time_calls(engine.predict, batch, args.iterations)
+
+        np.testing.assert_allclose(model.predict(batch, verbose=False), engine.predict(batch), rtol=1e-4, atol=1e-5)
+
+        for name, latencies in (("model.predict", keras_ms), ("InferenceEngine", engine_ms)):
+            print(f"{batch_size:>5} {name:<16} {latencies.mean():>9.2f} {np.percentile(latencies, 50):>9.2f} "
+                  f"{np.percentile(latencies, 99):>9.2f} {batch_size * 1000.0 / latencies.mean():>9.0f}")
+        print(f"{'':>5} speedup: {keras_ms.mean() / engine_ms.mean():.2f}x")
+
+
+if __name__ == "__main__":
+    main()
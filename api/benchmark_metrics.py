@@ -0,0 +1,95 @@
+"""
+Microbenchmark: overhead of the request instrumentation in metrics.py.
+
+Times each recording operation (histogram observe, timed block, counter
+increment) from one thread and from several threads at once, the cost of
+rendering /metrics, and the resulting overhead per prediction request, which
+records ``--observations-per-request`` values.
+
+Usage:
+    python benchmark_metrics.py
+    python benchmark_metrics.py --operations 2000000 --threads 8
+"""
+
+import argparse
+import threading
+import time
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest
+
+from metrics import LATENCY_BUCKETS
+
+
+def time_operation(operation, operations: int, threads: int = 1) -> float:
+    """Nanoseconds per call, with ``threads`` threads calling concurrently"""
+    per_thread = operations // threads
+    barrier = threading.Barrier(threads + 1)
+
+    def run():
+        barrier.wait()
+        for _ in range(per_thread):
+            operation()
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - started) * 1e9 / (per_thread * threads)
+
+
+def timed_block(histogram):
+    with histogram.time():
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cost of recording and rendering metrics")
+    parser.add_argument("--operations", type=int, default=1000000, help="Calls timed per operation")
+    parser.add_argument("--threads", type=int, default=4, help="Threads for the contended measurement")
+    parser.add_argument("--observations-per-request", type=int, default=8,
+                        help="Values one prediction request records (stages, class counter)")
+    args = parser.parse_args()
+
+    registry = CollectorRegistry()
+    histogram = Histogram("bench_stage_seconds", "Stage latency", ["stage"], buckets=LATENCY_BUCKETS,
+                          registry=registry).labels("decode")
+    counter = Counter("bench_predictions", "Predictions", ["disease"], registry=registry).labels("Cyst")
+    noop = lambda: None
+    operations = {
+        "empty call": noop,
+        "histogram observe": lambda: histogram.observe(0.0042),
+        "timed block": lambda: timed_block(histogram),
+        "counter inc": counter.inc,
+    }
+
+    print(f"{'operation':<18} {'1 thread ns':>12} {f'{args.threads} threads ns':>13}")
+    costs = {}
+    for name, operation in operations.items():
+        costs[name] = time_operation(operation, args.operations)
+        contended = time_operation(operation, args.operations, args.threads)
+        print(f"{name:<18} {costs[name]:>12.0f} {contended:>13.0f}")
+
+    # A full label set: one child per stage and class, as in a running server
+    full = CollectorRegistry()
+    stages = Histogram("kidney_stage_seconds", "Stage latency", ["stage"], buckets=LATENCY_BUCKETS, registry=full)
+    classes = Counter("kidney_predictions", "Predictions", ["disease"], registry=full)
+    for stage in ("read", "decode", "validation", "preprocess", "model_lock_wait", "inference", "serialization"):
+        stages.labels(stage).observe(0.001)
+    for name in ("Cyst", "Normal", "Stone", "Tumor"):
+        classes.labels(name).inc()
+    renders = 2000
+    started = time.perf_counter()
+    for _ in range(renders):
+        body = generate_latest(full)
+    render_us = (time.perf_counter() - started) * 1e6 / renders
+
+    per_request_us = args.observations_per_request * (costs["timed block"] - costs["empty call"]) / 1000
+    print(f"\nRendering /metrics: {render_us:.0f} us ({len(body)} bytes)")
+    print(f"Instrumentation per request ({args.observations_per_request} timed values): {per_request_us:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark: import cost of each module and cold start of the API.
+
+Every module is imported in a fresh interpreter (median of ``--repeats`` runs),
+and the report shows whether importing it pulled in TensorFlow or OpenCV. The
+API is then started with uvicorn and timed until ``/health`` first answers and
+until ``/ready`` reports that the model is loaded and warmed up.
+
+Usage:
+    python benchmark_startup.py
+    MODEL_BACKEND=tflite python benchmark_startup.py --apps main
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_MODULES = ("numpy", "PIL.Image", "cv2", "fastapi", "tensorflow", "preprocessing", "validation",
+                   "responses", "kidney_model", "backends", "inference_engine", "model_service", "main",
+                   "main_optimized")
+
+IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "tensorflow": "tensorflow" in sys.modules, "cv2": "cv2" in sys.modules}}))
+"""
+
+
+def time_import(module: str) -> dict:
+    """Import time of one module in a fresh interpreter"""
+    output = subprocess.run([sys.executable, "-c", IMPORT_PROBE.format(module=module)], cwd=API_DIR,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def wait_for(url: str, process: subprocess.Popen, started: float, timeout: float) -> float:
+    """Seconds from ``started`` until ``url`` answers 200"""
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                response.read()
+                return time.perf_counter() - started
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.05)
+    raise TimeoutError(f"{url} did not answer within {timeout:.0f}s")
+
+
+def time_cold_start(app: str, port: int, timeout: float):
+    """(seconds until /health answers, seconds until /ready answers) for a freshly started server"""
+    command = [sys.executable, "-m", "uvicorn", f"{app}:app", "--app-dir", API_DIR, "--port", str(port),
+               "--log-level", "warning"]
+    started = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        health = wait_for(f"http://127.0.0.1:{port}/health", process, started, timeout)
+        ready = wait_for(f"http://127.0.0.1:{port}/ready", process, started, timeout)
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+    return health, ready
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure module import times and API cold start")
+    parser.add_argument("--modules", nargs="+", default=list(DEFAULT_MODULES))
+    parser.add_argument("--apps", nargs="+", default=["main", "main_optimized"])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    print(f"{'module':<18} {'import s':>9}  pulls in")
+    for module in args.modules:
+        runs = [time_import(module) for _ in range(args.repeats)]
+        heavy = [name for name in ("tensorflow", "cv2") if runs[-1][name]]
+        print(f"{module:<18} {np.median([run['seconds'] for run in runs]):>9.2f}  {', '.join(heavy) or '-'}")
+
+    print(f"\nCold start ({os.getenv('MODEL_BACKEND', 'keras')} backend)")
+    print(f"{'app':<18} {'/health s':>9} {'/ready s':>9}")
+    for app in args.apps:
+        health, ready = time_cold_start(app, args.port, args.timeout)
+        print(f"{app:<18} {health:>9.2f} {ready:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
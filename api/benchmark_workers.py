@@ -0,0 +1,170 @@
+"""
+Benchmark: memory footprint of multi-worker serving.
+
+Starts the API with N workers, sends it prediction requests so that every
+worker has loaded and run its model, then reads each process's memory from
+/proc/<pid>/smaps_rollup (Linux only):
+
+- RSS counts every resident page a process maps, shared or not
+- PSS divides each shared page between the processes mapping it, so the PSS of
+  all processes adds up to the memory the server actually uses
+- USS counts the pages private to one process: what one more worker costs
+
+Two modes are compared:
+
+- ``serve``: ``serve.py``, preforked workers sharing one TFLite model file
+- ``uvicorn``: ``uvicorn main:app --workers N``, each worker importing
+  TensorFlow and loading the model on its own
+
+Usage:
+    python benchmark_workers.py
+    python benchmark_workers.py --workers 1 4 8 --modes serve
+"""
+
+import argparse
+import io
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def server_command(mode: str, app: str, workers: int, port: int) -> List[str]:
+    if mode == "serve":
+        return [sys.executable, os.path.join(API_DIR, "serve.py"), "--app", app,
+                "--workers", str(workers), "--port", str(port), "--log-level", "warning"]
+    return [sys.executable, "-m", "uvicorn", f"{app}:app", "--app-dir", API_DIR,
+            "--workers", str(workers), "--port", str(port), "--log-level", "warning"]
+
+
+def make_jpeg(seed: int) -> bytes:
+    """A distinct grayscale-like JPEG per request, so it passes validation and misses the prediction cache"""
+    gray = np.random.default_rng(seed).integers(40, 220, size=(256, 256), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(gray).convert('RGB').save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float):
+    """Wait for /ready, i.e. until the worker answering it has loaded its model"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"{url}/ready", timeout=5) as response:
+                response.read()
+                return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.5)
+    raise TimeoutError(f"{url} did not become ready within {timeout:.0f}s")
+
+
+def post_image(url: str, body: bytes, attempts: int = 120) -> int:
+    """POST an image, retrying while the worker that accepted it is still loading its model (503)"""
+    request = urllib.request.Request(f"{url}/predict", data=body, headers={"Content-Type": "image/jpeg"})
+    for attempt in range(attempts):
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            if e.code != 503 or attempt == attempts - 1:
+                raise
+            time.sleep(1)
+
+
+def descendants(pid: int) -> List[int]:
+    """All child processes of pid, recursively"""
+    children = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children") as f:
+            children.extend(int(child) for child in f.read().split())
+    return children + [grandchild for child in children for grandchild in descendants(child)]
+
+
+def memory_mb(pid: int) -> Dict[str, float]:
+    """RSS, PSS and USS of one process in MB"""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "uss": fields["Private_Clean"] + fields["Private_Dirty"],
+    }
+
+
+def measure(mode: str, app: str, workers: int, port: int, requests: int, timeout: float,
+            show_logs: bool = False) -> Dict[str, float]:
+    url = f"http://127.0.0.1:{port}"
+    output = None if show_logs else subprocess.DEVNULL
+    process = subprocess.Popen(server_command(mode, app, workers, port), stdout=output, stderr=output)
+    try:
+        wait_until_ready(url, process, timeout)
+        # Enough concurrent requests that every worker accepts some of them
+        with ThreadPoolExecutor(max_workers=2 * workers) as pool:
+            statuses = list(pool.map(lambda seed: post_image(url, make_jpeg(seed)), range(requests)))
+        assert all(status == 200 for status in statuses), statuses
+
+        pids = [pid for pid in descendants(process.pid) if os.path.exists(f"/proc/{pid}/smaps_rollup")]
+        if pids:
+            worker_memory = [memory_mb(pid) for pid in pids]
+            supervisor = memory_mb(process.pid)
+        else:
+            # uvicorn serves a single worker in its own process
+            worker_memory = [memory_mb(process.pid)]
+            supervisor = {"rss": 0.0, "pss": 0.0, "uss": 0.0}
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+
+    return {
+        "worker_rss": float(np.mean([m["rss"] for m in worker_memory])),
+        "worker_pss": float(np.mean([m["pss"] for m in worker_memory])),
+        "worker_uss": float(np.mean([m["uss"] for m in worker_memory])),
+        "total_rss": supervisor["rss"] + sum(m["rss"] for m in worker_memory),
+        "total_pss": supervisor["pss"] + sum(m["pss"] for m in worker_memory),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-worker and total memory of multi-worker serving")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--modes", nargs="+", choices=["serve", "uvicorn"], default=["serve", "uvicorn"])
+    parser.add_argument("--app", default="main", help="Module holding the FastAPI app")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--requests-per-worker", type=int, default=16)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--show-logs", action="store_true", help="Pass the servers' output through")
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes:
+        for workers in args.workers:
+            print(f"Measuring {mode} with {workers} worker(s)...", flush=True)
+            result = measure(mode, args.app, workers, args.port, args.requests_per_worker * workers,
+                             args.startup_timeout, args.show_logs)
+            results.append((mode, workers, result))
+
+    print(f"\n{'mode':<8} {'workers':>7} {'worker RSS':>11} {'worker PSS':>11} {'worker USS':>11} "
+          f"{'total RSS':>10} {'total PSS':>10}   (MB)")
+    for mode, workers, result in results:
+        print(f"{mode:<8} {workers:>7} {result['worker_rss']:>11.0f} {result['worker_pss']:>11.0f} "
+              f"{result['worker_uss']:>11.0f} {result['total_rss']:>10.0f} {result['total_pss']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Offline bulk scoring of whole image directories with KidneyModelService.
+
+Walks a directory tree (for example the notebook's ``CT-Dataset/<split>/<Class>/``
+layout), decodes and preprocesses images on a pool of worker processes, runs
+batched inference in the main process and writes one row per image to a CSV
+file or a directory of Parquet part files.
+
+Interrupted runs can be resumed: images already present in the output are
+skipped and new rows are appended (a CSV row left half-written by a killed
+run is dropped first, and its image scored again).
+
+With ``--compiled DIR`` the dataset is compiled into (or incrementally
+updated in) a dataset cache (see dataset_cache.py) and scored from its
+memory-mapped arrays, without decoding anything that was decoded before.
+
+Usage:
+    python bulk_score.py CT-Dataset --output scores.csv
+    python bulk_score.py CT-Dataset --output scores.parquet --format parquet --workers 16 --batch-size 128
+    python bulk_score.py CT-Dataset --output scores.csv --resume
+    python bulk_score.py CT-Dataset --output scores.csv --compiled ct-cache
+"""
+
+import argparse
+import csv
+import glob
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from typing import Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from dataset import CLASSES, IMAGE_EXTENSIONS, load_image
+from preprocessing import allocate_batch, to_model_input
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ["path", "label", "predicted", "confidence"] + [f"prob_{name.lower()}" for name in CLASSES] + ["error"]
+
+
+def iter_image_paths(root: str, skip: Set[str]) -> Iterator[str]:
+    """Depth-first walk yielding image paths lazily, in a stable order"""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except OSError as e:
+            logger.warning(f"Cannot read {directory}: {e}")
+            continue
+        subdirectories = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+            elif entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.path not in skip:
+                yield entry.path
+        stack.extend(reversed(subdirectories))
+
+
+def decode(path: str) -> Tuple[str, Optional[np.ndarray], Optional[str]]:
+    """Worker-side decode + resize to uint8 (4x less to pickle than float32); errors are returned rather than raised"""
+    try:
+        return path, load_image(path), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def label_for(path: str) -> str:
+    """Class name taken from the parent directory, when it is one of the known classes"""
+    parent = os.path.basename(os.path.dirname(path))
+    return parent if parent in CLASSES else ""
+
+
+class CsvOutput:
+    """Append-only CSV; flushed after every batch so an interrupted run loses nothing already written"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def completed_paths(self) -> Set[str]:
+        """Images scored without error, after dropping a last row a killed run left half-written"""
+        if not os.path.exists(self.path):
+            return set()
+        self._truncate_partial_row()
+        with open(self.path, newline="") as f:
+            return {row["path"] for row in csv.DictReader(f) if not row.get("error")}
+
+    def _truncate_partial_row(self, chunk_size: int = 65536):
+        """Cut the file after its last newline, so a partial row is scored again instead of read back"""
+        with open(self.path, "rb+") as f:
+            end = position = f.seek(0, os.SEEK_END)
+            keep = 0
+            while position > 0:
+                start = max(0, position - chunk_size)
+                f.seek(start)
+                newline = f.read(position - start).rfind(b"\n")
+                if newline >= 0:
+                    keep = start + newline + 1
+                    break
+                position = start
+            if keep < end:
+                logger.warning(f"Dropping a partially written last row of {self.path} ({end - keep} bytes)")
+                f.truncate(keep)
+
+    def open(self):
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, "a", newline="")
+        self._writer = csv.writer(self._file)
+        if new_file:
+            self._writer.writerow(COLUMNS)
+
+    def write(self, rows: List[list]):
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetOutput:
+    """
+    Directory of Parquet part files (readable as one dataset by pandas/pyarrow).
+    Parts are closed every ``rows_per_part`` rows; a part left without a footer by
+    an interrupted run is discarded on resume.
+    """
+
+    def __init__(self, path: str, rows_per_part: int = 50000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("Parquet output needs pyarrow installed (pip install pyarrow)") from e
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.rows_per_part = rows_per_part
+        self.schema = pyarrow.schema(
+            [("path", pyarrow.string()), ("label", pyarrow.string()), ("predicted", pyarrow.string()),
+             ("confidence", pyarrow.float32())]
+            + [(column, pyarrow.float32()) for column in COLUMNS[4:-1]]
+            + [("error", pyarrow.string())]
+        )
+
+    def _parts(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.path, "part-*.parquet")))
+
+    def completed_paths(self) -> Set[str]:
+        done = set()
+        for part in self._parts():
+            try:
+                table = self.pq.read_table(part, columns=["path", "error"])
+            except Exception:
+                logger.warning(f"Discarding incomplete part {part}")
+                os.remove(part)
+                continue
+            for path, error in zip(table.column("path").to_pylist(), table.column("error").to_pylist()):
+                if not error:
+                    done.add(path)
+        return done
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+        self._next_part = len(self._parts())
+        self._writer = None
+        self._rows_in_part = 0
+
+    def write(self, rows: List[list]):
+        if self._writer is None:
+            part = os.path.join(self.path, f"part-{self._next_part:05d}.parquet")
+            self._writer = self.pq.ParquetWriter(part, self.schema)
+            self._next_part += 1
+        columns = list(zip(*rows))
+        self._writer.write_table(self.pa.Table.from_arrays(
+            [self.pa.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+            schema=self.schema,
+        ))
+        self._rows_in_part += len(rows)
+        if self._rows_in_part >= self.rows_per_part:
+            self._close_part()
+
+    def _close_part(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._rows_in_part = 0
+
+    def close(self):
+        self._close_part()
+
+
+def score_batch(service, paths: List[str], images: List[np.ndarray], failures: List[Tuple[str, str]],
+                buffer: np.ndarray) -> List[list]:
+    rows = []
+    if len(images):
+        probabilities = service.predict_batch(to_model_input(images, out=buffer))
+        for path, probs in zip(paths, probabilities):
+            predicted = int(np.argmax(probs))
+            rows.append([path, label_for(path), service.classes[predicted], float(probs[predicted])]
+                        + [float(p) for p in probs] + [""])
+    for path, error in failures:
+        rows.append([path, label_for(path), "", None] + [None] * len(CLASSES) + [error])
+    return rows
+
+
+def score_compiled(service, output, input_dir: str, cache_dir: str, workers: int, batch_size: int,
+                   skip: Set[str], buffer: np.ndarray) -> int:
+    """Score every split of the dataset cache, compiling (or updating) it first; returns the images scored"""
+    from dataset_cache import compile_dataset, list_splits, open_split, read_index
+
+    compile_dataset(input_dir, cache_dir, workers)
+    scored = 0
+    for split in list_splits(cache_dir):
+        compiled = open_split(cache_dir, split)
+        # Paths as a directory walk of input_dir would report them, so --resume works across both modes
+        paths = [os.path.join(input_dir, os.path.relpath(path, os.path.abspath(input_dir))) for path in compiled.paths]
+        rows = [row for row, path in enumerate(paths) if path not in skip]
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            # Consecutive rows (the usual case) are a view of the memory map
+            images = (compiled.images[batch[0]:batch[-1] + 1] if batch[-1] - batch[0] == len(batch) - 1
+                      else compiled.images[batch])
+            output.write(score_batch(service, [paths[row] for row in batch], images, [], buffer))
+            scored += len(batch)
+        # Files that could not be decoded are reported as in a directory walk
+        failures = [(os.path.join(input_dir, name), error) for name, error in read_index(cache_dir, split)["errors"].items()
+                    if os.path.join(input_dir, name) not in skip]
+        if failures:
+            output.write(score_batch(service, [], [], failures, buffer))
+            scored += len(failures)
+    return scored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score every image under a directory tree")
+    parser.add_argument("input_dir", help="Root directory to scan for images (e.g. CT-Dataset)")
+    parser.add_argument("--output", default="scores.csv", help="CSV file, or directory for Parquet parts")
+    parser.add_argument("--format", choices=["csv", "parquet"], default=None,
+                        help="Output format (default: inferred from --output)")
+    parser.add_argument("--resume", action="store_true", help="Skip images already scored in --output")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Decode processes")
+    parser.add_argument("--batch-size", type=int, default=64, help="Images per inference call")
+    parser.add_argument("--backend", default=None, help="Inference backend: keras, tflite or onnx")
+    parser.add_argument("--model", default=None, help="Model file for the chosen backend")
+    parser.add_argument("--log-every", type=float, default=10.0, help="Seconds between progress reports")
+    parser.add_argument("--compiled", metavar="CACHE_DIR",
+                        help="Score from a dataset cache of input_dir in CACHE_DIR (compiled or updated first)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    output_format = args.format or ("parquet" if args.output.endswith(".parquet") else "csv")
+    output = ParquetOutput(args.output) if output_format == "parquet" else CsvOutput(args.output)
+
+    if os.path.exists(args.output) and not args.resume:
+        print(f"Error: {args.output} already exists (use --resume to continue it)")
+        sys.exit(1)
+    skip = output.completed_paths() if args.resume else set()
+    if skip:
+        logger.info(f"Resuming: {len(skip)} images already scored")
+
+    # Imported here so spawned decode workers never load TensorFlow or the model
+    from model_service import KidneyModelService
+    service = KidneyModelService(backend=args.backend, model_path=args.model)
+
+    output.open()
+    buffer = allocate_batch(args.batch_size)
+    scored = 0
+    started = last_report = time.perf_counter()
+    # Spawned (not forked) workers: forking after TensorFlow has started its threads is unsafe
+    context = multiprocessing.get_context("spawn")
+    try:
+        if args.compiled:
+            scored = score_compiled(service, output, args.input_dir, args.compiled, args.workers, args.batch_size,
+                                    skip, buffer)
+        else:
+            with context.Pool(processes=max(1, args.workers)) as pool:
+                paths, images, failures = [], [], []
+                decoded = pool.imap(decode, iter_image_paths(args.input_dir, skip), chunksize=16)
+                for path, image, error in decoded:
+                    if error is None:
+                        paths.append(path)
+                        images.append(image)
+                    else:
+                        failures.append((path, error))
+                    if len(paths) + len(failures) >= args.batch_size:
+                        output.write(score_batch(service, paths, images, failures, buffer))
+                        scored += len(paths) + len(failures)
+                        paths, images, failures = [], [], []
+
+                    now = time.perf_counter()
+                    if now - last_report >= args.log_every:
+                        logger.info(f"{scored} images scored, {scored / (now - started):.1f} images/s")
+                        last_report = now
+
+                if paths or failures:
+                    output.write(score_batch(service, paths, images, failures, buffer))
+                    scored += len(paths) + len(failures)
+    finally:
+        output.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Scored {scored} images in {elapsed:.1f}s ({scored / elapsed if elapsed else 0:.1f} images/s) -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Parity check between the serving preprocessing and the notebook's training transform.
+
+Every image is run through ``preprocessing.preprocess_batch`` and through
+``cv2.imread`` + ``cv2.resize`` as in the notebook. Images decoded at full
+resolution must match exactly; images large enough to be draft-decoded may only
+differ by ``--draft-tolerance`` (mean absolute difference on the 0-255 scale).
+Exits with a non-zero code on any mismatch.
+
+Synthetic images cover grayscale, RGBA PNG, EXIF-rotated and draft-decoded
+inputs (also run by test_preprocessing.py); pass ``--data-dir`` to also check
+real images from the dataset split.
+
+Usage:
+    python check_preprocessing.py
+    python check_preprocessing.py --data-dir CT-Dataset --limit 500
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from dataset import list_split
+from preprocessing import DRAFT_MIN_SIZE, allocate_batch, preprocess_batch, preprocess_image, training_transform
+
+
+def synthetic_image(width: int, height: int, mode: str = "RGB") -> Image.Image:
+    """Smooth colour gradients, so resampling differences show up in the check"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    channels = [127 + 60 * np.sin(x / 23.0), 127 + 60 * np.cos(y / 31.0), (x + y) % 256]
+    image = Image.fromarray(np.stack(channels, axis=-1).astype(np.uint8))
+    return image.convert(mode)
+
+
+def write_synthetic_cases(directory: str):
+    """(name, path) of synthetic images covering each decode path"""
+    cases = []
+
+    def save(name: str, image: Image.Image, **kwargs):
+        path = os.path.join(directory, name)
+        image.save(path, **kwargs)
+        cases.append((name, path))
+
+    save("rgb_512.jpg", synthetic_image(512, 512), quality=90)
+    save("rgb_300x200.png", synthetic_image(300, 200))
+    save("gray_512.jpg", synthetic_image(512, 512, "L"), quality=90)
+    save("rgba_256.png", synthetic_image(256, 256, "RGBA"))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotate 90 degrees clockwise
+    save("exif_rotated_640x480.jpg", synthetic_image(640, 480), quality=90, exif=exif)
+    save("draft_4000x3000.jpg", synthetic_image(4000, 3000), quality=90)
+    return cases
+
+
+def is_draft_decoded(path: str) -> bool:
+    with Image.open(path) as image:
+        return image.format == "JPEG" and min(image.size) >= 2 * DRAFT_MIN_SIZE
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check serving preprocessing against the training transform")
+    parser.add_argument("--data-dir", default=None, help="Dataset root with train/ and test/ splits")
+    parser.add_argument("--limit", type=int, default=200, help="Dataset images to check")
+    parser.add_argument("--draft-tolerance", type=float, default=2.0,
+                        help="Allowed mean absolute difference for draft-decoded JPEGs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cases = write_synthetic_cases(directory)
+        if args.data_dir:
+            paths = []
+            for split in ("train", "test"):
+                paths.extend(list_split(args.data_dir, split)[0])
+            cases.extend((os.path.relpath(path, args.data_dir), path) for path in paths[:args.limit])
+
+        # All cases go through one reused buffer, as the batch callers do
+        batch = preprocess_batch([path for _, path in cases], out=allocate_batch(len(cases) + 8))
+
+        failures = 0
+        for (name, path), served in zip(cases, batch):
+            reference = training_transform(path)
+            difference = np.abs(served - reference)
+            draft = is_draft_decoded(path)
+            single = preprocess_image(path)[0]
+            ok = (difference.mean() <= args.draft_tolerance if draft else difference.max() == 0) \
+                and np.array_equal(single, served)
+            failures += not ok
+            if not ok or not args.data_dir or draft:
+                print(f"{'OK  ' if ok else 'FAIL'} {name}: max diff {difference.max():.0f}, "
+                      f"mean diff {difference.mean():.3f}{' (draft decoded)' if draft else ''}")
+
+    print(f"\n{len(cases) - failures}/{len(cases)} images match the training transform")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
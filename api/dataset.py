@@ -0,0 +1,44 @@
+"""
+Helpers for the CT dataset layout produced by the notebook's split step:
+
+    CT-Dataset/
+        train/<Class>/*.jpg
+        test/<Class>/*.jpg
+"""
+
+import os
+from typing import List, Tuple
+
+import numpy as np
+
+from kidney_model import CLASSES
+from preprocessing import IMGSIZE, decode_image, preprocess_batch, resize_uint8
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+
+def list_split(data_dir: str, split: str) -> Tuple[List[str], np.ndarray]:
+    """Image paths and class indices of one split, in a stable order"""
+    paths, labels = [], []
+    split_dir = os.path.join(data_dir, split)
+    if not os.path.isdir(split_dir):
+        raise FileNotFoundError(f"Split directory not found: {split_dir}")
+    for label, class_name in enumerate(CLASSES):
+        class_dir = os.path.join(split_dir, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        for name in sorted(os.listdir(class_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(class_dir, name))
+                labels.append(label)
+    return paths, np.array(labels, dtype=np.int64)
+
+
+def load_image(path: str) -> np.ndarray:
+    """Load one image as the resized uint8 array the API feeds the model (see preprocessing.py)"""
+    return resize_uint8(decode_image(path))
+
+
+def load_images(paths: List[str]) -> np.ndarray:
+    """Preprocessed (N, IMGSIZE, IMGSIZE, 3) float32 model input for a list of image files"""
+    return preprocess_batch(paths)
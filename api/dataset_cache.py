@@ -0,0 +1,259 @@
+"""
+Compiled dataset cache: the preprocessed CT dataset in memory-mappable files.
+
+Compiling decodes and resizes every image once (with the API's transform, see
+preprocessing.py) and stores each split of the ``<split>/<Class>/`` layout as:
+
+    <cache_dir>/
+        train-<generation>.npy   # (N, IMGSIZE, IMGSIZE, 3) uint8 BGR, one row per image
+        train.index.json         # per row: file name, class, mtime, size and SHA-1
+        test-<generation>.npy
+        test.index.json
+
+Training, evaluation and bulk scoring open the ``.npy`` files with
+``np.load(mmap_mode="r")``: no decoding, no copy, and the OS page cache is
+shared between processes.
+
+Recompiling only decodes what changed. A file whose mtime and size match the
+index is reused as is. A file whose mtime or size changed is hashed, and it is
+decoded again only if its SHA-1 differs (``--verify`` hashes every file). New
+files are decoded, and removed ones dropped. Changed rows are rewritten in
+place. When files are added or removed, a new generation of the ``.npy`` file
+is assembled from the old rows and the newly decoded ones. The index is
+replaced last, so an interrupted compile leaves the previous cache intact.
+
+Usage:
+    python dataset_cache.py CT-Dataset --output ct-cache
+    python dataset_cache.py CT-Dataset --output ct-cache --verify --workers 8
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from dataset import CLASSES, list_split
+from preprocessing import INPUT_SHAPE, PREPROCESSING_VERSION, decode_image, resize_uint8
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT = 1
+
+
+class CompiledSplit(NamedTuple):
+    """A split of a compiled dataset cache"""
+    images: np.ndarray  # Read-only memmap, (N, IMGSIZE, IMGSIZE, 3) uint8
+    labels: np.ndarray  # (N,) int64 class indices
+    paths: List[str]  # Source image of each row, under the dataset root
+
+
+def index_path(cache_dir: str, split: str) -> str:
+    return os.path.join(cache_dir, f"{split}.index.json")
+
+
+def read_index(cache_dir: str, split: str) -> Optional[Dict[str, Any]]:
+    """Index of a compiled split, or None if there is none compiled with the current transform"""
+    try:
+        with open(index_path(cache_dir, split)) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (index.get("format") != INDEX_FORMAT or index.get("preprocessing_version") != PREPROCESSING_VERSION
+            or tuple(index.get("image_shape", ())) != INPUT_SHAPE or index.get("classes") != CLASSES):
+        return None
+    return index
+
+
+def list_splits(cache_dir: str) -> List[str]:
+    """Splits compiled in a cache directory"""
+    suffix = ".index.json"
+    return sorted(name[:-len(suffix)] for name in os.listdir(cache_dir) if name.endswith(suffix))
+
+
+def open_split(cache_dir: str, split: str) -> CompiledSplit:
+    """Memory-map a compiled split; rows are only read from disk when they are used"""
+    index = read_index(cache_dir, split)
+    if index is None:
+        raise FileNotFoundError(f"No compiled '{split}' split in {cache_dir} (run dataset_cache.py)")
+    images = np.load(os.path.join(cache_dir, index["data"]), mmap_mode="r")
+    labels = np.array([entry["label"] for entry in index["files"]], dtype=np.int64)
+    paths = [os.path.join(index["root"], entry["path"]) for entry in index["files"]]
+    return CompiledSplit(images, labels, paths)
+
+
+def file_sha1(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def load_file(task: Tuple[str, Optional[str]]) -> Tuple[str, Optional[str], Optional[np.ndarray], Optional[str]]:
+    """
+    Worker: (path, sha1, image, error) for one file. The image is None when the
+    file's SHA-1 equals the expected one (unchanged) or it cannot be decoded.
+    """
+    path, expected_sha1 = task
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        sha1 = file_sha1(data)
+        if sha1 == expected_sha1:
+            return path, sha1, None, None
+        return path, sha1, resize_uint8(decode_image(data)), None
+    except Exception as e:
+        return path, None, None, str(e)
+
+
+def discover_splits(root: str) -> List[str]:
+    """Sub-directories of the dataset root holding at least one class folder"""
+    splits = []
+    for name in sorted(os.listdir(root)):
+        if any(os.path.isdir(os.path.join(root, name, class_name)) for class_name in CLASSES):
+            splits.append(name)
+    if not splits:
+        raise FileNotFoundError(f"No <split>/<Class>/ folders under {root}")
+    return splits
+
+
+def compile_split(root: str, split: str, cache_dir: str, pool, verify: bool = False) -> Dict[str, int]:
+    """Bring one split of the cache up to date with the image files; returns what was done"""
+    paths, labels = list_split(root, split)
+    names = [os.path.relpath(path, root) for path in paths]
+    old_index = read_index(cache_dir, split)
+    old_entries = {entry["path"]: (row, entry) for row, entry in enumerate(old_index["files"])} if old_index else {}
+    stats = {"files": len(paths), "reused": 0, "hashed": 0, "decoded": 0, "failed": 0, "removed": 0}
+
+    # Which files need reading: new ones, and known ones whose mtime or size changed (or every one with verify)
+    file_stats, tasks = {}, []
+    for path, name in zip(paths, names):
+        stat = os.stat(path)
+        file_stats[name] = (stat.st_mtime_ns, stat.st_size)
+        old = old_entries.get(name)
+        if old is not None and not verify and (old[1]["mtime_ns"], old[1]["size"]) == file_stats[name]:
+            continue
+        tasks.append((path, old[1]["sha1"] if old is not None else None))
+
+    # Decode into a staging memmap on disk, so memory stays bounded however many files changed
+    decoded_rows: Dict[str, int] = {}
+    sha1s: Dict[str, str] = {}
+    errors: Dict[str, str] = {}
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=cache_dir, prefix=".staging-") as staging_dir:
+        staging = np.lib.format.open_memmap(os.path.join(staging_dir, "staging.npy"), mode="w+", dtype=np.uint8,
+                                            shape=(max(1, len(tasks)),) + INPUT_SHAPE)
+        for path, sha1, image, error in pool.imap(load_file, tasks, chunksize=16):
+            name = os.path.relpath(path, root)
+            if error is not None:
+                errors[name] = error
+                continue
+            sha1s[name] = sha1
+            if image is None:
+                stats["hashed"] += 1  # Touched but identical
+            else:
+                decoded_rows[name] = len(decoded_rows)
+                staging[decoded_rows[name]] = image
+
+        # Rows of the new layout: every file that decoded (now or in an earlier compile), in list order
+        rows, files = [], []
+        for name, label in zip(names, labels):
+            old = old_entries.get(name)
+            if name in errors:
+                continue
+            if name in decoded_rows:
+                source = ("staging", decoded_rows[name])
+            elif old is not None:
+                source = ("old", old[0])
+            else:
+                continue
+            mtime_ns, size = file_stats[name]
+            rows.append(source)
+            files.append({"path": name, "label": int(label), "mtime_ns": mtime_ns, "size": size,
+                          "sha1": sha1s.get(name, old[1]["sha1"] if old is not None else None)})
+        stats["decoded"] = len(decoded_rows)
+        stats["failed"] = len(errors)
+        stats["reused"] = sum(1 for source, _ in rows if source == "old")
+        stats["removed"] = sum(1 for name in old_entries if name not in file_stats)
+
+        old_data = os.path.join(cache_dir, old_index["data"]) if old_index else None
+        same_layout = old_index is not None and [entry["path"] for entry in old_index["files"]] == [
+            entry["path"] for entry in files]
+        if same_layout:
+            # Only contents changed: rewrite those rows in place
+            generation = old_index["generation"]
+            data_name = old_index["data"]
+            if decoded_rows:
+                target = np.load(old_data, mmap_mode="r+")
+                for row, (source, source_row) in enumerate(rows):
+                    if source == "staging":
+                        target[row] = staging[source_row]
+                target.flush()
+                del target
+        else:
+            # Files were added or removed: assemble a new generation from the old rows and the staged ones
+            generation = old_index["generation"] + 1 if old_index else 0
+            data_name = f"{split}-{generation:06d}.npy"
+            old_images = np.load(old_data, mmap_mode="r") if old_index else None
+            target = np.lib.format.open_memmap(os.path.join(cache_dir, data_name), mode="w+", dtype=np.uint8,
+                                               shape=(len(rows),) + INPUT_SHAPE)
+            for row, (source, source_row) in enumerate(rows):
+                target[row] = staging[source_row] if source == "staging" else old_images[source_row]
+            target.flush()
+            del target, old_images
+        del staging
+
+    index = {
+        "format": INDEX_FORMAT,
+        "preprocessing_version": PREPROCESSING_VERSION,
+        "image_shape": list(INPUT_SHAPE),
+        "classes": CLASSES,
+        "root": os.path.abspath(root),
+        "split": split,
+        "generation": generation,
+        "data": data_name,
+        "files": files,
+        "errors": errors,
+    }
+    # The index is the commit point: written atomically, after the data it points to
+    staging_index = index_path(cache_dir, split) + ".tmp"
+    with open(staging_index, "w") as f:
+        json.dump(index, f)
+    os.replace(staging_index, index_path(cache_dir, split))
+    if old_index is not None and old_index["data"] != data_name:
+        os.remove(old_data)
+    return stats
+
+
+def compile_dataset(root: str, cache_dir: str, workers: int = os.cpu_count() or 1,
+                    verify: bool = False) -> Dict[str, Dict[str, int]]:
+    """Compile (or incrementally update) the cache of every split under root"""
+    # Spawned like bulk_score.py's decoders, so they are safe to start from a process running TensorFlow
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=max(1, workers)) as pool:
+        return {split: compile_split(root, split, cache_dir, pool, verify) for split in discover_splits(root)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the dataset into memory-mappable preprocessed arrays")
+    parser.add_argument("data_dir", help="Dataset root holding <split>/<Class>/ folders (e.g. CT-Dataset)")
+    parser.add_argument("--output", default="dataset-cache", help="Cache directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Decode processes")
+    parser.add_argument("--verify", action="store_true", help="Hash every file instead of trusting mtime and size")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    started = time.perf_counter()
+    results = compile_dataset(args.data_dir, args.output, args.workers, args.verify)
+    elapsed = time.perf_counter() - started
+    for split, stats in results.items():
+        print(f"{split:<8} {stats['files']:>7} files: {stats['reused']} reused, {stats['decoded']} decoded, "
+              f"{stats['hashed']} unchanged after hashing, {stats['removed']} removed, {stats['failed']} failed")
+    print(f"Compiled {args.data_dir} into {args.output} in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
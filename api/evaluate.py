@@ -0,0 +1,400 @@
+"""
+Evaluate a model on a held-out split and gate its promotion.
+
+Runs batched inference over one split of the ``<split>/<Class>/`` layout
+(decoded on a pool of worker processes, or read from a cache compiled by
+dataset_cache.py) with any inference backend, and reports:
+
+- accuracy, the confusion matrix and per-class precision, recall and F1
+- calibration: the reliability curve of the top-class confidence with its
+  expected and maximum calibration error, and a one-vs-rest curve per class
+- log loss, and the latency per batch and per image
+
+Every statistic is accumulated batch by batch from fixed-size counts
+(``np.bincount`` over the batch), so memory does not grow with the number of
+images and hundreds of thousands of images need no more than a few batches.
+
+The report is written as JSON. With gate options (``--min-accuracy``,
+``--min-recall``, ``--baseline``) the exit code is non-zero when the model
+fails any of them, or when its train.py metadata sidecar is missing or lists
+other classes or preprocessing; ``--promote PATH`` copies a model that passes
+(and its sidecar) to PATH, atomically, e.g. to ``kidney_model.h5``.
+
+Usage:
+    python evaluate.py CT-Dataset --model kidney_model.h5
+    python evaluate.py CT-Dataset --compiled-dir ct-cache --model kidney_model_int8.tflite --report int8.json
+    python evaluate.py CT-Dataset --model candidate.h5 --min-accuracy 0.97 --baseline current.json \\
+        --promote kidney_model.h5
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from bulk_score import decode
+from dataset import CLASSES, list_split
+from kidney_model import METADATA_FORMAT, metadata_path
+from preprocessing import INPUT_SHAPE, PREPROCESSING_VERSION, allocate_batch, to_model_input
+
+logger = logging.getLogger(__name__)
+
+REPORT_FORMAT = 1
+CALIBRATION_BINS = 10
+# Probabilities are clipped before the log so a confident mistake costs a finite loss
+LOG_LOSS_EPSILON = 1e-7
+
+
+class Evaluation:
+    """Running counts of a classification evaluation, updated one batch at a time"""
+
+    def __init__(self, num_classes: int = len(CLASSES), bins: int = CALIBRATION_BINS):
+        self.num_classes = num_classes
+        self.bins = bins
+        self.confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+        # Top-class confidence per bin: images, summed confidence, correct predictions
+        self.confidence_count = np.zeros(bins, dtype=np.int64)
+        self.confidence_sum = np.zeros(bins)
+        self.confidence_correct = np.zeros(bins, dtype=np.int64)
+        # One-vs-rest, per (bin, class): predictions, summed probability, images of that class
+        self.class_count = np.zeros((bins, num_classes), dtype=np.int64)
+        self.class_probability_sum = np.zeros((bins, num_classes))
+        self.class_positives = np.zeros((bins, num_classes), dtype=np.int64)
+        self.log_loss_sum = 0.0
+        self.batch_seconds: List[float] = []
+        self.batch_sizes: List[int] = []
+        self.failures: Dict[str, str] = {}
+
+    def _bin(self, probabilities: np.ndarray) -> np.ndarray:
+        return np.minimum((probabilities * self.bins).astype(np.int64), self.bins - 1)
+
+    def update(self, probabilities: np.ndarray, labels: np.ndarray):
+        """Add one batch of (N, classes) probabilities and their (N,) true class indices"""
+        k, bins = self.num_classes, self.bins
+        rows = np.arange(len(labels))
+        predicted = probabilities.argmax(axis=1)
+        self.confusion += np.bincount(labels * k + predicted, minlength=k * k).reshape(k, k)
+
+        confidence = probabilities[rows, predicted]
+        confidence_bin = self._bin(confidence)
+        self.confidence_count += np.bincount(confidence_bin, minlength=bins)
+        self.confidence_sum += np.bincount(confidence_bin, weights=confidence, minlength=bins)
+        self.confidence_correct += np.bincount(confidence_bin, weights=predicted == labels,
+                                               minlength=bins).astype(np.int64)
+
+        # Flat (bin, class) cell of every probability in the batch
+        cells = (self._bin(probabilities) * k + np.arange(k)).ravel()
+        self.class_count += np.bincount(cells, minlength=bins * k).reshape(bins, k)
+        self.class_probability_sum += np.bincount(cells, weights=probabilities.ravel(),
+                                                  minlength=bins * k).reshape(bins, k)
+        positives = (labels[:, None] == np.arange(k)).ravel()
+        self.class_positives += np.bincount(cells, weights=positives, minlength=bins * k).reshape(
+            bins, k).astype(np.int64)
+
+        true_probability = np.clip(probabilities[rows, labels], LOG_LOSS_EPSILON, 1.0)
+        self.log_loss_sum += float(-np.log(true_probability).sum())
+
+    @property
+    def images(self) -> int:
+        return int(self.confusion.sum())
+
+    def calibration(self) -> Dict[str, Any]:
+        """Reliability curves; a bin's accuracy equals its mean confidence for a calibrated model"""
+        count = np.maximum(self.confidence_count, 1)
+        accuracy = self.confidence_correct / count
+        confidence = self.confidence_sum / count
+        gaps = np.abs(accuracy - confidence)
+        used = self.confidence_count > 0
+        class_count = np.maximum(self.class_count, 1)
+        edges = np.linspace(0.0, 1.0, self.bins + 1)
+        return {
+            "bins": edges.tolist(),
+            "expected_calibration_error": float((gaps * self.confidence_count).sum() / max(1, self.images)),
+            "max_calibration_error": float(gaps[used].max()) if used.any() else 0.0,
+            "confidence": {
+                "count": self.confidence_count.tolist(),
+                "mean_confidence": [float(value) if n else None for value, n in zip(confidence,
+                                                                                    self.confidence_count)],
+                "accuracy": [float(value) if n else None for value, n in zip(accuracy, self.confidence_count)],
+            },
+            "per_class": {
+                name: {
+                    "count": self.class_count[:, i].tolist(),
+                    "mean_probability": [float(self.class_probability_sum[b, i] / class_count[b, i])
+                                         if self.class_count[b, i] else None for b in range(self.bins)],
+                    "fraction_positive": [float(self.class_positives[b, i] / class_count[b, i])
+                                          if self.class_count[b, i] else None for b in range(self.bins)],
+                }
+                for i, name in enumerate(CLASSES[:self.num_classes])
+            },
+        }
+
+    def latency(self) -> Dict[str, Any]:
+        if not self.batch_seconds:
+            return {}
+        batch_ms = np.array(self.batch_seconds) * 1000.0
+        total_seconds = float(np.sum(self.batch_seconds))
+        return {
+            "batches": len(batch_ms),
+            "batch_ms": {"mean": float(batch_ms.mean()), "p50": float(np.percentile(batch_ms, 50)),
+                         "p99": float(np.percentile(batch_ms, 99))},
+            "ms_per_image": total_seconds * 1000.0 / max(1, sum(self.batch_sizes)),
+            "images_per_second": sum(self.batch_sizes) / total_seconds if total_seconds else None,
+        }
+
+    def results(self) -> Dict[str, Any]:
+        matrix = self.confusion
+        true_positives = np.diag(matrix)
+        support = matrix.sum(axis=1)
+        predicted = matrix.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            precision = true_positives / predicted
+            recall = true_positives / support
+            # Same as 2PR / (P + R), and 0 rather than undefined for a class that is never predicted
+            f1 = 2 * true_positives / (predicted + support)
+
+        def value(x):
+            return None if np.isnan(x) else float(x)
+
+        return {
+            "images": self.images,
+            "failed": len(self.failures),
+            "accuracy": float(true_positives.sum() / max(1, self.images)),
+            "log_loss": self.log_loss_sum / max(1, self.images),
+            "per_class": {
+                name: {"precision": value(precision[i]), "recall": value(recall[i]), "f1": value(f1[i]),
+                       "support": int(support[i])}
+                for i, name in enumerate(CLASSES[:self.num_classes])
+            },
+            "macro_f1": value(np.nanmean(f1)) if not np.isnan(f1).all() else None,
+            "confusion_matrix": matrix.tolist(),
+            "calibration": self.calibration(),
+            "latency": self.latency(),
+            "failures": self.failures,
+        }
+
+
+def iter_file_batches(data_dir: str, split: str, batch_size: int, workers: int,
+                      evaluation: Evaluation) -> Iterator[Tuple[List[np.ndarray], np.ndarray]]:
+    """(uint8 images, labels) batches of a split's image files, decoded on worker processes"""
+    paths, labels = list_split(data_dir, split)
+    label_of = dict(zip(paths, labels))
+    # Spawned, like bulk_score.py's decoders, so they never inherit TensorFlow's threads
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=max(1, workers)) as pool:
+        images, batch_labels = [], []
+        for path, image, error in pool.imap(decode, paths, chunksize=16):
+            if error is not None:
+                evaluation.failures[path] = error
+                continue
+            images.append(image)
+            batch_labels.append(label_of[path])
+            if len(images) == batch_size:
+                yield images, np.array(batch_labels, dtype=np.int64)
+                images, batch_labels = [], []
+        if images:
+            yield images, np.array(batch_labels, dtype=np.int64)
+
+
+def iter_compiled_batches(compiled_dir: str, split: str, batch_size: int,
+                          evaluation: Evaluation) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """(uint8 images, labels) batches of a compiled split: consecutive rows, i.e. views of the memory map"""
+    from dataset_cache import open_split, read_index
+
+    compiled = open_split(compiled_dir, split)
+    evaluation.failures.update(read_index(compiled_dir, split)["errors"])
+    for start in range(0, len(compiled.labels), batch_size):
+        yield compiled.images[start:start + batch_size], compiled.labels[start:start + batch_size]
+
+
+def evaluate(backend, batches, evaluation: Evaluation, batch_size: int) -> Evaluation:
+    """Run the backend over every batch and accumulate the results"""
+    buffer = allocate_batch(batch_size)
+    for images, labels in batches:
+        batch = to_model_input(images, out=buffer)
+        started = time.perf_counter()
+        probabilities = np.asarray(backend.predict(batch), dtype=np.float64)
+        evaluation.batch_seconds.append(time.perf_counter() - started)
+        evaluation.batch_sizes.append(len(labels))
+        evaluation.update(probabilities, labels)
+    return evaluation
+
+
+def read_metadata(model_path: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """train.py's metadata sidecar of a model, or None and why it could not be read"""
+    path = metadata_path(model_path)
+    try:
+        with open(path) as f:
+            metadata = json.load(f)
+    except FileNotFoundError:
+        return None, f"no metadata sidecar {path} (written by train.py)"
+    except (OSError, ValueError) as e:
+        return None, f"unreadable metadata sidecar {path}: {e}"
+    if not isinstance(metadata, dict):
+        return None, f"metadata sidecar {path} is not a JSON object"
+    return metadata, None
+
+
+def gate(results: Dict[str, Any], metadata: Optional[Dict[str, Any]], metadata_error: Optional[str],
+         require_metadata: bool, min_accuracy: Optional[float], min_recall: Optional[float],
+         baseline: Optional[Dict[str, Any]], max_accuracy_drop: float) -> List[str]:
+    """Reasons the model must not be promoted (none when it passes)"""
+    failures = []
+    if not results["images"]:
+        failures.append("no images were evaluated")
+    if metadata is None:
+        # Without its metadata, nothing says the model was trained on these classes and this preprocessing
+        if require_metadata:
+            failures.append(metadata_error)
+    elif metadata.get("format") != METADATA_FORMAT:
+        failures.append(f"metadata format {metadata.get('format')} is not {METADATA_FORMAT}")
+    else:
+        if metadata.get("classes") != CLASSES:
+            failures.append(f"model classes {metadata.get('classes')} differ from {CLASSES}")
+        if metadata.get("preprocessing", {}).get("version") != PREPROCESSING_VERSION:
+            failures.append(f"model was trained with preprocessing version "
+                            f"{metadata.get('preprocessing', {}).get('version')}, the API uses {PREPROCESSING_VERSION}")
+    if min_accuracy is not None and results["accuracy"] < min_accuracy:
+        failures.append(f"accuracy {results['accuracy']:.4f} is below {min_accuracy:.4f}")
+    if min_recall is not None:
+        for name, stats in results["per_class"].items():
+            if stats["support"] and stats["recall"] < min_recall:
+                failures.append(f"{name} recall {stats['recall']:.4f} is below {min_recall:.4f}")
+    if baseline is not None:
+        drop = baseline["accuracy"] - results["accuracy"]
+        if drop > max_accuracy_drop:
+            failures.append(f"accuracy is {drop:.4f} below the baseline's {baseline['accuracy']:.4f} "
+                            f"(allowed {max_accuracy_drop:.4f})")
+    return failures
+
+
+def promote(model_path: str, target: str):
+    """Copy the model (and its metadata) to target, each staged next to it and renamed into place"""
+    directory = os.path.dirname(os.path.abspath(target))
+    os.makedirs(directory, exist_ok=True)
+    # The model last, so whoever sees it also finds its metadata (the gate made sure there is one)
+    for source, destination in [(metadata_path(model_path), metadata_path(target)), (model_path, target)]:
+        with tempfile.NamedTemporaryFile(dir=directory, suffix=os.path.splitext(destination)[1],
+                                         delete=False) as f:
+            staged = f.name
+        try:
+            shutil.copyfile(source, staged)
+            os.replace(staged, destination)
+        finally:
+            if os.path.exists(staged):
+                os.remove(staged)
+
+
+def print_summary(results: Dict[str, Any]):
+    latency = results["latency"]
+    print(f"\n{results['images']} images ({results['failed']} failed): accuracy {results['accuracy']:.4f}, "
+          f"log loss {results['log_loss']:.4f}, ECE {results['calibration']['expected_calibration_error']:.4f}")
+    if latency:
+        print(f"Latency: {latency['ms_per_image']:.2f} ms/image, batch p50 {latency['batch_ms']['p50']:.1f} ms / "
+              f"p99 {latency['batch_ms']['p99']:.1f} ms, {latency['images_per_second']:.0f} images/s")
+    print(f"  {'class':<7} {'precision':>9} {'recall':>7} {'f1':>7} {'support':>8}")
+    for name, stats in results["per_class"].items():
+        cells = [f"{stats[key]:.4f}" if stats[key] is not None else "n/a" for key in ("precision", "recall", "f1")]
+        print(f"  {name:<7} {cells[0]:>9} {cells[1]:>7} {cells[2]:>7} {stats['support']:>8}")
+    print("  confusion matrix (rows = actual, columns = predicted):")
+    for name, row in zip(CLASSES, results["confusion_matrix"]):
+        print(f"  {name:<7} {row}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a model on a held-out split, optionally as a promotion gate")
+    parser.add_argument("data_dir", help="Dataset root holding <split>/<Class>/ folders (e.g. CT-Dataset)")
+    parser.add_argument("--split", default="test")
+    parser.add_argument("--compiled-dir", help="Read the split compiled by dataset_cache.py in this directory")
+    parser.add_argument("--model", default="kidney_model.h5")
+    parser.add_argument("--backend", help="keras, tflite or onnx (default: from the model file extension)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Decode processes")
+    parser.add_argument("--report", default="evaluation_report.json")
+    parser.add_argument("--min-accuracy", type=float, help="Fail when accuracy is lower")
+    parser.add_argument("--min-recall", type=float, help="Fail when any class's recall is lower")
+    parser.add_argument("--baseline", help="Report of the model in service; fail when accuracy drops further than "
+                                           "--max-accuracy-drop below it")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.0)
+    parser.add_argument("--promote", metavar="PATH", help="Copy the model to PATH if it passes the gate")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not os.path.exists(args.model):
+        print(f"Error: {args.model} not found")
+        sys.exit(1)
+    backend_name = args.backend or {".tflite": "tflite", ".onnx": "onnx"}.get(
+        os.path.splitext(args.model)[1].lower(), "keras")
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    # Imported here so spawned decode workers never load an inference runtime
+    from backends import create_backend
+    backend = create_backend(backend_name, args.model, batch_buckets=(args.batch_size,))
+    backend.warmup()
+
+    evaluation = Evaluation()
+    try:
+        if args.compiled_dir:
+            batches = iter_compiled_batches(args.compiled_dir, args.split, args.batch_size, evaluation)
+        else:
+            batches = iter_file_batches(args.data_dir, args.split, args.batch_size, args.workers, evaluation)
+        started = time.perf_counter()
+        evaluate(backend, batches, evaluation, args.batch_size)
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    elapsed = time.perf_counter() - started
+
+    results = evaluation.results()
+    metadata, metadata_error = read_metadata(args.model)
+    gating = bool(args.promote or args.baseline or args.min_accuracy is not None or args.min_recall is not None)
+    failures = gate(results, metadata, metadata_error, gating, args.min_accuracy, args.min_recall, baseline,
+                    args.max_accuracy_drop)
+    report = {
+        "format": REPORT_FORMAT,
+        "model": os.path.abspath(args.model),
+        "model_version": backend.version,
+        "backend": backend_name,
+        "split": args.split,
+        "source": os.path.abspath(args.compiled_dir or args.data_dir),
+        "input_shape": list(INPUT_SHAPE),
+        "preprocessing_version": PREPROCESSING_VERSION,
+        "classes": CLASSES,
+        "batch_size": args.batch_size,
+        "seconds": elapsed,
+        "results": results,
+        "gate": {
+            "min_accuracy": args.min_accuracy,
+            "min_recall": args.min_recall,
+            "baseline": args.baseline,
+            "max_accuracy_drop": args.max_accuracy_drop,
+            "passed": not failures,
+            "failures": failures,
+        },
+    }
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_summary(results)
+    print(f"Evaluated in {elapsed:.1f}s; report written to {args.report}")
+    if failures:
+        print("Gate failed:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    if args.promote:
+        promote(args.model, args.promote)
+        print(f"Gate passed: {args.model} promoted to {args.promote}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Execution model for the prediction endpoints.
+
+Image decoding, validation and preprocessing are CPU-bound and run on a
+bounded thread pool so they never block the asyncio event loop. Inference runs
+on the batch scheduler's dedicated worker thread (see ``batching.py``). An
+in-flight limiter provides backpressure: once ``MAX_IN_FLIGHT`` prediction
+requests are being processed, new ones are rejected with 503 and a
+``Retry-After`` header instead of piling up in memory.
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", str(min(8, os.cpu_count() or 1))))
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "64"))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "1"))
+
+preprocess_executor = ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS, thread_name_prefix="preprocess")
+
+
+async def run_in_pool(fn: Callable[..., Any], *args: Any) -> Any:
+    """Run a CPU-bound function on the preprocessing pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(preprocess_executor, fn, *args)
+
+
+def shutdown_pool():
+    """Stop accepting new work on the preprocessing pool"""
+    preprocess_executor.shutdown(wait=False)
+
+
+class InFlightLimiter:
+    """Async context manager that caps the number of concurrent prediction requests"""
+
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT, retry_after: int = RETRY_AFTER_SECONDS):
+        self.max_in_flight = max(1, max_in_flight)
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.rejected = 0
+
+    def acquire(self):
+        """Take a slot or raise 503; only called from the event loop thread, so no lock is needed"""
+        if self.in_flight >= self.max_in_flight:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Server is busy, please retry shortly",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+
+    async def __aenter__(self):
+        self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "rejected": self.rejected,
+        }
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    Streaming response that releases an in-flight slot taken by the endpoint
+    once it ends, however it ends: a client that disconnects before the first
+    line never runs the body generator, so its finally cannot be relied on.
+    """
+
+    def __init__(self, content, limiter: InFlightLimiter, **kwargs):
+        super().__init__(content, **kwargs)
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.limiter.release()
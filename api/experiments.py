@@ -0,0 +1,265 @@
+"""
+Shadow evaluation and A/B routing of model versions on live traffic.
+
+Both compare versions of the model registry's ``MODEL_DIR`` (see
+model_registry.py); the versions involved are pinned, i.e. kept loaded next to
+the active one.
+
+- ``SHADOW_MODEL_VERSION``: a candidate run on a sample (``SHADOW_SAMPLE_RATE``)
+  of the requests. It gets the same preprocessed image once the served result
+  is ready, on its own batch scheduler, so it never delays a response; while
+  more than ``SHADOW_MAX_QUEUE`` images wait for it, samples are dropped. Its
+  results are never served, only compared with the served ones: agreement
+  rate, a disagreement matrix (served class by shadow class), and inference
+  latency against the served version.
+- ``AB_WEIGHTS``: e.g. ``2024-05-01=0.9,2024-06-12=0.1`` splits requests
+  between versions. The arm is picked from the upload hash when the prediction
+  cache is on, so a repeated upload gets the same version (and its cached
+  result). Per-arm request counts, predicted classes and mean confidence are
+  recorded.
+
+Both are off by default; their metrics are served at ``/metrics/experiments``.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from bisect import bisect_right
+from collections import deque
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from batching import BatchScheduler
+from model_registry import LoadedModel, ModelRegistry
+from responses import CLASSES
+
+logger = logging.getLogger(__name__)
+
+SHADOW_MODEL_VERSION = os.getenv("SHADOW_MODEL_VERSION")  # Version in MODEL_DIR to run in shadow
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "0.1"))  # Fraction of requests sent to it
+SHADOW_MAX_QUEUE = int(os.getenv("SHADOW_MAX_QUEUE", "64"))  # Images waiting for it before samples are dropped
+AB_WEIGHTS = os.getenv("AB_WEIGHTS", "")  # "<version>=<weight>,..."
+# Batches kept per model version for the latency percentiles
+LATENCY_WINDOW = 2048
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """``"a=0.9,b=0.1"`` -> ``{"a": 0.9, "b": 0.1}``, normalized to sum to 1"""
+    weights = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        version, _, weight = part.partition("=")
+        weights[version.strip()] = float(weight) if weight.strip() else 1.0
+    if any(weight < 0 for weight in weights.values()) or (weights and sum(weights.values()) <= 0):
+        raise ValueError(f"A/B weights must be non-negative and not all zero: {spec!r}")
+    total = sum(weights.values())
+    return {version: weight / total for version, weight in weights.items()}
+
+
+def latency_summary(samples) -> Dict[str, float]:
+    samples = np.asarray(samples, dtype=np.float64)
+    if not len(samples):
+        return {"batches": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0}
+    p50, p95 = np.percentile(samples, [50, 95])
+    return {"batches": len(samples), "mean": float(samples.mean()), "p50": float(p50), "p95": float(p95)}
+
+
+class LatencyStats:
+    """Per-image inference time of each model version, over its most recent batches"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, version: str, batch_size: int, seconds: float):
+        # Per image, so versions that see different batch sizes stay comparable
+        with self._lock:
+            samples = self._samples.get(version)
+            if samples is None:
+                samples = self._samples[version] = deque(maxlen=self.window)
+            samples.append(seconds * 1000.0 / max(1, batch_size))
+
+    def summary(self, version: str) -> Dict[str, float]:
+        with self._lock:
+            samples = list(self._samples.get(version, ()))
+        return latency_summary(samples)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            versions = list(self._samples)
+        return {version: self.summary(version) for version in versions}
+
+
+class ShadowEvaluator:
+    """Runs a shadow model on sampled requests in the background and compares it with the served results"""
+
+    def __init__(self, model: LoadedModel, latency: LatencyStats, sample_rate: float = SHADOW_SAMPLE_RATE,
+                 max_queue: int = SHADOW_MAX_QUEUE, **scheduler_kwargs):
+        self.model = model
+        self.latency = latency
+        self.sample_rate = min(1.0, max(0.0, sample_rate))
+        self.max_queue = max(1, max_queue)
+        self.scheduler = BatchScheduler(self._run_model, **scheduler_kwargs)
+        self._lock = threading.Lock()
+        self.sampled = 0
+        self.dropped = 0
+        self.failed = 0
+        self.compared = 0
+        self.agreed = 0
+        self.probability_diff_sum = 0.0
+        # Rows: served class, columns: shadow class
+        self.matrix = np.zeros((len(CLASSES), len(CLASSES)), dtype=np.int64)
+        self.served_versions: Dict[str, int] = {}
+
+    def start(self):
+        self.scheduler.start()
+        logger.info(f"Shadow model version {self.model.version} evaluating {self.sample_rate:.0%} of requests")
+
+    def stop(self):
+        self.scheduler.stop()
+
+    def _run_model(self, batch: np.ndarray) -> List[Tuple[np.ndarray, str]]:
+        # No model_lock: the shadow model must never hold up the served one
+        started = time.perf_counter()
+        predictions = self.model.backend.predict(batch)
+        self.latency.record(self.model.version, len(batch), time.perf_counter() - started)
+        return [(row, self.model.version) for row in predictions]
+
+    def submit(self, image: np.ndarray, served: np.ndarray, served_version: str):
+        """Send a served request to the shadow model if it is sampled; never blocks"""
+        if served_version == self.model.version or random.random() >= self.sample_rate:
+            return
+        if self.scheduler.queue_depth >= self.max_queue:
+            self.dropped += 1
+            return
+        self.sampled += 1
+        # Copied, as the served row may be a view of the backend's output buffer
+        future = self.scheduler.submit(image)
+        future.add_done_callback(partial(self._compare, np.array(served, dtype=np.float32), served_version))
+
+    def _compare(self, served: np.ndarray, served_version: str, future):
+        if future.cancelled() or future.exception() is not None:
+            with self._lock:
+                self.failed += 1
+            return
+        row, _ = future.result()
+        shadow = np.asarray(row, dtype=np.float32)
+        served_class = int(np.argmax(served))
+        shadow_class = int(np.argmax(shadow))
+        with self._lock:
+            self.compared += 1
+            self.agreed += served_class == shadow_class
+            self.matrix[served_class, shadow_class] += 1
+            self.probability_diff_sum += float(np.abs(shadow - served).max())
+            self.served_versions[served_version] = self.served_versions.get(served_version, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Agreement, disagreement matrix and latency of the shadow model against the served versions"""
+        with self._lock:
+            compared = self.compared
+            stats = {
+                "enabled": True,
+                "version": self.model.version,
+                "sample_rate": self.sample_rate,
+                "sampled": self.sampled,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "pending": self.scheduler.queue_depth,
+                "compared": compared,
+                "agreement_rate": self.agreed / compared if compared else None,
+                "mean_max_probability_diff": self.probability_diff_sum / compared if compared else None,
+                "disagreement_matrix": {
+                    "labels": list(CLASSES),
+                    "served_by_shadow": self.matrix.tolist(),
+                },
+                "served_versions": dict(self.served_versions),
+            }
+        shadow_latency = self.latency.summary(self.model.version)
+        stats["latency_ms"] = shadow_latency
+        # Shadow minus served per-image latency; positive means the shadow model is slower
+        stats["latency_delta_ms"] = {}
+        for version in stats["served_versions"]:
+            served_latency = self.latency.summary(version)
+            stats["latency_delta_ms"][version] = {
+                key: shadow_latency[key] - served_latency[key] for key in ("mean", "p50", "p95")
+            }
+        return stats
+
+
+class ABRouter:
+    """Splits requests between model versions by weight and records each arm's outcomes"""
+
+    def __init__(self, weights: Dict[str, float]):
+        self.weights = dict(weights)
+        self.versions = list(self.weights)
+        self._cumulative = list(np.cumsum([self.weights[version] for version in self.versions]))
+        self._lock = threading.Lock()
+        self.requests = {version: 0 for version in self.versions}
+        self.class_counts = {version: [0] * len(CLASSES) for version in self.versions}
+        self.confidence_sum = {version: 0.0 for version in self.versions}
+
+    def choose(self, image_hash: Optional[str] = None) -> str:
+        """Arm for a request; the same upload hash always gets the same arm"""
+        point = int(image_hash[:12], 16) / 16 ** 12 if image_hash else random.random()
+        return self.versions[min(bisect_right(self._cumulative, point), len(self.versions) - 1)]
+
+    def record(self, result: Dict[str, Any]):
+        """Count a prediction result served by one of the arms"""
+        version = result["model_version"]
+        if version not in self.requests:
+            return
+        with self._lock:
+            self.requests[version] += 1
+            self.class_counts[version][result["class_index"]] += 1
+            self.confidence_sum[version] += result["confidence"]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": True,
+                "arms": {
+                    version: {
+                        "weight": self.weights[version],
+                        "requests": self.requests[version],
+                        "share": self.requests[version] / max(1, sum(self.requests.values())),
+                        "class_counts": dict(zip(CLASSES, self.class_counts[version])),
+                        "mean_confidence": (self.confidence_sum[version] / self.requests[version]
+                                            if self.requests[version] else None),
+                    }
+                    for version in self.versions
+                },
+            }
+
+
+def create_ab_router(registry: ModelRegistry) -> Optional[ABRouter]:
+    """Router over the AB_WEIGHTS versions, pinned in the registry; None when A/B routing is off or misconfigured"""
+    if not AB_WEIGHTS.strip():
+        return None
+    try:
+        weights = parse_weights(AB_WEIGHTS)
+        for version in weights:
+            registry.pin(version)
+    except Exception as e:
+        logger.error(f"A/B routing disabled: {e}")
+        return None
+    logger.info(f"A/B routing between model versions {weights}")
+    return ABRouter(weights)
+
+
+def create_shadow_evaluator(registry: ModelRegistry, latency: LatencyStats,
+                            **scheduler_kwargs) -> Optional[ShadowEvaluator]:
+    """Evaluator for SHADOW_MODEL_VERSION, pinned in the registry; None when shadowing is off or misconfigured"""
+    if not SHADOW_MODEL_VERSION:
+        return None
+    try:
+        model = registry.pin(SHADOW_MODEL_VERSION)
+    except Exception as e:
+        logger.error(f"Shadow evaluation disabled: {e}")
+        return None
+    return ShadowEvaluator(model, latency, **scheduler_kwargs)
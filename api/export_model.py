@@ -0,0 +1,124 @@
+"""
+Export kidney_model.h5 to the TFLite and ONNX formats used by the inference backends,
+and to the compact .npz weights the keras backend loads fastest (see kidney_model.py).
+
+Each exported model is loaded back through its backend and checked against the
+Keras model on the same inputs. The export fails (non-zero exit code) if the
+probabilities differ by more than ``--atol`` or any predicted class changes.
+Each model is written to a staged file next to its output and verified there;
+only a model that passes is renamed into place, so a server loading the output
+path never picks up a failed export.
+
+Usage:
+    python export_model.py                          # every format
+    python export_model.py --formats tflite --atol 1e-3
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+
+from backends import DEFAULT_MODEL_PATHS, create_backend
+from kidney_model import WEIGHTS_FILENAME, load_model, save_weights
+from preprocessing import IMGSIZE
+
+
+def export_tflite(model: tf.keras.Model, output_path: str):
+    """Convert the Keras model to a float32 TFLite flatbuffer"""
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+
+
+def export_onnx(model: tf.keras.Model, output_path: str, opset: int = 13):
+    """Convert the Keras model to ONNX with a dynamic batch dimension"""
+    try:
+        import tf2onnx
+    except ImportError as e:
+        raise ImportError("ONNX export needs tf2onnx installed (pip install tf2onnx)") from e
+
+    input_signature = [tf.TensorSpec((None, IMGSIZE, IMGSIZE, 3), tf.float32, name="input")]
+    forward = tf.function(lambda images: model(images, training=False))
+    tf2onnx.convert.from_function(forward, input_signature=input_signature, opset=opset, output_path=output_path)
+
+
+EXPORTERS = {
+    "tflite": export_tflite,
+    "onnx": export_onnx,
+    "npz": save_weights,
+}
+# Output file and the backend that verifies it, per format
+EXPORT_PATHS = dict(DEFAULT_MODEL_PATHS, npz=WEIGHTS_FILENAME)
+EXPORT_BACKENDS = {"tflite": "tflite", "onnx": "onnx", "npz": "keras"}
+
+
+def sample_inputs(count: int, seed: int = 0) -> np.ndarray:
+    """Random images in the value range the model is served with (0-255, see preprocessing.py)"""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (count, IMGSIZE, IMGSIZE, 3)).astype(np.float32)
+
+
+def verify(reference: np.ndarray, candidate: np.ndarray, atol: float) -> bool:
+    """Compare probabilities and predicted classes of two models"""
+    max_diff = float(np.max(np.abs(reference - candidate)))
+    agreement = float(np.mean(np.argmax(reference, axis=1) == np.argmax(candidate, axis=1)))
+    ok = max_diff <= atol and agreement == 1.0
+    print(f"  max |diff| = {max_diff:.2e} (atol {atol:.0e}), argmax agreement = {agreement:.2%} -> "
+          f"{'OK' if ok else 'MISMATCH'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the Keras model to TFLite/ONNX and verify the outputs")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATHS["keras"], help="Keras model to export")
+    parser.add_argument("--formats", nargs="+", choices=sorted(EXPORTERS), default=sorted(EXPORTERS))
+    parser.add_argument("--output-dir", default=".", help="Where to write kidney_model.<format>")
+    parser.add_argument("--atol", type=float, default=1e-3, help="Maximum allowed probability difference")
+    parser.add_argument("--samples", type=int, default=32, help="Number of random inputs to compare on")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print(f"Error: {args.model} not found")
+        sys.exit(1)
+
+    model = load_model(args.model)
+    inputs = sample_inputs(args.samples)
+    reference = model(inputs, training=False).numpy()
+
+    failed = []
+    for fmt in args.formats:
+        output_path = os.path.join(args.output_dir, EXPORT_PATHS[fmt])
+        print(f"Exporting {args.model} -> {output_path}")
+        # Stage next to the output (with its extension, which picks the loader) so the final rename is atomic
+        with tempfile.NamedTemporaryFile(suffix=os.path.splitext(output_path)[1],
+                                         dir=os.path.dirname(os.path.abspath(output_path)), delete=False) as f:
+            candidate_path = f.name
+        try:
+            EXPORTERS[fmt](model, candidate_path)
+            backend = create_backend(EXPORT_BACKENDS[fmt], candidate_path)
+            ok = verify(reference, backend.predict(inputs), args.atol)
+        except Exception as e:
+            print(f"  export failed: {e}")
+            ok = False
+        try:
+            if ok:
+                os.replace(candidate_path, output_path)
+            else:
+                failed.append(fmt)
+                print(f"  {output_path} left unchanged")
+        finally:
+            if os.path.exists(candidate_path):
+                os.remove(candidate_path)
+
+    if failed:
+        print(f"Export verification failed for: {', '.join(failed)}")
+        sys.exit(1)
+    print("All exports verified")
+
+
+if __name__ == "__main__":
+    main()
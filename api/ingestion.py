@@ -0,0 +1,134 @@
+"""
+Request body ingestion with size limits.
+
+- BodySizeLimitMiddleware rejects a request with 413 as soon as its
+  Content-Length, or the number of body bytes received so far, exceeds the
+  limit for its path, so oversized uploads are never fully buffered.
+- Upload and base64 payloads are handed to the decoder as memoryviews over a
+  single buffer instead of bytes -> BytesIO -> bytes copies.
+- Image dimensions are checked from the header (see preprocessing.decode_image)
+  against MAX_IMAGE_PIXELS before any pixel data is decoded.
+"""
+
+import binascii
+import json
+import logging
+import os
+import re
+from typing import Dict, Optional
+
+from fastapi import HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+# Request body limit for single-image endpoints (bytes)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# Request body limit for /predict-batch, whose multipart parts are spooled to disk (bytes)
+MAX_BATCH_UPLOAD_BYTES = int(os.getenv("MAX_BATCH_UPLOAD_BYTES", str(1024 * 1024 * 1024)))
+# Largest image (width * height) that will be decoded
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))
+
+# {"image": "<base64>"}: base64 never needs JSON escapes, so the value can be sliced out of the raw body
+_BASE64_IMAGE_FIELD = re.compile(rb'^\s*\{\s*"image"\s*:\s*"([A-Za-z0-9+/=]*)"\s*\}\s*$')
+
+
+def is_raw_image_body(content_type: Optional[str]) -> bool:
+    """True for request bodies that are the encoded image itself rather than a form or JSON document"""
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    return media_type == "application/octet-stream" or media_type.startswith("image/")
+
+
+def payload_too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Request body exceeds the {limit} byte limit")
+
+
+class BodySizeLimitMiddleware:
+    """ASGI middleware enforcing a per-path request body limit while the body is received"""
+
+    def __init__(self, app, max_body_bytes: int = MAX_UPLOAD_BYTES, path_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.path_limits.get(scope["path"], self.max_body_bytes)
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            logger.warning(f"Rejected {scope['path']}: Content-Length {int(content_length)} over {limit} bytes")
+            response = JSONResponse(status_code=413, content={"detail": payload_too_large(limit).detail})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Chunked or lying clients: stop reading as soon as the limit is crossed
+                    raise payload_too_large(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def read_body(request: Request, limit: int = MAX_UPLOAD_BYTES) -> bytearray:
+    """Accumulate the request body chunk by chunk into one buffer"""
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise payload_too_large(limit)
+    return body
+
+
+def decode_base64_payload(body: bytearray) -> memoryview:
+    """Decode the image of a {"image": "<base64>"} body (CPU-bound, runs on the preprocessing pool)"""
+    match = _BASE64_IMAGE_FIELD.match(body)
+    if match is not None:
+        # Decode straight from a view of the request body, without a str copy of the payload
+        start, end = match.span(1)
+        encoded = memoryview(body)[start:end]
+    else:
+        try:
+            data = json.loads(body)
+        except ValueError as e:
+            # JSONDecodeError, or UnicodeDecodeError for a body that is not UTF-8
+            raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+        if not isinstance(data, dict) or "image" not in data:
+            raise HTTPException(status_code=400, detail="Image data not provided")
+        encoded = data["image"]
+    try:
+        return memoryview(binascii.a2b_base64(encoded))
+    except (binascii.Error, TypeError, ValueError) as e:
+        # ValueError: a str with non-ASCII characters
+        raise HTTPException(status_code=400, detail=f"Invalid base64 image data: {str(e)}")
+
+
+def upload_buffer(upload: UploadFile, limit: int = MAX_UPLOAD_BYTES) -> memoryview:
+    """
+    Read a (spooled) upload into one preallocated buffer and return a view of it.
+    Blocking file I/O: run it on the preprocessing pool.
+    """
+    file = upload.file
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    if size > limit:
+        raise payload_too_large(limit)
+    file.seek(0)
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    filled = 0
+    while filled < size:
+        count = file.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    return view[:filled]
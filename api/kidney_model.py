@@ -0,0 +1,223 @@
+"""
+The kidney classification model: class list, input size, architecture and weights.
+
+This is the only definition of the network. The API, the model service,
+training, evaluation, export and the setup scripts all build or load the model
+through it. The architecture is the notebook's CNN:
+
+    Conv 32 - MaxPool - Dropout - Conv 64 - MaxPool - Conv 128 - MaxPool -
+    Flatten - Dense 256 - Dropout - Dense 128 - Dropout - Dense 64 - Dense 4 (softmax)
+
+``ARCHITECTURE`` describes it as plain data, so the shape of every weight is
+known (``weight_shapes``) without importing TensorFlow, which is only imported
+to build a Keras model.
+
+Weights can be stored as a compact ``.npz`` file (``save_weights``): the
+float32 arrays in layer order, the class list and a digest of the
+architecture. ``load_weights`` checks all of them before building anything, so
+a file made for another architecture or class list fails in milliseconds with
+``WeightsMismatch``. ``load_model`` then builds the network (no optimizer,
+nothing compiled, no random initialization) and sets the weights, which is
+faster than deserializing a full ``.h5`` file and gives the same model on
+every start. Convert a trained ``kidney_model.h5`` with
+``python kidney_model.py kidney_model.h5 kidney_model.npz``.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+CLASSES = ['Cyst', 'Normal', 'Stone', 'Tumor']
+NUM_CLASSES = len(CLASSES)
+IMGSIZE = 128
+INPUT_SHAPE = (IMGSIZE, IMGSIZE, 3)
+
+# (layer, units or rate, activation); convolutions are 3x3 'valid', pools 2x2
+ARCHITECTURE = (
+    ("conv", 32, "relu"),
+    ("maxpool",),
+    ("dropout", 0.25),
+    ("conv", 64, "relu"),
+    ("maxpool",),
+    ("conv", 128, "relu"),
+    ("maxpool",),
+    ("flatten",),
+    ("dense", 256, "relu"),
+    ("dropout", 0.25),
+    ("dense", 128, "relu"),
+    ("dropout", 0.25),
+    ("dense", 64, "relu"),
+    ("dense", NUM_CLASSES, "softmax"),
+)
+KERNEL_SIZE = 3
+
+WEIGHTS_FORMAT = 1
+WEIGHTS_FILENAME = "kidney_model.npz"
+# Version of the metadata sidecar train.py writes next to a model (classes, preprocessing, metrics)
+METADATA_FORMAT = 1
+
+
+class WeightsMismatch(ValueError):
+    """A model or weights file does not match the architecture, input size or classes defined here"""
+
+
+def weight_shapes() -> List[Tuple[int, ...]]:
+    """Shape of every weight array (kernel, then bias, per layer) in Keras' get_weights() order"""
+    height, width, channels = INPUT_SHAPE
+    features = None
+    shapes = []
+    for layer in ARCHITECTURE:
+        kind = layer[0]
+        if kind == "conv":
+            shapes += [(KERNEL_SIZE, KERNEL_SIZE, channels, layer[1]), (layer[1],)]
+            height, width, channels = height - KERNEL_SIZE + 1, width - KERNEL_SIZE + 1, layer[1]
+        elif kind == "maxpool":
+            height, width = height // 2, width // 2
+        elif kind == "flatten":
+            features = height * width * channels
+        elif kind == "dense":
+            shapes += [(features, layer[1]), (layer[1],)]
+            features = layer[1]
+    return shapes
+
+
+def architecture_digest() -> str:
+    """Identifies the architecture, input size and classes a weights file was made for"""
+    description = json.dumps({"architecture": ARCHITECTURE, "input_shape": INPUT_SHAPE, "classes": CLASSES})
+    return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+
+def build_model(weights: Optional[List[np.ndarray]] = None, seed: Optional[int] = None):
+    """
+    The Keras model, not compiled. With ``weights`` the layers are created with
+    zero initializers (nothing random is drawn) and the weights are set; without,
+    they are randomly initialized (seeded with ``seed``).
+    """
+    import tensorflow as tf
+
+    if seed is not None:
+        tf.keras.utils.set_random_seed(seed)
+    initializer = {"kernel_initializer": "zeros"} if weights is not None else {}
+    layers = [tf.keras.Input(shape=INPUT_SHAPE)]
+    for layer in ARCHITECTURE:
+        kind = layer[0]
+        if kind == "conv":
+            layers.append(tf.keras.layers.Conv2D(layer[1], (KERNEL_SIZE, KERNEL_SIZE), activation=layer[2],
+                                                 **initializer))
+        elif kind == "maxpool":
+            layers.append(tf.keras.layers.MaxPooling2D((2, 2)))
+        elif kind == "dropout":
+            layers.append(tf.keras.layers.Dropout(layer[1]))
+        elif kind == "flatten":
+            layers.append(tf.keras.layers.Flatten())
+        elif kind == "dense":
+            layers.append(tf.keras.layers.Dense(layer[1], activation=layer[2], **initializer))
+    model = tf.keras.Sequential(layers)
+    if weights is not None:
+        model.set_weights(weights)
+    return model
+
+
+def create_kidney_model(seed: Optional[int] = None):
+    """Untrained model compiled for training, as in the notebook"""
+    model = build_model(seed=seed)
+    model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+
+def metadata_path(model_path: str) -> str:
+    """The metadata sidecar of a model file: kidney_model.h5 -> kidney_model.json"""
+    return os.path.splitext(model_path)[0] + ".json"
+
+
+def check_weights(weights: List[np.ndarray]):
+    """Raise WeightsMismatch unless the arrays fit the architecture exactly"""
+    expected = weight_shapes()
+    if len(weights) != len(expected):
+        raise WeightsMismatch(f"Expected {len(expected)} weight arrays, got {len(weights)}")
+    for index, (array, shape) in enumerate(zip(weights, expected)):
+        if tuple(array.shape) != shape:
+            raise WeightsMismatch(f"Weight {index} has shape {tuple(array.shape)}, the architecture needs {shape}")
+
+
+def check_model(model):
+    """Raise WeightsMismatch unless a loaded Keras model takes INPUT_SHAPE images and predicts NUM_CLASSES classes"""
+    input_shape = tuple(model.input_shape[1:])
+    output_shape = tuple(model.output_shape[1:])
+    if input_shape != INPUT_SHAPE or output_shape != (NUM_CLASSES,):
+        raise WeightsMismatch(f"Model maps {input_shape} to {output_shape}, the API needs {INPUT_SHAPE} to "
+                              f"({NUM_CLASSES},)")
+
+
+def save_weights(model, path: str):
+    """Write a model's weights as a validated .npz file, staged next to path and renamed into place"""
+    weights = [np.asarray(array, dtype=np.float32) for array in model.get_weights()]
+    check_weights(weights)
+    arrays = {f"weight_{index:03d}": array for index, array in enumerate(weights)}
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(suffix=".npz", dir=directory, delete=False) as f:
+        try:
+            # Uncompressed: loading is a plain read
+            np.savez(f, format=np.array(WEIGHTS_FORMAT), architecture=np.array(architecture_digest()),
+                     classes=np.array(CLASSES), **arrays)
+        except BaseException:
+            os.remove(f.name)
+            raise
+    os.replace(f.name, path)
+
+
+def load_weights(path: str) -> List[np.ndarray]:
+    """Weights of an .npz file, after checking they were made for this architecture and class list"""
+    with np.load(path, allow_pickle=False) as data:
+        if not {"format", "architecture", "classes"} <= set(data.files) or int(data["format"]) != WEIGHTS_FORMAT:
+            raise WeightsMismatch(f"{path} is not a kidney model weights file (format {WEIGHTS_FORMAT})")
+        if list(data["classes"]) != CLASSES:
+            raise WeightsMismatch(f"{path} was made for classes {list(data['classes'])}, not {CLASSES}")
+        if str(data["architecture"]) != architecture_digest():
+            raise WeightsMismatch(f"{path} was made for another architecture or input size")
+        names = sorted(name for name in data.files if name.startswith("weight_"))
+        weights = [data[name] for name in names]
+    check_weights(weights)
+    for name, array in zip(names, weights):
+        if array.dtype != np.float32 or not np.isfinite(array).all():
+            raise WeightsMismatch(f"{path}: {name} is not finite float32")
+    return weights
+
+
+def load_model(path: str):
+    """
+    A model for inference only: .npz weights are validated and set on the
+    architecture defined here; .h5/.keras files are loaded without compiling and
+    checked for the input size and number of classes.
+    """
+    if path.endswith(".npz"):
+        return build_model(load_weights(path))
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(path, compile=False)
+    check_model(model)
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a saved Keras model into a validated .npz weights file")
+    parser.add_argument("model", help="Keras model (.h5 or .keras) with the architecture defined in kidney_model.py")
+    parser.add_argument("output", nargs="?", default=WEIGHTS_FILENAME)
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    save_weights(model, args.output)
+    # Read back through the loader, so a file that would not load is noticed here
+    reloaded = build_model(load_weights(args.output))
+    inputs = np.random.default_rng(0).integers(0, 256, (4,) + INPUT_SHAPE).astype(np.float32)
+    max_diff = float(np.max(np.abs(model(inputs, training=False).numpy() - reloaded(inputs, training=False).numpy())))
+    print(f"Wrote {args.output} ({os.path.getsize(args.output) / 1e6:.1f} MB, max |diff| after reload {max_diff:.1e})")
+
+
+if __name__ == "__main__":
+    main()
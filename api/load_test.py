@@ -0,0 +1,131 @@
+"""
+Load test for the Kidney Disease Prediction API.
+
+Saturates /predict-base64 with large uploads while probing /health at a fixed
+rate, then compares the /health latency distribution against an idle baseline.
+With decode, preprocessing and inference off the event loop, /health p99 should
+stay flat while /predict is saturated.
+
+Usage (with the API already running):
+    python load_test.py --url http://localhost:8000 --concurrency 32 --duration 20
+"""
+
+import argparse
+import base64
+import io
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+
+def make_upload(width: int, height: int) -> bytes:
+    """Create a grayscale-like JPEG so it passes validation and reaches inference"""
+    rng = np.random.default_rng(0)
+    gray = rng.integers(40, 220, size=(height, width), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(gray).convert('RGB').save(buffer, format='JPEG', quality=90)
+    return json.dumps({"image": base64.b64encode(buffer.getvalue()).decode('ascii')}).encode('utf-8')
+
+
+def percentile(samples, q):
+    return float(np.percentile(samples, q)) if samples else float('nan')
+
+
+def summarize(name, samples):
+    print(f"{name:<28} n={len(samples):<6} p50={percentile(samples, 50):8.2f} ms  "
+          f"p95={percentile(samples, 95):8.2f} ms  p99={percentile(samples, 99):8.2f} ms")
+
+
+def probe_health(url: str, stop: threading.Event, interval: float, samples: list):
+    """Request /health every ``interval`` seconds until stopped"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(f"{url}/health", timeout=30) as response:
+                response.read()
+            samples.append((time.perf_counter() - started) * 1000.0)
+        except urllib.error.URLError as e:
+            print(f"/health failed: {e}")
+        stop.wait(max(0.0, interval - (time.perf_counter() - started)))
+
+
+def hammer_predict(url: str, body: bytes, stop: threading.Event, latencies: list, statuses: dict, lock: threading.Lock):
+    """Send /predict-base64 requests back to back until stopped"""
+    while not stop.is_set():
+        request = urllib.request.Request(f"{url}/predict-base64", data=body,
+                                         headers={"Content-Type": "application/json"})
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+            if status == 503:
+                # Honour the server's backpressure hint
+                stop.wait(float(e.headers.get("Retry-After", "1")))
+        except urllib.error.URLError:
+            # The server may reset the connection when it rejects a request before reading its body
+            status = 0
+            stop.wait(1.0)
+        elapsed = (time.perf_counter() - started) * 1000.0
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the prediction API")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent /predict clients")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per phase")
+    parser.add_argument("--width", type=int, default=5472, help="Upload width (default ~20 MP)")
+    parser.add_argument("--height", type=int, default=3648, help="Upload height")
+    parser.add_argument("--health-interval", type=float, default=0.05, help="Seconds between /health probes")
+    args = parser.parse_args()
+
+    url = args.url.rstrip('/')
+    body = make_upload(args.width, args.height)
+    print(f"Upload size: {len(body) / 1e6:.1f} MB ({args.width}x{args.height})")
+
+    # Phase 1: idle baseline
+    idle_samples = []
+    stop = threading.Event()
+    prober = threading.Thread(target=probe_health, args=(url, stop, args.health_interval, idle_samples))
+    prober.start()
+    time.sleep(args.duration)
+    stop.set()
+    prober.join()
+
+    # Phase 2: /predict saturated
+    loaded_samples, predict_latencies, statuses, lock = [], [], {}, threading.Lock()
+    stop = threading.Event()
+    prober = threading.Thread(target=probe_health, args=(url, stop, args.health_interval, loaded_samples))
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for _ in range(args.concurrency):
+            pool.submit(hammer_predict, url, body, stop, predict_latencies, statuses, lock)
+        prober.start()
+        time.sleep(args.duration)
+        stop.set()
+    prober.join()
+
+    print()
+    summarize("/health (idle)", idle_samples)
+    summarize("/health (predict saturated)", loaded_samples)
+    summarize("/predict-base64", predict_latencies)
+    print(f"/predict-base64 throughput: {len(predict_latencies) / args.duration:.1f} req/s")
+    print(f"/predict-base64 status codes: {dict(sorted(statuses.items()))}")
+    if idle_samples and loaded_samples:
+        print(f"/health p99 ratio (saturated / idle): "
+              f"{percentile(loaded_samples, 99) / percentile(idle_samples, 99):.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,38 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
 import uvicorn
-import io
-import base64
 from PIL import Image
 import numpy as np
-import cv2
-import tensorflow as tf
 import time
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 import logging
 import threading
-from functools import lru_cache
+import os
+from functools import partial
+
+from batch_predict import is_archive, iter_upload_images, stream_predictions
+from batching import BatchScheduler, default_batch_buckets
+from experiments import LatencyStats, create_ab_router, create_shadow_evaluator
+from executors import RETRY_AFTER_SECONDS, InFlightLimiter, SlotStreamingResponse, run_in_pool, shutdown_pool
+from ingestion import (BodySizeLimitMiddleware, MAX_BATCH_UPLOAD_BYTES, MAX_IMAGE_PIXELS,
+                       decode_base64_payload, is_raw_image_body, read_body, upload_buffer)
+from metrics import (BATCH_QUEUE_DEPTH, CACHE_HITS, CONTENT_TYPE as METRICS_CONTENT_TYPE, DECODE_SECONDS,
+                     IN_FLIGHT, IN_FLIGHT_REJECTED, INFERENCE_SECONDS, LOCK_WAIT_SECONDS, PREDICTIONS_BY_CLASS,
+                     PREPROCESS_SECONDS, READ_SECONDS, SERIALIZATION_SECONDS, VALIDATION_REJECTIONS,
+                     VALIDATION_SECONDS, render as render_metrics, scraped)
+from kidney_model import CLASSES, IMGSIZE
+from model_registry import ModelRegistry
+from prediction_cache import PredictionCache, create_prediction_cache, hash_image
+from validation import is_kidney_scan_image
+from preprocessing import PREPROCESSING_VERSION, ImageTooLarge, decode_image, resize_uint8
+from responses import (COMPACT_JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPES, RESULT_VERSION, invalid_image_result,
+                       make_response, negotiate, prediction_result, render)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Performance optimizations
-tf.config.optimizer.set_jit(True)  # Enable XLA optimization
-tf.config.optimizer.set_experimental_options({"layout_optimizer": True})
-
 app = FastAPI(title="Kidney Disease Prediction API", version="1.0.0")
 
 # Add CORS middleware to allow Flutter app to connect
@@ -33,267 +44,239 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Model configuration
-CLASSES = ['Cyst', 'Normal', 'Stone', 'Tumor']
-IMGSIZE = 128
-model = None
+# Reject oversized bodies while they are received; batch uploads are spooled to disk
+app.add_middleware(BodySizeLimitMiddleware, path_limits={"/predict-batch": MAX_BATCH_UPLOAD_BYTES})
+
+# Model configuration (classes and input size are defined in kidney_model.py)
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "keras")  # 'keras', 'tflite' or 'onnx'
+MODEL_PATH = os.getenv("MODEL_PATH")  # Defaults to kidney_model.<h5|tflite|onnx>; or set MODEL_DIR (see model_registry.py)
+# Admin token for POST /models/{version}/activate; the endpoint is disabled while unset
+MODEL_ADMIN_TOKEN = os.getenv("MODEL_ADMIN_TOKEN")
+model_registry = None
 model_lock = threading.Lock()
+# Set once the model is loaded and warmed up; until then /ready and the prediction endpoints answer 503
+model_ready = threading.Event()
+model_load_error = None
 
-# Cache for processed images to avoid redundant computations
-@lru_cache(maxsize=100)
-def cached_preprocess_image(image_hash: str) -> np.ndarray:
-    """Cache preprocessed images to avoid redundant computations"""
-    # This is a placeholder - in practice, you'd store the actual image data
-    return np.zeros((1, IMGSIZE, IMGSIZE, 3), dtype=np.float32)
+# Micro-batching configuration
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "32"))
+MAX_BATCH_WAIT_MS = float(os.getenv("MAX_BATCH_WAIT_MS", "5"))
+INFERENCE_BATCH_BUCKETS = default_batch_buckets(MAX_BATCH_SIZE)
+batch_scheduler = None
 
-def create_kidney_model():
-    """Create the CNN model architecture"""
-    model = tf.keras.Sequential()
-    
-    model.add(tf.keras.layers.Conv2D(filters=32, kernel_size=(3, 3), activation='relu', input_shape=(IMGSIZE, IMGSIZE, 3)))
-    model.add(tf.keras.layers.MaxPooling2D((2,2)))
-    model.add(tf.keras.layers.Dropout(0.25))
-    
-    model.add(tf.keras.layers.Conv2D(filters=64, kernel_size=(3, 3), activation='relu'))
-    model.add(tf.keras.layers.MaxPooling2D((2,2)))
-    
-    model.add(tf.keras.layers.Conv2D(filters=128, kernel_size=(3, 3), activation='relu'))
-    model.add(tf.keras.layers.MaxPooling2D((2,2)))
-    
-    model.add(tf.keras.layers.Flatten())
-    model.add(tf.keras.layers.Dense(256, activation='relu'))
-    model.add(tf.keras.layers.Dropout(0.25))
-    
-    model.add(tf.keras.layers.Dense(128, activation='relu'))
-    model.add(tf.keras.layers.Dropout(0.25))
-    
-    model.add(tf.keras.layers.Dense(64, activation='relu'))
-    model.add(tf.keras.layers.Dense(4, activation='softmax'))
-    
-    model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
-    
-    return model
+# Shadow evaluation and A/B routing between model versions (see experiments.py)
+inference_latency = LatencyStats()
+ab_router = None
+ab_schedulers: Dict[str, BatchScheduler] = {}
+shadow_evaluator = None
+
+# Backpressure for the prediction endpoints
+inflight_limiter = InFlightLimiter()
+
+# Read when /metrics is scraped (the batch scheduler only exists once the app has started)
+IN_FLIGHT.set_function(scraped("in-flight requests", lambda: inflight_limiter.in_flight))
+IN_FLIGHT_REJECTED.set_function(scraped("in-flight rejections", lambda: inflight_limiter.rejected))
+BATCH_QUEUE_DEPTH.set_function(scraped("batch queue depth", lambda: batch_scheduler.queue_depth))
+
+# Results cache keyed by upload hash and model version
+prediction_cache = None
 
 def load_model():
-    """Load or create the kidney classification model with optimizations"""
-    global model
-    try:
-        # Try to load saved model
-        model = tf.keras.models.load_model('kidney_model.h5')
-        
-        # Optimize model for inference
-        model = tf.keras.models.clone_model(model)
-        model.set_weights(tf.keras.models.load_model('kidney_model.h5').get_weights())
-        
-        # Compile with optimizations
-        model.compile(
-            optimizer='adam', 
-            loss='sparse_categorical_crossentropy', 
-            metrics=['accuracy'],
-            run_eagerly=False  # Disable eager execution for better performance
-        )
-        
-        # Warm up the model with a dummy prediction
-        dummy_input = np.random.random((1, IMGSIZE, IMGSIZE, 3)).astype(np.float32)
-        _ = model.predict(dummy_input, verbose=False)
-        
-        logger.info("Model loaded and optimized successfully")
-    except Exception as e:
-        logger.warning(f"Saved model not found or error loading: {e}. Creating new model (will need training)")
-        model = create_kidney_model()
+    """Load and warm up the newest model version in the configured inference backend, then watch for new ones"""
+    global model_registry
+    # TensorFlow is imported here rather than at startup, and only by the keras backend
+    if MODEL_BACKEND == "keras":
+        import tensorflow as tf
+        
+        # Performance optimizations
+        tf.config.optimizer.set_jit(True)  # Enable XLA optimization
+        tf.config.optimizer.set_experimental_options({"layout_optimizer": True})
+    
+    # Keras models are loaded once for inference only and traced per batch bucket. A model that
+    # cannot be loaded fails startup (see /ready) instead of being replaced by an untrained network
+    model_registry = ModelRegistry(MODEL_BACKEND, model_path=MODEL_PATH, on_evict=forget_cached_predictions,
+                                   batch_buckets=INFERENCE_BATCH_BUCKETS)
+    # Warmed up before it is activated, so the first request pays no setup cost
+    model_registry.load_initial()
+    logger.info(f"Model version {model_registry.active.version} loaded and warmed up")
+    start_experiments()
+    model_ready.set()
+    model_registry.start()
 
-def preprocess_image(image: Image.Image) -> np.ndarray:
-    """Optimized image preprocessing"""
+def start_experiments():
+    """Load the configured A/B arms and shadow model, each with its own batch scheduler"""
+    global ab_router, shadow_evaluator
+    router = create_ab_router(model_registry)
+    if router is not None:
+        for version in router.versions:
+            ab_schedulers[version] = BatchScheduler(partial(run_model, version=version),
+                                                    max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS)
+            ab_schedulers[version].start()
+        ab_router = router
+    shadow_evaluator = create_shadow_evaluator(model_registry, inference_latency,
+                                               max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS)
+    if shadow_evaluator is not None:
+        shadow_evaluator.start()
+
+def load_model_in_background():
+    """Load the model off the event loop, so the server accepts connections (and /health answers) right away"""
+    global model_load_error
     try:
-        # Convert PIL image to numpy array
-        img_array = np.array(image, dtype=np.float32)
-        
-        # Convert to RGB if needed (more efficient)
-        if len(img_array.shape) == 3 and img_array.shape[2] == 4:  # RGBA
-            img_array = img_array[:, :, :3]  # Take only RGB channels
-        elif len(img_array.shape) == 2:  # Grayscale
-            img_array = np.stack([img_array] * 3, axis=-1)
-        
-        # Resize to model input size (more efficient with cv2)
-        img_resized = cv2.resize(img_array, (IMGSIZE, IMGSIZE), interpolation=cv2.INTER_AREA)
-        
-        # Normalize pixel values (vectorized operation)
-        img_normalized = img_resized.astype(np.float32) / 255.0
-        
-        # Add batch dimension
-        img_batch = np.expand_dims(img_normalized, axis=0)
-        
-        return img_batch
-        
+        load_model()
     except Exception as e:
-        logger.error(f"Error preprocessing image: {e}")
-        raise
+        model_load_error = str(e)
+        logger.error(f"Model loading failed: {e}")
+
+def model_not_ready() -> HTTPException:
+    detail = f"Model failed to load: {model_load_error}" if model_load_error else "Model is still loading"
+    return HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
 
-def is_kidney_scan_image(image: Image.Image) -> Dict[str, Any]:
+def forget_cached_predictions(model):
+    """Drop the cached results of a model version that was unloaded"""
+    if prediction_cache is not None:
+        prediction_cache.invalidate(prediction_cache_version(model.version) + ":")
+
+def run_model(batch: np.ndarray, version: Optional[str] = None):
     """
-    Optimized validation for kidney scan images
+    Run one forward pass on a stacked batch of preprocessed images, with the active model
+    or a pinned version (A/B arm). Each row comes back paired with the version of the
+    model that produced it, so a hot swap between batches never mislabels a result.
     """
-    try:
-        # Convert to numpy array
-        img_array = np.array(image)
-        
-        # Quick checks for medical imaging characteristics
-        
-        # 1. Check if image is grayscale
-        if len(img_array.shape) == 2:  # Grayscale
-            return {
-                "is_kidney_scan": True,
-                "confidence": 0.8,
-                "reason": "Grayscale medical image detected"
-            }
-        
-        # 2. Quick color variance check (more efficient)
-        if len(img_array.shape) == 3:
-            # Use only a sample of pixels for faster computation
-            sample_size = min(1000, img_array.shape[0] * img_array.shape[1])
-            indices = np.random.choice(img_array.shape[0] * img_array.shape[1], sample_size, replace=False)
-            sample_pixels = img_array.reshape(-1, 3)[indices]
-            
-            # Calculate color variance on sample
-            r, g, b = sample_pixels[:, 0], sample_pixels[:, 1], sample_pixels[:, 2]
-            color_variance = np.std(r - g) + np.std(g - b) + np.std(r - b)
-            
-            if color_variance < 20:  # Low color variance indicates grayscale-like
-                return {
-                    "is_kidney_scan": True,
-                    "confidence": 0.8,
-                    "reason": "Medical scan-like image detected (low color variation)"
-                }
-            
-            # Quick brightness and contrast check
-            brightness = np.mean(sample_pixels)
-            contrast = np.std(sample_pixels)
-            
-            if 50 < brightness < 200 and 20 < contrast < 100:
-                return {
-                    "is_kidney_scan": True,
-                    "confidence": 0.7,
-                    "reason": "Medical image characteristics detected"
-                }
-        
-        return {
-            "is_kidney_scan": False,
-            "confidence": 0.9,
-            "reason": "Image does not appear to be a medical scan"
-        }
-        
-    except Exception as e:
-        return {
-            "is_kidney_scan": False,
-            "confidence": 0.5,
-            "reason": f"Error validating image: {str(e)}"
-        }
-
-def predict_kidney_disease(image: Image.Image) -> Dict[str, Any]:
-    """Optimized prediction using the trained model"""
-    global model
-    
-    if model is None:
+    model = model_registry.active if version is None else model_registry.get(version)
+    waiting = time.perf_counter()
+    with model_lock:  # Thread-safe prediction
+        started = time.perf_counter()
+        predictions = model.backend.predict(batch)
+    finished = time.perf_counter()
+    LOCK_WAIT_SECONDS.observe(started - waiting)
+    INFERENCE_SECONDS.observe(finished - started)
+    inference_latency.record(model.version, len(batch), finished - started)
+    return [(row, model.version) for row in predictions]
+
+def prepare_image(image: Image.Image):
+    """Resize and validate an image (CPU-bound, runs on the preprocessing pool)"""
+    # uint8 BGR at IMGSIZE; the batch scheduler casts it into the float32 batch
+    with PREPROCESS_SECONDS.time():
+        img_resized = resize_uint8(image)
+    with VALIDATION_SECONDS.time():
+        validation = is_kidney_scan_image(img_resized)
+    if not validation["is_kidney_scan"]:
+        return validation, None
+    return validation, img_resized
+
+async def predict_kidney_disease(image: Image.Image, model_version: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Optimized prediction using the trained model (the active version, or the A/B arm
+    model_version); returns a coded result (see responses.py)
+    """
+    if model_registry is None or model_registry.active is None:
         raise Exception("Model not loaded")
     
     try:
-        # Quick validation (faster version)
-        validation = is_kidney_scan_image(image)
+        # Validation and preprocessing run off the event loop
+        validation, processed_image = await run_in_pool(prepare_image, image)
         
         if not validation["is_kidney_scan"]:
-            return {
-                "disease": "Invalid Image",
-                "confidence": validation["confidence"],
-                "severity": "None",
-                "message": f"This image does not appear to be a kidney scan. {validation['reason']}. Please upload a clear kidney ultrasound, CT scan, or MRI image for analysis.",
-                "recommendations": [
-                    "Upload a clear kidney ultrasound image",
-                    "Use CT scan or MRI images of the kidney area",
-                    "Ensure the image shows kidney structures clearly",
-                    "Avoid photos of people, objects, or non-medical images",
-                    "Make sure the image is well-lit and in focus"
-                ],
-                "timestamp": time.time(),
-                "validation_error": True
-            }
-        
-        # Preprocess image
-        processed_image = preprocess_image(image)
-        
-        # Make prediction with optimizations
-        with model_lock:  # Thread-safe prediction
-            predictions = model.predict(processed_image, verbose=False)
+            return invalid_image_result(validation, model_registry.active.version)
         
-        # Get predicted class and confidence
-        predicted_class_idx = np.argmax(predictions[0])
-        confidence = float(predictions[0][predicted_class_idx])
-        predicted_class = CLASSES[predicted_class_idx]
+        # Queue for the next batched forward pass
+        scheduler = batch_scheduler if model_version is None else ab_schedulers[model_version]
+        predictions, model_version = await scheduler.predict(processed_image)
         
-        # Get severity and message
-        if predicted_class.lower() == 'normal':
-            severity = "None"
-            message = "No kidney disease detected. Your kidneys appear healthy."
-        else:
-            if confidence > 0.9:
-                severity = "High"
-                message = f"Strong indication of {predicted_class.lower()} detected. Please consult a healthcare professional immediately."
-            elif confidence > 0.7:
-                severity = "Medium"
-                message = f"Moderate indication of {predicted_class.lower()} detected. Please consult a healthcare professional for proper diagnosis."
-            else:
-                severity = "Low"
-                message = f"Possible indication of {predicted_class.lower()} detected. Consider consulting a healthcare professional for further evaluation."
-        
-        # Get recommendations
-        if predicted_class.lower() == 'normal':
-            recommendations = [
-                "Continue maintaining a healthy lifestyle",
-                "Stay hydrated with adequate water intake",
-                "Regular exercise and balanced diet",
-                "Annual check-ups recommended"
-            ]
-        else:
-            recommendations = [
-                "Consult a nephrologist immediately",
-                "Follow up with additional tests",
-                "Monitor symptoms closely",
-                "Maintain prescribed medications if any"
-            ]
-            
-            if predicted_class.lower() == 'cyst':
-                recommendations.extend([
-                    "Monitor cyst size regularly",
-                    "Avoid activities that may cause trauma to the kidney area"
-                ])
-            elif predicted_class.lower() == 'stone':
-                recommendations.extend([
-                    "Increase water intake to help pass stones",
-                    "Follow dietary recommendations to prevent future stones"
-                ])
-            elif predicted_class.lower() == 'tumor':
-                recommendations.extend([
-                    "Seek immediate medical attention",
-                    "Prepare for potential imaging and biopsy procedures"
-                ])
-        
-        return {
-            "disease": predicted_class,
-            "confidence": confidence,
-            "severity": severity,
-            "message": message,
-            "recommendations": recommendations,
-            "timestamp": time.time(),
-            "validation_error": False
-        }
+        # Predicted class, severity, message and recommendations, as codes
+        result = prediction_result(predictions, model_version)
+        if ab_router is not None:
+            ab_router.record(result)
+        if shadow_evaluator is not None:
+            # The shadow model runs after this result is ready and is never waited for
+            shadow_evaluator.submit(processed_image, predictions, model_version)
+        return result
         
     except Exception as e:
         logger.error(f"Error making prediction: {e}")
         raise
 
+def decode_upload(image_data: memoryview) -> Image.Image:
+    """Decode upload bytes (CPU-bound, runs on the preprocessing pool)"""
+    with DECODE_SECONDS.time():
+        return decode_image(image_data, MAX_IMAGE_PIXELS)
+
+def count_prediction(prediction: Dict[str, Any]):
+    """Count a served result by predicted class, or as a validation rejection"""
+    if prediction["validation_error"]:
+        VALIDATION_REJECTIONS.inc()
+    else:
+        PREDICTIONS_BY_CLASS[prediction["class_index"]].inc()
+
+def prediction_cache_version(model_version: str) -> str:
+    return f"{model_version}-{PREPROCESSING_VERSION}-{RESULT_VERSION}"
+
+def route_request(image_hash: Optional[str] = None) -> Optional[str]:
+    """A/B arm for a request, or None for the active model version"""
+    return ab_router.choose(image_hash) if ab_router is not None else None
+
+def lookup_cached_prediction(image_data: memoryview):
+    """Upload hash, model version (see route_request) and its cached result (or None) for raw upload bytes"""
+    image_hash = hash_image(image_data)
+    model_version = route_request(image_hash)
+    cache_version = prediction_cache_version(model_version or model_registry.active.version)
+    return image_hash, model_version, prediction_cache.get(PredictionCache.key_from_hash(image_hash, cache_version))
+
+async def predict_image_bytes(image_data: memoryview, description: str) -> Dict[str, Any]:
+    """Coded result for raw upload bytes, skipping decode and inference on a cache hit"""
+    if not model_ready.is_set():
+        raise model_not_ready()
+    
+    image_hash = None
+    if prediction_cache is not None:
+        image_hash, model_version, cached = await run_in_pool(lookup_cached_prediction, image_data)
+        if cached is not None:
+            logger.info(f"Cache hit for {description}")
+            CACHE_HITS.inc()
+            count_prediction(cached)
+            if ab_router is not None:
+                ab_router.record(cached)
+            return cached
+    else:
+        model_version = route_request()
+    
+    try:
+        image = await run_in_pool(decode_upload, image_data)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    logger.info(f"Processing {description}, size: {image.size}")
+    
+    prediction = await predict_kidney_disease(image, model_version)
+    count_prediction(prediction)
+    
+    if image_hash is not None:
+        # Keyed by the version that actually produced the result, which may be newer than the one looked up
+        cache_key = PredictionCache.key_from_hash(image_hash, prediction_cache_version(prediction["model_version"]))
+        await run_in_pool(prediction_cache.set, cache_key, prediction)
+    return prediction
+
 @app.on_event("startup")
 async def startup_event():
-    """Load model on startup"""
-    load_model()
+    """Start loading the model, set up the prediction cache and start the batch scheduler on startup"""
+    global batch_scheduler, prediction_cache
+    # Loading and warm-up run in the background; /ready reports when they are done
+    threading.Thread(target=load_model_in_background, name="model-loader", daemon=True).start()
+    prediction_cache = create_prediction_cache()
+    batch_scheduler = BatchScheduler(run_model, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS)
+    batch_scheduler.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the batch schedulers, the shadow model and the model directory watcher"""
+    if batch_scheduler is not None:
+        batch_scheduler.stop()
+    for scheduler in ab_schedulers.values():
+        scheduler.stop()
+    if shadow_evaluator is not None:
+        shadow_evaluator.stop()
+    if model_registry is not None:
+        model_registry.stop()
+    shutdown_pool()
 
 @app.get("/")
 async def root():
@@ -303,62 +286,174 @@ async def root():
 async def health_check():
     return {"status": "healthy", "service": "kidney-disease-prediction"}
 
-@app.post("/predict")
-async def predict_disease(file: UploadFile = File(...)):
+@app.get("/ready")
+async def readiness_check():
+    """200 once the model is loaded and warmed up, 503 until then"""
+    if not model_ready.is_set():
+        raise model_not_ready()
+    return {"status": "ready", "model_version": model_registry.active.version}
+
+@app.get("/models")
+async def model_versions():
+    """Active, resident and available model versions"""
+    if model_registry is None:
+        raise model_not_ready()
+    return model_registry.stats()
+
+@app.post("/models/{version}/activate")
+async def activate_model_version(version: str, request: Request):
     """
-    Predict kidney disease from uploaded image
+    Serve a specific model version from MODEL_DIR, e.g. to roll back. Resident versions
+    switch instantly; others are loaded and warmed up first. Needs the X-Admin-Token header.
     """
+    if not MODEL_ADMIN_TOKEN or request.headers.get("x-admin-token") != MODEL_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model administration is disabled or the admin token is wrong")
+    if model_registry is None or version not in model_registry.available_versions():
+        raise HTTPException(status_code=404, detail=f"Unknown model version: {version}")
     try:
-        # Validate file type
-        if not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Read and validate image
-        image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data))
-        
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        logger.info(f"Processing image: {file.filename}, size: {image.size}")
-        
-        # Get prediction
-        prediction = predict_kidney_disease(image)
-        
-        return JSONResponse(content=prediction)
-        
+        model = await run_in_pool(model_registry.activate, version)
     except Exception as e:
-        logger.error(f"Error processing image: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+        logger.error(f"Error activating model version {version}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Could not load model version {version}: {str(e)}")
+    return {"active": model.version, "digest": model.digest}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Stage latency histograms, prediction counters and queue gauges in the Prometheus text format"""
+    return Response(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/metrics/batching")
+async def batching_metrics():
+    """Queue depth, batch-size histogram and wait-time metrics of the batch scheduler"""
+    if batch_scheduler is None:
+        raise HTTPException(status_code=503, detail="Batch scheduler not running")
+    return batch_scheduler.stats()
+
+@app.get("/metrics/experiments")
+async def experiment_metrics():
+    """Shadow-model agreement, A/B arm outcomes and per-version inference latency"""
+    return {
+        "latency_ms": inference_latency.stats(),
+        "shadow": shadow_evaluator.stats() if shadow_evaluator is not None else {"enabled": False},
+        "ab": ab_router.stats() if ab_router is not None else {"enabled": False},
+    }
+
+@app.get("/metrics/in-flight")
+async def in_flight_metrics():
+    """Number of prediction requests currently being processed"""
+    return inflight_limiter.stats()
+
+@app.get("/metrics/cache")
+async def cache_metrics():
+    """Prediction cache hit/miss/eviction counters"""
+    if prediction_cache is None:
+        return {"enabled": False}
+    return dict(prediction_cache.stats(), enabled=True)
+
+@app.post("/predict")
+async def predict_disease(request: Request, file: Optional[UploadFile] = File(None)):
+    """
+    Predict kidney disease from uploaded image
+    
+    Accepts a multipart upload in the "file" field, or the encoded image as the raw
+    request body (Content-Type: application/octet-stream or image/*). The Accept
+    header selects the response format (see responses.py).
+    """
+    raw_body = file is None
+    if raw_body and not is_raw_image_body(request.headers.get("content-type")):
+        raise HTTPException(status_code=400, detail="Send the image as a multipart \"file\" field or as an application/octet-stream body")
+    
+    # Validate file type
+    if not raw_body and not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    
+    media_type = negotiate(request.headers.get("accept"))
+    async with inflight_limiter:
+        try:
+            with READ_SECONDS.time():
+                if raw_body:
+                    image_data = memoryview(await read_body(request))
+                    description = "raw image body"
+                else:
+                    # Read the spooled upload into one buffer; decoding happens off the event loop unless the result is cached
+                    image_data = await run_in_pool(upload_buffer, file)
+                    description = f"image: {file.filename}"
+            
+            # Get prediction
+            prediction = await predict_image_bytes(image_data, description)
+            
+            with SERIALIZATION_SECONDS.time():
+                return make_response(prediction, media_type, time.time())
+            
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing image: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
 @app.post("/predict-base64")
-async def predict_disease_base64(data: Dict[str, str]):
+async def predict_disease_base64(request: Request):
     """
     Predict kidney disease from base64 encoded image
+    
+    Expects a JSON body of the form {"image": "<base64 data>"}, or the encoded
+    image itself with Content-Type: application/octet-stream (no base64 overhead).
     """
-    try:
-        if "image" not in data:
-            raise HTTPException(status_code=400, detail="Image data not provided")
-        
-        # Decode base64 image
-        image_data = base64.b64decode(data["image"])
-        image = Image.open(io.BytesIO(image_data))
-        
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        logger.info(f"Processing base64 image, size: {image.size}")
-        
-        # Get prediction
-        prediction = predict_kidney_disease(image)
-        
-        return JSONResponse(content=prediction)
-        
-    except Exception as e:
-        logger.error(f"Error processing base64 image: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+    media_type = negotiate(request.headers.get("accept"))
+    async with inflight_limiter:
+        try:
+            # Read the body (size-limited), then decode the base64 image off the event loop
+            with READ_SECONDS.time():
+                body = await read_body(request)
+                if is_raw_image_body(request.headers.get("content-type")):
+                    image_data = memoryview(body)
+                else:
+                    image_data = await run_in_pool(decode_base64_payload, body)
+            
+            # Get prediction
+            prediction = await predict_image_bytes(image_data, "base64 image")
+            
+            with SERIALIZATION_SECONDS.time():
+                return make_response(prediction, media_type, time.time())
+            
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing base64 image: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+
+@app.post("/predict-batch")
+async def predict_disease_batch(request: Request, files: List[UploadFile] = File(...)):
+    """
+    Predict kidney disease for many images, or zip/tar archives of images
+    
+    Streams newline-delimited JSON: one object per image, in completion order,
+    with the same fields as /predict plus "index" and "filename". Lines use the
+    compact format when it (or msgpack) is accepted.
+    """
+    for upload in files:
+        if not is_archive(upload.filename or "") and not (upload.content_type or "").startswith('image/'):
+            raise HTTPException(status_code=400, detail=f"{upload.filename} is not an image or a zip/tar archive")
+    
+    # NDJSON lines are always JSON, so msgpack falls back to compact JSON
+    media_type = negotiate(request.headers.get("accept"))
+    if media_type in MSGPACK_MEDIA_TYPES:
+        media_type = COMPACT_JSON_MEDIA_TYPE
+    
+    async def predict_item(image_data, description: str) -> Dict[str, Any]:
+        prediction = await predict_image_bytes(image_data, description)
+        with SERIALIZATION_SECONDS.time():
+            return render(prediction, media_type, time.time())
+    
+    # The whole batch holds one in-flight slot until the response ends; taken
+    # here so a full server answers 503 before any line is streamed
+    inflight_limiter.acquire()
+    
+    async def ndjson_lines():
+        async for line in stream_predictions(iter_upload_images(files), predict_item):
+            yield line
+    
+    return SlotStreamingResponse(ndjson_lines(), inflight_limiter, media_type="application/x-ndjson")
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
@@ -0,0 +1,87 @@
+"""
+Prometheus metrics, rendered in the text exposition format by ``GET /metrics``.
+
+The metrics are prometheus_client counters, gauges and histograms in the API's
+own registry. Values kept by other components (in-flight requests, batch queue
+depth) are read when ``/metrics`` is scraped, through ``scraped``: until the
+component is up they read as 0, and the failure is logged once.
+"""
+
+import logging
+from typing import Callable
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily
+
+from responses import CLASSES
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Upper bounds (in seconds) of the stage latency buckets: 100 us to 10 s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0)
+
+REGISTRY = CollectorRegistry()
+
+
+def scraped(description: str, function: Callable[[], float]) -> Callable[[], float]:
+    """Reads function() at scrape time; 0 while the component it reads from is not up yet"""
+    failed = False
+
+    def read() -> float:
+        nonlocal failed
+        try:
+            return float(function())
+        except Exception as e:
+            if not failed:
+                failed = True
+                logger.warning(f"Metrics: {description} unavailable, reported as 0 ({e!r})")
+            return 0.0
+
+    return read
+
+
+class ScrapedCounter:
+    """A counter kept by another component, read when /metrics is scraped (see set_function)"""
+
+    def __init__(self, name: str, documentation: str, registry: CollectorRegistry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.function: Callable[[], float] = lambda: 0.0
+        registry.register(self)
+
+    def set_function(self, function: Callable[[], float]):
+        self.function = function
+
+    def collect(self):
+        yield CounterMetricFamily(self.name, self.documentation, value=self.function())
+
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
+
+
+# Pipeline metrics shared by main.py and main_optimized.py (only one of them runs per process)
+STAGE_SECONDS = Histogram("kidney_stage_seconds", "Time spent in each stage of a prediction request", ["stage"],
+                          buckets=LATENCY_BUCKETS, registry=REGISTRY)
+READ_SECONDS = STAGE_SECONDS.labels("read")
+DECODE_SECONDS = STAGE_SECONDS.labels("decode")
+VALIDATION_SECONDS = STAGE_SECONDS.labels("validation")
+PREPROCESS_SECONDS = STAGE_SECONDS.labels("preprocess")
+LOCK_WAIT_SECONDS = STAGE_SECONDS.labels("model_lock_wait")  # Per batch
+INFERENCE_SECONDS = STAGE_SECONDS.labels("inference")  # Per batch
+SERIALIZATION_SECONDS = STAGE_SECONDS.labels("serialization")
+
+PREDICTIONS = Counter("kidney_predictions", "Predictions served, by predicted class", ["disease"], registry=REGISTRY)
+PREDICTIONS_BY_CLASS = [PREDICTIONS.labels(name) for name in CLASSES]
+VALIDATION_REJECTIONS = Counter("kidney_validation_rejections", "Uploads rejected as not a kidney CT scan",
+                                registry=REGISTRY)
+CACHE_HITS = Counter("kidney_prediction_cache_hits", "Predictions served from the prediction cache",
+                     registry=REGISTRY)
+IN_FLIGHT = Gauge("kidney_in_flight_requests", "Prediction requests currently being processed", registry=REGISTRY)
+IN_FLIGHT_REJECTED = ScrapedCounter("kidney_in_flight_rejected",
+                                    "Requests rejected with 503 because too many were in flight")
+BATCH_QUEUE_DEPTH = Gauge("kidney_batch_queue_depth", "Images waiting for the next batched forward pass",
+                          registry=REGISTRY)
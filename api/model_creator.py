@@ -1,39 +1,4 @@
-import numpy as np
-import tensorflow as tf
-from keras.models import Sequential
-from keras.layers import Conv2D, MaxPooling2D, Dropout, Flatten, Dense
-
-def create_kidney_model():
-    """
-    Create the kidney classification model based on the notebook architecture
-    """
-    IMGSIZE = 128
-    
-    model = Sequential()
-    
-    model.add(Conv2D(filters=32, kernel_size=(3, 3), activation='relu', input_shape=(IMGSIZE, IMGSIZE, 3)))
-    model.add(MaxPooling2D((2,2)))
-    model.add(Dropout(0.25))
-    
-    model.add(Conv2D(filters=64, kernel_size=(3, 3), activation='relu'))
-    model.add(MaxPooling2D((2,2)))
-    
-    model.add(Conv2D(filters=128, kernel_size=(3, 3), activation='relu'))
-    model.add(MaxPooling2D((2,2)))
-    
-    model.add(Flatten())
-    model.add(Dense(256, activation='relu'))
-    model.add(Dropout(0.25))
-    
-    model.add(Dense(128, activation='relu'))
-    model.add(Dropout(0.25))
-    
-    model.add(Dense(64, activation='relu'))
-    model.add(Dense(4, activation='softmax'))
-    
-    model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
-    
-    return model
+from kidney_model import create_kidney_model
 
 def save_model():
     """
@@ -44,4 +9,4 @@ def save_model():
     print("Model saved as kidney_model.h5")
 
 if __name__ == "__main__":
-    save_model() 
\ No newline at end of file
+    save_model()
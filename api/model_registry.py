@@ -0,0 +1,270 @@
+"""
+Versioned model registry with hot reload.
+
+Models are served from ``MODEL_DIR``, one sub-directory per version holding
+the backend's model file (for the keras backend ``kidney_model.npz`` is used
+when present, see kidney_model.py)::
+
+    models/
+        2024-05-01/kidney_model.h5
+        2024-06-12/kidney_model.npz
+
+Versions are ordered by name (digit runs compare numerically, so ``v10`` comes
+after ``v9``) and the newest one is served. A watcher thread polls the
+directory every ``MODEL_POLL_SECONDS``; when a new version appears it is
+loaded and warmed up in the background and then swapped in atomically.
+Requests already running keep the model they started with, so nothing is
+dropped. The last ``MODEL_KEEP_VERSIONS`` versions stay loaded, so rolling
+back to one of them is instant. Versions can also be pinned: kept loaded, but
+not served by default (A/B arms and shadow models, see experiments.py).
+
+Publish a version by writing it under a name starting with ``.`` (ignored by
+the watcher) and renaming the directory once it is complete.
+
+Without ``MODEL_DIR`` (or when ``MODEL_PATH`` is set) the single model file is
+served as before, versioned by its content hash. A model that fails to load is
+reported, never replaced by an untrained network.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from backends import DEFAULT_MODEL_PATHS, InferenceBackend, create_backend
+from kidney_model import WEIGHTS_FILENAME
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = os.getenv("MODEL_DIR")  # Versioned model directory; MODEL_PATH takes precedence
+MODEL_KEEP_VERSIONS = int(os.getenv("MODEL_KEEP_VERSIONS", "2"))  # Versions kept loaded for rollback
+MODEL_POLL_SECONDS = float(os.getenv("MODEL_POLL_SECONDS", "10"))  # 0 disables watching MODEL_DIR
+
+
+def version_sort_key(version: str):
+    """Natural sort key: digit runs compare as numbers"""
+    return [(0, int(part), "") if part.isdigit() else (1, 0, part) for part in re.split(r"(\d+)", version) if part]
+
+
+class LoadedModel:
+    """A warmed-up inference backend and the version it serves"""
+
+    def __init__(self, version: str, backend: InferenceBackend):
+        self.version = version
+        self.backend = backend
+        # Content hash of the model file
+        self.digest = backend.version
+        self.loaded_at = time.time()
+
+    def __repr__(self):
+        return f"LoadedModel(version={self.version!r}, digest={self.digest!r})"
+
+
+class ModelRegistry:
+    """Loads model versions, keeps the most recent ones resident and swaps the active one"""
+
+    def __init__(self, backend_name: str, model_dir: Optional[str] = MODEL_DIR, model_path: Optional[str] = None,
+                 keep_versions: int = MODEL_KEEP_VERSIONS, poll_seconds: float = MODEL_POLL_SECONDS,
+                 on_evict: Optional[Callable[[LoadedModel], None]] = None, **backend_kwargs):
+        self.backend_name = backend_name.lower()
+        # An explicit model file wins over the versioned directory
+        self.model_dir = None if model_path else model_dir
+        self.model_path = model_path or DEFAULT_MODEL_PATHS.get(self.backend_name)
+        self.model_filename = os.path.basename(DEFAULT_MODEL_PATHS.get(self.backend_name, ""))
+        self.keep_versions = max(1, keep_versions)
+        self.poll_seconds = poll_seconds
+        self.on_evict = on_evict
+        self.backend_kwargs = backend_kwargs
+
+        self._active: Optional[LoadedModel] = None
+        self._resident: "OrderedDict[str, LoadedModel]" = OrderedDict()
+        # Never unloaded, and not counted in keep_versions
+        self._pinned = set()
+        # Versions the watcher has already acted on (loaded, or failed to load)
+        self._seen: Dict[str, float] = {}
+        self.failures: Dict[str, str] = {}
+        self.swaps = 0
+        self._load_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+
+    @property
+    def active(self) -> Optional[LoadedModel]:
+        """The model serving new requests; read it once per request or batch"""
+        return self._active
+
+    def _version_path(self, version: str) -> str:
+        if self.backend_name == "keras":
+            # Validated .npz weights (see kidney_model.py) load faster than the full Keras file
+            weights = os.path.join(self.model_dir, version, WEIGHTS_FILENAME)
+            if os.path.isfile(weights):
+                return weights
+        return os.path.join(self.model_dir, version, self.model_filename)
+
+    def available_versions(self) -> List[str]:
+        """Complete versions in the model directory, oldest first"""
+        if self.model_dir is None:
+            return []
+        try:
+            names = os.listdir(self.model_dir)
+        except OSError as e:
+            logger.warning(f"Cannot list model directory {self.model_dir}: {e}")
+            return []
+        versions = [name for name in names if not name.startswith(".") and os.path.isfile(self._version_path(name))]
+        return sorted(versions, key=version_sort_key)
+
+    def _load(self, version: str) -> LoadedModel:
+        """Load and warm up a version without activating it"""
+        resident = self._resident.get(version)
+        if resident is not None:
+            return resident
+        path = self._version_path(version) if self.model_dir is not None else self.model_path
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Model file not found: {path}")
+        started = time.perf_counter()
+        backend = create_backend(self.backend_name, path, **self.backend_kwargs)
+        backend.warmup()
+        # In single-file mode the content hash is the version
+        model = LoadedModel(version if self.model_dir is not None else backend.version, backend)
+        logger.info(f"Loaded model version {model.version} in {time.perf_counter() - started:.1f}s")
+        return model
+
+    def activate(self, version: str) -> LoadedModel:
+        """Load (unless resident) and warm up a version, then make it the active one"""
+        with self._load_lock:
+            try:
+                model = self._load(version)
+            except Exception as e:
+                self.failures[version] = str(e)
+                raise
+            self.failures.pop(version, None)
+            self._resident[model.version] = model
+            self._resident.move_to_end(model.version)
+            previous, self._active = self._active, model  # Atomic swap: the next batch uses the new model
+            if previous is not model:
+                self.swaps += 1
+                logger.info(f"Serving model version {model.version}"
+                            + (f" (was {previous.version})" if previous is not None else ""))
+            self._evict()
+            return model
+
+    def pin(self, version: str) -> LoadedModel:
+        """Load (unless resident) and warm up a version and keep it loaded, without activating it"""
+        if self.model_dir is None:
+            raise ValueError(f"Cannot load model version {version}: MODEL_DIR is not set")
+        with self._load_lock:
+            try:
+                model = self._load(version)
+            except Exception as e:
+                self.failures[version] = str(e)
+                raise
+            self.failures.pop(version, None)
+            self._resident[model.version] = model
+            self._pinned.add(model.version)
+            return model
+
+    def get(self, version: str) -> Optional[LoadedModel]:
+        """A resident version, or None"""
+        return self._resident.get(version)
+
+    def _evict(self):
+        unpinned = [version for version in self._resident if version not in self._pinned]
+        excess = len(unpinned) - self.keep_versions
+        for version in unpinned:
+            if excess <= 0:
+                break
+            model = self._resident[version]
+            if model is self._active:
+                continue
+            excess -= 1
+            del self._resident[version]
+            logger.info(f"Unloaded model version {version}")
+            if self.on_evict is not None:
+                self.on_evict(model)
+
+    def load_initial(self) -> LoadedModel:
+        """Activate the newest available version (or the single model file)"""
+        if self.model_dir is None:
+            return self.activate(os.path.basename(self.model_path))
+        versions = self.available_versions()
+        if not versions:
+            raise FileNotFoundError(f"No model versions in {self.model_dir} (expected <version>/{self.model_filename})")
+        # Fall back to older versions if the newest cannot be loaded
+        for version in reversed(versions):
+            self._seen[version] = self._mtime(version)
+            try:
+                return self.activate(version)
+            except Exception as e:
+                logger.error(f"Could not load model version {version}: {e}")
+        raise RuntimeError(f"No model version in {self.model_dir} could be loaded: {self.failures}")
+
+    def _mtime(self, version: str) -> float:
+        try:
+            return os.path.getmtime(self._version_path(version))
+        except OSError:
+            return 0.0
+
+    def poll(self) -> Optional[LoadedModel]:
+        """Activate the newest version that appeared (or changed after failing) since the last poll"""
+        new_versions = []
+        for version in self.available_versions():
+            mtime = self._mtime(version)
+            # A version that failed to load is retried once its file is replaced
+            if version not in self._seen or (version in self.failures and self._seen[version] != mtime):
+                new_versions.append(version)
+            self._seen[version] = mtime
+        if not new_versions:
+            return None
+        newest = new_versions[-1]
+        if self._active is not None and version_sort_key(newest) < version_sort_key(self._active.version):
+            # Only roll forward automatically; older versions are activated explicitly
+            return None
+        try:
+            return self.activate(newest)
+        except Exception as e:
+            logger.error(f"Could not load model version {newest}, still serving "
+                         f"{self._active.version if self._active else 'nothing'}: {e}")
+            return None
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Model directory poll failed: {e}")
+
+    def start(self):
+        """Start watching the model directory for new versions"""
+        if self.model_dir is None or self.poll_seconds <= 0 or self._watcher is not None:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name="model-watcher", daemon=True)
+        self._watcher.start()
+        logger.info(f"Watching {self.model_dir} for new model versions every {self.poll_seconds:g}s")
+
+    def stop(self):
+        if self._watcher is None:
+            return
+        self._stop.set()
+        self._watcher.join(timeout=5)
+        self._watcher = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Active and resident versions, versions on disk and load failures"""
+        active = self._active
+        return {
+            "active": active.version if active else None,
+            "active_digest": active.digest if active else None,
+            "backend": self.backend_name,
+            "model_dir": self.model_dir,
+            "resident": [{"version": model.version, "digest": model.digest, "loaded_at": model.loaded_at}
+                         for model in list(self._resident.values())],
+            "pinned": sorted(self._pinned, key=version_sort_key),
+            "available": self.available_versions(),
+            "keep_versions": self.keep_versions,
+            "swaps": self.swaps,
+            "failures": dict(self.failures),
+        }
@@ -1,88 +1,40 @@
 import numpy as np
-import cv2
-import tensorflow as tf
 from PIL import Image
 import logging
-from typing import Dict, Any, Tuple
+import threading
+from typing import Dict, Any, Optional, Tuple
 import os
 
+from backends import DEFAULT_MODEL_PATHS, InferenceBackend, create_backend
+from kidney_model import CLASSES
+from preprocessing import IMGSIZE, resize_uint8, to_model_input
+from responses import (DISEASE_RECOMMENDATIONS, MESSAGES, RECOMMENDATION_TEXT, RECOMMENDATIONS, RESPONSE_TEXT,
+                       SEVERITIES, severity_and_message)
+
 logger = logging.getLogger(__name__)
 
 class KidneyModelService:
-    def __init__(self):
-        self.model = None
-        self.classes = ['Cyst', 'Normal', 'Stone', 'Tumor']
-        self.IMGSIZE = 128
-        self.model_path = 'kidney_model.h5'
+    def __init__(self, backend: Optional[str] = None, model_path: Optional[str] = None):
+        self.backend: Optional[InferenceBackend] = None
+        self.classes = list(CLASSES)
+        self.IMGSIZE = IMGSIZE
+        # Inference backend: 'keras', 'tflite' or 'onnx'
+        self.backend_name = (backend or os.getenv('MODEL_BACKEND', 'keras')).lower()
+        self.model_path = model_path or os.getenv('MODEL_PATH') or DEFAULT_MODEL_PATHS.get(self.backend_name)
         self.load_model()
     
     def load_model(self):
-        """Load the trained kidney classification model"""
-        try:
-            if os.path.exists(self.model_path):
-                self.model = tf.keras.models.load_model(self.model_path)
-                logger.info("Model loaded successfully from saved file")
-            else:
-                logger.warning("Saved model not found. Creating new model (will need training)")
-                self.model = self.create_model()
-        except Exception as e:
-            logger.error(f"Error loading model: {e}")
-            self.model = self.create_model()
-    
-    def create_model(self):
-        """Create the CNN model architecture"""
-        from tensorflow.keras.models import Sequential
-        from tensorflow.keras.layers import Conv2D, MaxPooling2D, Dropout, Flatten, Dense
-        
-        model = Sequential()
-        
-        model.add(Conv2D(filters=32, kernel_size=(3, 3), activation='relu', input_shape=(self.IMGSIZE, self.IMGSIZE, 3)))
-        model.add(MaxPooling2D((2,2)))
-        model.add(Dropout(0.25))
-        
-        model.add(Conv2D(filters=64, kernel_size=(3, 3), activation='relu'))
-        model.add(MaxPooling2D((2,2)))
-        
-        model.add(Conv2D(filters=128, kernel_size=(3, 3), activation='relu'))
-        model.add(MaxPooling2D((2,2)))
-        
-        model.add(Flatten())
-        model.add(Dense(256, activation='relu'))
-        model.add(Dropout(0.25))
-        
-        model.add(Dense(128, activation='relu'))
-        model.add(Dropout(0.25))
-        
-        model.add(Dense(64, activation='relu'))
-        model.add(Dense(4, activation='softmax'))
-        
-        model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
-        
-        return model
+        """Load the trained kidney classification model into the configured backend"""
+        # A missing or broken model is an error, never silently replaced by an untrained network
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"Model file not found: {self.model_path}")
+        self.backend = create_backend(self.backend_name, self.model_path)
+        logger.info("Model loaded successfully from saved file")
     
     def preprocess_image(self, image: Image.Image) -> np.ndarray:
         """Preprocess image for model input"""
         try:
-            # Convert PIL image to numpy array
-            img_array = np.array(image)
-            
-            # Convert to RGB if needed
-            if len(img_array.shape) == 3 and img_array.shape[2] == 4:  # RGBA
-                img_array = cv2.cvtColor(img_array, cv2.COLOR_RGBA2RGB)
-            elif len(img_array.shape) == 2:  # Grayscale
-                img_array = cv2.cvtColor(img_array, cv2.COLOR_GRAY2RGB)
-            
-            # Resize to model input size
-            img_resized = cv2.resize(img_array, (self.IMGSIZE, self.IMGSIZE))
-            
-            # Normalize pixel values
-            img_normalized = img_resized.astype(np.float32) / 255.0
-            
-            # Add batch dimension
-            img_batch = np.expand_dims(img_normalized, axis=0)
-            
-            return img_batch
-            
+            return to_model_input([resize_uint8(image)])
         except Exception as e:
             logger.error(f"Error preprocessing image: {e}")
             raise
@@ -90,14 +42,14 @@ class KidneyModelService:
     def predict(self, image: Image.Image) -> Dict[str, Any]:
         """Make prediction on the input image"""
         try:
-            if self.model is None:
+            if self.backend is None:
                 raise Exception("Model not loaded")
             
             # Preprocess image
             processed_image = self.preprocess_image(image)
             
             # Make prediction
-            predictions = self.model.predict(processed_image, verbose=False)
+            predictions = self.predict_batch(processed_image)
             
             # Get predicted class and confidence
             predicted_class_idx = np.argmax(predictions[0])
@@ -121,58 +73,49 @@ class KidneyModelService:
             logger.error(f"Error making prediction: {e}")
             raise
     
+    def predict_batch(self, batch: np.ndarray) -> np.ndarray:
+        """Class probabilities for a preprocessed batch of shape (N, IMGSIZE, IMGSIZE, 3)"""
+        if self.backend is None:
+            raise Exception("Model not loaded")
+        return self.backend.predict(batch)
+    
+    def class_index(self, disease: str) -> Optional[int]:
+        """Index of a class name, compared case-insensitively; None for any other name"""
+        for index, name in enumerate(self.classes):
+            if name.lower() == disease.lower():
+                return index
+        return None
+    
     def get_severity_and_message(self, disease: str, confidence: float) -> Tuple[str, str]:
         """Get severity level and message based on prediction"""
-        if disease.lower() == 'normal':
-            severity = "None"
-            message = "No kidney disease detected. Your kidneys appear healthy."
-        else:
-            if confidence > 0.9:
-                severity = "High"
-                message = f"Strong indication of {disease.lower()} detected. Please consult a healthcare professional immediately."
-            elif confidence > 0.7:
-                severity = "Medium"
-                message = f"Moderate indication of {disease.lower()} detected. Please consult a healthcare professional for proper diagnosis."
-            else:
-                severity = "Low"
-                message = f"Possible indication of {disease.lower()} detected. Consider consulting a healthcare professional for further evaluation."
-        
-        return severity, message
+        class_index = self.class_index(disease)
+        if class_index is None:
+            # Not a class (e.g. "Invalid Image"): the generic wording by confidence
+            severity, message = severity_and_message(class_index, confidence)
+            return SEVERITIES[severity], MESSAGES[message].format(disease=disease.lower())
+        text = RESPONSE_TEXT[(class_index, severity_and_message(class_index, confidence)[0])]
+        return text["severity"], text["message"]
     
     def get_recommendations(self, disease: str, severity: str) -> list:
         """Get personalized recommendations based on prediction"""
-        if disease.lower() == 'normal':
-            return [
-                "Continue maintaining a healthy lifestyle",
-                "Stay hydrated with adequate water intake",
-                "Regular exercise and balanced diet",
-                "Annual check-ups recommended"
-            ]
-        else:
-            recommendations = [
-                "Consult a nephrologist immediately",
-                "Follow up with additional tests",
-                "Monitor symptoms closely",
-                "Maintain prescribed medications if any"
-            ]
-            
-            if disease.lower() == 'cyst':
-                recommendations.extend([
-                    "Monitor cyst size regularly",
-                    "Avoid activities that may cause trauma to the kidney area"
-                ])
-            elif disease.lower() == 'stone':
-                recommendations.extend([
-                    "Increase water intake to help pass stones",
-                    "Follow dietary recommendations to prevent future stones"
-                ])
-            elif disease.lower() == 'tumor':
-                recommendations.extend([
-                    "Seek immediate medical attention",
-                    "Prepare for potential imaging and biopsy procedures"
-                ])
-            
-            return recommendations
+        class_index = self.class_index(disease)
+        if class_index is None:
+            return [RECOMMENDATIONS[code] for code in DISEASE_RECOMMENDATIONS]
+        return list(RECOMMENDATION_TEXT[class_index])
+
+_model_service: Optional[KidneyModelService] = None
+_model_service_lock = threading.Lock()
+
+def get_model_service() -> KidneyModelService:
+    """Shared model service instance, created (and its model loaded) on first use"""
+    global _model_service
+    with _model_service_lock:
+        if _model_service is None:
+            _model_service = KidneyModelService()
+        return _model_service
 
-# Global model service instance
-model_service = KidneyModelService() 
\ No newline at end of file
+def __getattr__(name: str):
+    # `from model_service import model_service` keeps working without loading the model at import time
+    if name == "model_service":
+        return get_model_service()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}") 
\ No newline at end of file
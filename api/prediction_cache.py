@@ -0,0 +1,223 @@
+"""
+Content-addressed cache of prediction results.
+
+Entries are keyed by a fast hash of the raw upload bytes plus the model
+version, so a byte-identical retry (the mobile app retries the same upload
+across its list of server URLs) skips decoding, validation and inference, and a
+model change never serves stale results.
+
+Two storage backends are available:
+
+- ``MemoryCacheBackend``: per-process LRU with optional TTL
+- ``FileCacheBackend``: one JSON file per entry in a shared directory, so all
+  workers on a host share results (point it at a tmpfs such as /dev/shm)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "1024"))  # 0 disables the cache
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "3600"))  # Seconds, 0 means no expiry
+PREDICTION_CACHE_DIR = os.getenv("PREDICTION_CACHE_DIR")  # Set to share the cache between workers
+
+
+def hash_image(image_data) -> str:
+    """128-bit BLAKE2b digest of the raw upload bytes"""
+    return hashlib.blake2b(image_data, digest_size=16).hexdigest()
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache with optional TTL expiry"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float = 0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if self.ttl_seconds and time.time() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete_prefix(self, prefix: str) -> int:
+        with self._lock:
+            keys = [key for key in self._entries if key.startswith(prefix)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileCacheBackend:
+    """
+    Cache shared between processes through a directory of JSON files.
+    Entries expire by file age; the oldest files are pruned once the directory
+    grows past ``max_entries``.
+    """
+
+    def __init__(self, directory: str, max_entries: int, ttl_seconds: float = 0, prune_every: int = 64):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.prune_every = prune_every
+        self.evictions = 0
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key.replace(":", "_") + ".json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            if self.ttl_seconds and time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                os.remove(path)
+                self.evictions += 1
+                return None
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        # Write to a temporary file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Could not write prediction cache entry: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self._prune()
+
+    def _prune(self):
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")]
+            excess = len(entries) - self.max_entries
+            if excess <= 0:
+                return
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in entries[:excess]:
+                os.remove(entry.path)
+                self.evictions += 1
+        except OSError as e:
+            logger.warning(f"Could not prune prediction cache: {e}")
+
+    def delete_prefix(self, prefix: str) -> int:
+        removed = 0
+        name_prefix = prefix.replace(":", "_")
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name.startswith(name_prefix) and entry.name.endswith(".json"):
+                    os.remove(entry.path)
+                    removed += 1
+        except OSError as e:
+            logger.warning(f"Could not invalidate prediction cache entries: {e}")
+        return removed
+
+    def __len__(self):
+        try:
+            return sum(1 for entry in os.scandir(self.directory) if entry.name.endswith(".json"))
+        except OSError:
+            return 0
+
+
+class PredictionCache:
+    """Prediction results keyed by upload hash and model version, with hit/miss/eviction counters"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        # Lookups run on the preprocessing pool's threads, and += is not atomic
+        self._counter_lock = threading.Lock()
+
+    @staticmethod
+    def key(image_data, model_version: str) -> str:
+        return PredictionCache.key_from_hash(hash_image(image_data), model_version)
+
+    @staticmethod
+    def key_from_hash(image_hash: str, model_version: str) -> str:
+        return f"{model_version}:{image_hash}"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self.backend.get(key)
+        with self._counter_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]):
+        # Timestamps are per response, not part of the cached result
+        self.backend.set(key, {k: v for k, v in value.items() if k != "timestamp"})
+
+    def invalidate(self, model_version: str) -> int:
+        """Drop every entry cached for a model version (or version prefix); returns how many were dropped"""
+        removed = self.backend.delete_prefix(model_version)
+        if removed:
+            logger.info(f"Dropped {removed} cached predictions of model version {model_version}")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._counter_lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "max_entries": self.backend.max_entries,
+            "ttl_seconds": self.backend.ttl_seconds,
+            "hits": hits,
+            "misses": misses,
+            "evictions": self.backend.evictions,
+            "hit_rate": (hits / lookups) if lookups else 0.0,
+        }
+
+
+def create_prediction_cache(max_entries: int = PREDICTION_CACHE_SIZE, ttl_seconds: float = PREDICTION_CACHE_TTL,
+                            directory: Optional[str] = PREDICTION_CACHE_DIR) -> Optional[PredictionCache]:
+    """Build the configured cache, or None when caching is disabled"""
+    if max_entries <= 0:
+        return None
+    if directory:
+        backend = FileCacheBackend(directory, max_entries, ttl_seconds)
+    else:
+        backend = MemoryCacheBackend(max_entries, ttl_seconds)
+    logger.info(f"Prediction cache enabled ({type(backend).__name__}, max_entries={max_entries}, ttl={ttl_seconds}s)")
+    return PredictionCache(backend)
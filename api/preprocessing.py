@@ -0,0 +1,167 @@
+"""
+Image preprocessing for the kidney classification model.
+
+This is the only place images are turned into model input; the API, the model
+service, bulk scoring, quantization and export all go through it. It matches the
+notebook's training transform:
+
+    img = cv2.imread(path)                      # BGR, uint8, EXIF-oriented
+    img = cv2.resize(img, (IMGSIZE, IMGSIZE))   # INTER_LINEAR
+    # no scaling: the model was trained on 0-255 pixel values
+
+Images with a side shorter than 2 * DRAFT_MIN_SIZE are decoded at full
+resolution and produce exactly the training input (see check_preprocessing.py).
+Larger JPEGs are decoded with PIL's draft mode, which lets libjpeg scale by 1/2,
+1/4 or 1/8 during decoding while keeping at least DRAFT_MIN_SIZE pixels, so a
+4000x3000 photo is decoded at 1000x750 instead of at full resolution. Resizing
+happens in uint8 and only the IMGSIZE x IMGSIZE result is converted to float32.
+
+OpenCV is imported on first use rather than at import time, so importing this
+module (and the API) stays cheap.
+"""
+
+import io
+from typing import Optional, Sequence, Union
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from kidney_model import IMGSIZE, INPUT_SHAPE
+
+DRAFT_MIN_SIZE = 4 * IMGSIZE
+# Bumped whenever the transform changes, so cached predictions made with the old one are not reused
+PREPROCESSING_VERSION = "2"
+
+ImageSource = Union[bytes, bytearray, memoryview, str]
+
+
+class ImageTooLarge(ValueError):
+    """The image header declares more pixels than the caller allows"""
+
+
+class BufferReader(io.RawIOBase):
+    """Seekable file object over a memoryview; unlike BytesIO it does not copy the buffer"""
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast("B")
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        chunk = self._view[self._position:self._position + len(b)]
+        b[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+def decode_image(source: ImageSource, max_pixels: Optional[int] = None) -> Image.Image:
+    """
+    Decode raw image bytes (or a file path) into an RGB PIL image.
+    Large JPEGs are decoded at the smallest libjpeg scale that keeps both sides
+    at least DRAFT_MIN_SIZE. With ``max_pixels``, images whose header declares
+    more pixels are rejected with ImageTooLarge before any pixel data is decoded.
+    """
+    if isinstance(source, bytes):
+        # BytesIO shares an immutable bytes buffer instead of copying it
+        source = io.BytesIO(source)
+    elif isinstance(source, (bytearray, memoryview)):
+        source = BufferReader(source)
+    image = Image.open(source)
+
+    # Image.open only parses the header, so the size is known before decoding
+    width, height = image.size
+    if max_pixels is not None and width * height > max_pixels:
+        raise ImageTooLarge(f"Image is {width}x{height} pixels, the limit is {max_pixels} pixels")
+
+    # Only JPEG supports draft mode; other formats ignore it
+    image.draft('RGB', (DRAFT_MIN_SIZE, DRAFT_MIN_SIZE))
+
+    # cv2.imread applies the EXIF orientation, so training images were upright
+    ImageOps.exif_transpose(image, in_place=True)
+
+    # Convert to RGB if necessary (grayscale is replicated, alpha is dropped, as cv2.imread does)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    return image
+
+
+def resize_uint8(image: Image.Image) -> np.ndarray:
+    """Resize a decoded RGB image to an IMGSIZE x IMGSIZE BGR uint8 array"""
+    import cv2
+
+    img_array = np.asarray(image)
+    if img_array.ndim == 2:
+        img_array = cv2.cvtColor(img_array, cv2.COLOR_GRAY2RGB)
+    elif img_array.shape[2] == 4:
+        img_array = cv2.cvtColor(img_array, cv2.COLOR_RGBA2RGB)
+    img_resized = cv2.resize(img_array, (IMGSIZE, IMGSIZE), interpolation=cv2.INTER_LINEAR)
+    # The channel swap is done at IMGSIZE, where it is cheap
+    return cv2.cvtColor(img_resized, cv2.COLOR_RGB2BGR)
+
+
+def allocate_batch(batch_size: int) -> np.ndarray:
+    """Uninitialised (N, IMGSIZE, IMGSIZE, 3) float32 model input buffer"""
+    return np.empty((batch_size,) + INPUT_SHAPE, dtype=np.float32)
+
+
+def _output_view(batch_size: int, out: Optional[np.ndarray]) -> np.ndarray:
+    if out is None:
+        return allocate_batch(batch_size)
+    if out.shape[1:] != INPUT_SHAPE or out.dtype != np.float32 or len(out) < batch_size:
+        raise ValueError(f"Output buffer {out.shape} {out.dtype} cannot hold {batch_size} model inputs")
+    return out[:batch_size]
+
+
+def to_model_input(images: Sequence[np.ndarray], out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Cast resized uint8 images into a (N, IMGSIZE, IMGSIZE, 3) float32 batch.
+    With ``out`` the batch is written into (the first N rows of) that buffer.
+    """
+    batch = _output_view(len(images), out)
+    for i, img_resized in enumerate(images):
+        batch[i] = img_resized
+    return batch
+
+
+def preprocess_batch(sources: Sequence[ImageSource], out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Decode, resize and stack encoded images (bytes or file paths) into a
+    (N, IMGSIZE, IMGSIZE, 3) float32 batch. With ``out`` the batch is written into
+    (the first N rows of) that buffer, so a caller can reuse one allocation.
+    """
+    batch = _output_view(len(sources), out)
+    for i, source in enumerate(sources):
+        batch[i] = resize_uint8(decode_image(source))
+    return batch
+
+
+def preprocess_image(source: ImageSource) -> np.ndarray:
+    """Model input of shape (1, IMGSIZE, IMGSIZE, 3) for a single encoded image"""
+    return preprocess_batch([source])
+
+
+def training_transform(path: str) -> np.ndarray:
+    """The notebook's preprocessing, kept as the reference for parity checks"""
+    import cv2
+
+    img = cv2.imread(path)
+    if img is None:
+        raise ValueError(f"Could not read image: {path}")
+    return cv2.resize(img, (IMGSIZE, IMGSIZE)).astype(np.float32)
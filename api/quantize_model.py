@@ -0,0 +1,174 @@
+"""
+Post-training INT8 quantization of the kidney classification model.
+
+Takes the Keras model saved by extract_model.py / setup_model.py (or a trained
+kidney_model.h5 from the notebook), runs full-integer post-training
+quantization calibrated on a representative sample of ``train/<Class>/*.jpg``,
+and evaluates the float and INT8 models on ``test/<Class>/*.jpg``.
+
+The report compares per-class accuracy, confusion matrices and latency. The
+INT8 model is only written if its accuracy is within ``--max-accuracy-drop`` of
+the float model; otherwise the export is refused with a non-zero exit code.
+
+Usage:
+    python quantize_model.py --data-dir CT-Dataset
+    python quantize_model.py --data-dir CT-Dataset --max-accuracy-drop 0.005 --output kidney_model_int8.tflite
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from backends import TFLiteBackend
+from dataset import CLASSES, list_split, load_images
+from kidney_model import load_model
+
+
+def representative_dataset(paths, count: int, seed: int = 44):
+    """Generator of single-image calibration batches drawn from the training split"""
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(paths), size=min(count, len(paths)), replace=False)
+
+    def generator():
+        for index in sample:
+            yield [load_images([paths[index]])]
+
+    return generator
+
+
+def quantize(model: tf.keras.Model, calibration) -> bytes:
+    """Full-integer quantization: weights, activations, inputs and outputs are all int8"""
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = calibration
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+    return converter.convert()
+
+
+def confusion_matrix(y_true: np.ndarray, y_pred: np.ndarray, num_classes: int = len(CLASSES)) -> np.ndarray:
+    return np.bincount(y_true * num_classes + y_pred, minlength=num_classes * num_classes).reshape(num_classes, num_classes)
+
+
+def evaluate(predict_fn, images: np.ndarray, labels: np.ndarray, batch_size: int, latency_samples: int):
+    """Accuracy, per-class accuracy, confusion matrix and latency of one model"""
+    probabilities = np.concatenate([
+        predict_fn(images[start:start + batch_size]) for start in range(0, len(images), batch_size)
+    ])
+    predicted = np.argmax(probabilities, axis=1)
+    matrix = confusion_matrix(labels, predicted)
+    support = matrix.sum(axis=1)
+
+    # Single-image latency, the way the API sees an isolated request
+    latencies = []
+    for image in images[:latency_samples]:
+        started = time.perf_counter()
+        predict_fn(image[np.newaxis])
+        latencies.append((time.perf_counter() - started) * 1000.0)
+
+    return {
+        "accuracy": float(np.mean(predicted == labels)),
+        "per_class_accuracy": {
+            name: (float(matrix[i, i] / support[i]) if support[i] else None) for i, name in enumerate(CLASSES)
+        },
+        "confusion_matrix": matrix.tolist(),
+        "latency_ms": {
+            "mean": float(np.mean(latencies)),
+            "p50": float(np.percentile(latencies, 50)),
+            "p99": float(np.percentile(latencies, 99)),
+        },
+    }
+
+
+def print_summary(name, results):
+    print(f"\n{name}: accuracy {results['accuracy']:.4f}, "
+          f"latency mean {results['latency_ms']['mean']:.2f} ms / p99 {results['latency_ms']['p99']:.2f} ms")
+    for class_name, accuracy in results["per_class_accuracy"].items():
+        print(f"  {class_name:<7} {'n/a' if accuracy is None else f'{accuracy:.4f}'}")
+    print("  confusion matrix (rows = actual, columns = predicted):")
+    for class_name, row in zip(CLASSES, results["confusion_matrix"]):
+        print(f"  {class_name:<7} {row}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="INT8 post-training quantization with an accuracy gate")
+    parser.add_argument("--model", default="kidney_model.h5", help="Float Keras model to quantize")
+    parser.add_argument("--data-dir", required=True, help="Dataset root containing train/ and test/ class folders")
+    parser.add_argument("--output", default="kidney_model_int8.tflite")
+    parser.add_argument("--report", default="quantization_report.json")
+    parser.add_argument("--calibration-samples", type=int, default=500)
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.01,
+                        help="Refuse the export if INT8 accuracy is lower than float by more than this")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--latency-samples", type=int, default=100)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print(f"Error: {args.model} not found")
+        sys.exit(1)
+
+    model = load_model(args.model)
+    train_paths, _ = list_split(args.data_dir, "train")
+    test_paths, test_labels = list_split(args.data_dir, "test")
+    if not train_paths or not test_paths:
+        print(f"Error: {args.data_dir} needs images in both train/<Class>/ and test/<Class>/")
+        sys.exit(1)
+
+    print(f"Quantizing {args.model} with {min(args.calibration_samples, len(train_paths))} calibration images...")
+    quantized = quantize(model, representative_dataset(train_paths, args.calibration_samples))
+
+    # Stage next to the output so the final rename is atomic
+    output_dir = os.path.dirname(os.path.abspath(args.output))
+    with tempfile.NamedTemporaryFile(suffix=".tflite", dir=output_dir, delete=False) as f:
+        f.write(quantized)
+        candidate_path = f.name
+
+    try:
+        print(f"Evaluating on {len(test_paths)} test images...")
+        test_images = load_images(test_paths)
+        int8_backend = TFLiteBackend(candidate_path)
+        float_results = evaluate(lambda x: model(x, training=False).numpy(), test_images, test_labels,
+                                 args.batch_size, args.latency_samples)
+        int8_results = evaluate(int8_backend.predict, test_images, test_labels,
+                                args.batch_size, args.latency_samples)
+
+        accuracy_drop = float_results["accuracy"] - int8_results["accuracy"]
+        accepted = accuracy_drop <= args.max_accuracy_drop
+        report = {
+            "model": args.model,
+            "test_images": len(test_paths),
+            "calibration_samples": min(args.calibration_samples, len(train_paths)),
+            "float": dict(float_results, size_bytes=os.path.getsize(args.model)),
+            "int8": dict(int8_results, size_bytes=len(quantized)),
+            "accuracy_drop": accuracy_drop,
+            "max_accuracy_drop": args.max_accuracy_drop,
+            "accepted": accepted,
+        }
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+        print_summary("Float", float_results)
+        print_summary("INT8", int8_results)
+        print(f"\nAccuracy drop: {accuracy_drop:+.4f} (allowed {args.max_accuracy_drop:.4f})")
+        print(f"Report written to {args.report}")
+
+        if not accepted:
+            print("INT8 export refused: accuracy drop exceeds the threshold")
+            sys.exit(1)
+
+        os.replace(candidate_path, args.output)
+        print(f"INT8 model saved as {args.output} (serve it with MODEL_BACKEND=tflite MODEL_PATH={args.output})")
+    finally:
+        if os.path.exists(candidate_path):
+            os.remove(candidate_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+Prediction results and their wire formats.
+
+A prediction is kept internally (and in the prediction cache) as a compact,
+integer-coded result:
+
+    {"class_index": 3, "confidence": 0.93, "probabilities": [...],
+     "severity": 3, "message": 3, "recommendations": [4, 5, 6, 7, 12, 13],
+     "validation_error": false, "reason": null, "model_version": "3"}
+
+and rendered per request, chosen from the Accept header:
+
+- application/json (default): the original response, with English strings.
+- application/vnd.kidney.compact+json: the codes only, with short keys.
+- application/msgpack: the same compact payload as MessagePack (needs the
+  msgpack package).
+
+The JSON bodies of every (class, severity) combination are pre-encoded once,
+at import, into byte fragments; per request only the confidence, timestamp,
+model version and probabilities are encoded (with orjson when it is installed) and spliced
+in. benchmark_responses.py measures the per-request cost.
+
+Clients localize the codes with the tables below; their order is part of the
+API and must only ever be appended to.
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from fastapi.responses import Response
+
+from kidney_model import CLASSES
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+NORMAL_INDEX = CLASSES.index('Normal')
+# class_index of images rejected by validation
+INVALID_IMAGE_INDEX = -1
+INVALID_IMAGE = "Invalid Image"
+
+# Bumped whenever the cached result layout changes
+RESULT_VERSION = "2"
+
+SEVERITIES = ["None", "Low", "Medium", "High"]
+SEVERITY_NONE, SEVERITY_LOW, SEVERITY_MEDIUM, SEVERITY_HIGH = range(4)
+
+MESSAGES = [
+    "No kidney disease detected. Your kidneys appear healthy.",
+    "Possible indication of {disease} detected. Consider consulting a healthcare professional for further evaluation.",
+    "Moderate indication of {disease} detected. Please consult a healthcare professional for proper diagnosis.",
+    "Strong indication of {disease} detected. Please consult a healthcare professional immediately.",
+    "This image does not appear to be a kidney scan. {reason}. Please upload a clear kidney ultrasound, CT scan, or MRI image for analysis.",
+]
+MESSAGE_NORMAL, MESSAGE_POSSIBLE, MESSAGE_MODERATE, MESSAGE_STRONG, MESSAGE_INVALID_IMAGE = range(5)
+
+RECOMMENDATIONS = [
+    # Normal
+    "Continue maintaining a healthy lifestyle",
+    "Stay hydrated with adequate water intake",
+    "Regular exercise and balanced diet",
+    "Annual check-ups recommended",
+    # Any disease
+    "Consult a nephrologist immediately",
+    "Follow up with additional tests",
+    "Monitor symptoms closely",
+    "Maintain prescribed medications if any",
+    # Cyst
+    "Monitor cyst size regularly",
+    "Avoid activities that may cause trauma to the kidney area",
+    # Stone
+    "Increase water intake to help pass stones",
+    "Follow dietary recommendations to prevent future stones",
+    # Tumor
+    "Seek immediate medical attention",
+    "Prepare for potential imaging and biopsy procedures",
+    # Invalid image
+    "Upload a clear kidney ultrasound image",
+    "Use CT scan or MRI images of the kidney area",
+    "Ensure the image shows kidney structures clearly",
+    "Avoid photos of people, objects, or non-medical images",
+    "Make sure the image is well-lit and in focus",
+]
+NORMAL_RECOMMENDATIONS = [0, 1, 2, 3]
+DISEASE_RECOMMENDATIONS = [4, 5, 6, 7]
+CLASS_RECOMMENDATIONS = {'Cyst': [8, 9], 'Stone': [10, 11], 'Tumor': [12, 13]}
+INVALID_IMAGE_RECOMMENDATIONS = [14, 15, 16, 17, 18]
+
+JSON_MEDIA_TYPE = "application/json"
+COMPACT_JSON_MEDIA_TYPE = "application/vnd.kidney.compact+json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def severity_and_message(class_index: int, confidence: float):
+    """Severity and message codes for a predicted class"""
+    if class_index == NORMAL_INDEX:
+        return SEVERITY_NONE, MESSAGE_NORMAL
+    if confidence > 0.9:
+        return SEVERITY_HIGH, MESSAGE_STRONG
+    if confidence > 0.7:
+        return SEVERITY_MEDIUM, MESSAGE_MODERATE
+    return SEVERITY_LOW, MESSAGE_POSSIBLE
+
+
+def recommendation_codes(class_index: int) -> List[int]:
+    if class_index == NORMAL_INDEX:
+        return list(NORMAL_RECOMMENDATIONS)
+    return DISEASE_RECOMMENDATIONS + CLASS_RECOMMENDATIONS.get(CLASSES[class_index], [])
+
+
+def prediction_result(probabilities: Sequence[float], model_version: Optional[str] = None) -> Dict[str, Any]:
+    """Coded result for one row of model output, from the model version that produced it"""
+    # One tolist() instead of a numpy scalar per element
+    probabilities = np.asarray(probabilities, dtype=np.float64).tolist()
+    class_index = max(range(len(probabilities)), key=probabilities.__getitem__)
+    confidence = probabilities[class_index]
+    severity, message = severity_and_message(class_index, confidence)
+    return {
+        "class_index": class_index,
+        "confidence": confidence,
+        "probabilities": probabilities,
+        "severity": severity,
+        "message": message,
+        "recommendations": recommendation_codes(class_index),
+        "validation_error": False,
+        "reason": None,
+        "model_version": model_version,
+    }
+
+
+def invalid_image_result(validation: Dict[str, Any], model_version: Optional[str] = None) -> Dict[str, Any]:
+    """Coded result for an image rejected by the kidney-scan validator (stamped with the serving model version)"""
+    return {
+        "class_index": INVALID_IMAGE_INDEX,
+        "confidence": validation["confidence"],
+        "probabilities": None,
+        "severity": SEVERITY_NONE,
+        "message": MESSAGE_INVALID_IMAGE,
+        "recommendations": list(INVALID_IMAGE_RECOMMENDATIONS),
+        "validation_error": True,
+        "reason": validation["reason"],
+        "model_version": model_version,
+    }
+
+
+def full_response(result: Dict[str, Any], timestamp: float) -> Dict[str, Any]:
+    """The original JSON response, with every code expanded to English text"""
+    class_index = result["class_index"]
+    disease = INVALID_IMAGE if class_index == INVALID_IMAGE_INDEX else CLASSES[class_index]
+    return {
+        "disease": disease,
+        "confidence": result["confidence"],
+        "severity": SEVERITIES[result["severity"]],
+        "message": MESSAGES[result["message"]].format(disease=disease.lower(), reason=result["reason"]),
+        "recommendations": [RECOMMENDATIONS[code] for code in result["recommendations"]],
+        "timestamp": timestamp,
+        "validation_error": result["validation_error"],
+        "model_version": result["model_version"],
+    }
+
+
+def compact_response(result: Dict[str, Any], timestamp: float) -> Dict[str, Any]:
+    """Codes and probabilities only; a few dozen bytes instead of several hundred"""
+    response = {
+        "c": result["class_index"],
+        "conf": round(result["confidence"], 4),
+        "s": result["severity"],
+        "m": result["message"],
+        "r": result["recommendations"],
+        "t": round(timestamp, 3),
+        "v": result["model_version"],
+    }
+    if result["reason"] is not None:
+        response["rs"] = result["reason"]
+    if result["probabilities"] is not None:
+        response["p"] = [round(p, 4) for p in result["probabilities"]]
+    return response
+
+
+def encode_json(value) -> bytes:
+    """Compact JSON, as produced by JSONResponse"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# Placeholders for the per-request fields while a template is being built
+_CONFIDENCE, _TIMESTAMP, _PROBABILITIES = "\x00confidence\x00", "\x00timestamp\x00", "\x00probabilities\x00"
+_MODEL_VERSION = "\x00model_version\x00"
+
+
+def _split_template(payload: Dict[str, Any], placeholders) -> Tuple[bytes, ...]:
+    """Encode a payload holding placeholders and cut it into the fragments around them"""
+    encoded = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    fragments = []
+    for placeholder in placeholders:
+        head, encoded = encoded.split(json.dumps(placeholder).encode("utf-8"))
+        fragments.append(head)
+    fragments.append(encoded)
+    return tuple(fragments)
+
+
+def _representative_result(class_index: int, severity: int, reason: Optional[str] = None) -> Dict[str, Any]:
+    """A coded result of the given kind; its confidence and probabilities are placeholders"""
+    if class_index == INVALID_IMAGE_INDEX:
+        return invalid_image_result({"confidence": 0.0, "reason": reason})
+    # A confidence that lands in this severity band
+    confidence = {SEVERITY_NONE: 1.0, SEVERITY_LOW: 0.5, SEVERITY_MEDIUM: 0.8, SEVERITY_HIGH: 1.0}[severity]
+    probabilities = [0.0] * len(CLASSES)
+    probabilities[class_index] = confidence
+    return prediction_result(probabilities)
+
+
+def _build_templates(class_index: int, severity: int, reason: Optional[str] = None):
+    """(full JSON fragments, compact JSON fragments) for one kind of response"""
+    result = _representative_result(class_index, severity, reason)
+    if class_index == INVALID_IMAGE_INDEX:
+        placeholders = (_CONFIDENCE, _TIMESTAMP, _MODEL_VERSION)
+    else:
+        placeholders = (_CONFIDENCE, _TIMESTAMP, _MODEL_VERSION, _PROBABILITIES)
+
+    full = dict(full_response(result, 0.0), confidence=_CONFIDENCE, timestamp=_TIMESTAMP, model_version=_MODEL_VERSION)
+    compact = dict(compact_response(result, 0.0), conf=_CONFIDENCE, t=_TIMESTAMP, v=_MODEL_VERSION)
+    if "p" in compact:
+        compact["p"] = _PROBABILITIES
+    return _split_template(full, (_CONFIDENCE, _TIMESTAMP, _MODEL_VERSION)), _split_template(compact, placeholders)
+
+
+# Every response the classifier can produce, keyed by (class index, severity)
+TEMPLATES = {
+    (class_index, severity): _build_templates(class_index, severity)
+    for class_index in range(len(CLASSES))
+    for severity in ([SEVERITY_NONE] if class_index == NORMAL_INDEX else [SEVERITY_LOW, SEVERITY_MEDIUM, SEVERITY_HIGH])
+}
+# Severity, message and recommendations as text, for callers that want strings rather than JSON
+RESPONSE_TEXT = {
+    key: {field: value for field, value in full_response(_representative_result(*key), 0.0).items()
+          if field in ("severity", "message", "recommendations")}
+    for key in TEMPLATES
+}
+# Recommendations only depend on the class
+RECOMMENDATION_TEXT = {
+    class_index: tuple(RECOMMENDATIONS[code] for code in recommendation_codes(class_index))
+    for class_index in range(len(CLASSES))
+}
+# Invalid-image responses also embed the validator's reason; the set of reasons is small
+_INVALID_IMAGE_TEMPLATES: Dict[str, Tuple] = {}
+MAX_INVALID_IMAGE_TEMPLATES = 64
+
+
+def _templates_for(result: Dict[str, Any]):
+    if result["class_index"] != INVALID_IMAGE_INDEX:
+        return TEMPLATES[(result["class_index"], result["severity"])]
+    reason = result["reason"]
+    templates = _INVALID_IMAGE_TEMPLATES.get(reason)
+    if templates is None:
+        templates = _build_templates(INVALID_IMAGE_INDEX, SEVERITY_NONE, reason)
+        if len(_INVALID_IMAGE_TEMPLATES) < MAX_INVALID_IMAGE_TEMPLATES:
+            _INVALID_IMAGE_TEMPLATES[reason] = templates
+    return templates
+
+
+def render_bytes(result: Dict[str, Any], media_type: str, timestamp: float) -> bytes:
+    """Encoded JSON body (full or compact) for a coded result, spliced into its precomputed template"""
+    full, compact = _templates_for(result)
+    model_version = encode_json(result["model_version"])
+    if media_type == JSON_MEDIA_TYPE:
+        return b"".join((full[0], encode_json(result["confidence"]), full[1], encode_json(timestamp), full[2],
+                         model_version, full[3]))
+    parts = [compact[0], encode_json(round(result["confidence"], 4)), compact[1], encode_json(round(timestamp, 3)),
+             compact[2], model_version, compact[3]]
+    if result["probabilities"] is not None:
+        parts += [encode_json([round(p, 4) for p in result["probabilities"]]), compact[4]]
+    return b"".join(parts)
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """Media type to respond with for an Accept header; JSON unless a compact format is asked for"""
+    accepted = {part.split(";")[0].strip().lower() for part in (accept or "").split(",")}
+    if msgpack is not None and accepted.intersection(MSGPACK_MEDIA_TYPES):
+        return MSGPACK_MEDIA_TYPES[0]
+    if COMPACT_JSON_MEDIA_TYPE in accepted:
+        return COMPACT_JSON_MEDIA_TYPE
+    return JSON_MEDIA_TYPE
+
+
+def render(result: Dict[str, Any], media_type: str, timestamp: float) -> Dict[str, Any]:
+    """Response payload for a media type returned by negotiate()"""
+    if media_type == JSON_MEDIA_TYPE:
+        return full_response(result, timestamp)
+    return compact_response(result, timestamp)
+
+
+def make_response(result: Dict[str, Any], media_type: str, timestamp: float) -> Response:
+    # Caches in front of the API must key on Accept as well as the URL
+    headers = {"Vary": "Accept"}
+    if result["model_version"] is not None:
+        headers["X-Model-Version"] = result["model_version"]
+    if media_type in MSGPACK_MEDIA_TYPES:
+        payload = msgpack.packb(compact_response(result, timestamp))
+    else:
+        payload = render_bytes(result, media_type, timestamp)
+    return Response(content=payload, media_type=media_type, headers=headers)
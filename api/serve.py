@@ -0,0 +1,190 @@
+"""
+Preforking multi-worker server that shares the model weights between workers.
+
+``uvicorn main:app --workers N`` starts N independent interpreters: each one
+imports TensorFlow and loads its own copy of the model. This supervisor instead:
+
+- stages the TFLite model (exported from ``kidney_model.h5`` if needed) once in
+  shared memory (``/dev/shm``). Every worker serves it with the ``tflite``
+  backend, whose interpreter mmaps the file read-only, so all workers map the
+  same physical weight pages;
+- imports the app and the TFLite runtime (TensorFlow, NumPy, OpenCV, ...) once
+  and freezes the heap before forking, so workers share those pages
+  copy-on-write;
+- binds the listening socket once, forks the workers that accept on it, and
+  restarts any worker that dies.
+
+No TensorFlow runtime is created before the fork: each worker loads its
+interpreter, batch scheduler and thread pools in its own startup event.
+
+Usage:
+    python serve.py --workers 4
+    python serve.py --workers 8 --app main_optimized --port 8000
+"""
+
+import argparse
+import gc
+import importlib
+import logging
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+
+import uvicorn
+
+from backends import DEFAULT_MODEL_PATHS, load_tflite_interpreter, model_file_version
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Where the shared model file is staged; /dev/shm is RAM-backed on Linux
+SHARED_MODEL_DIR = os.getenv("SHARED_MODEL_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+# A worker that dies sooner than this after starting is restarted with a delay, to avoid a crash loop
+MIN_WORKER_LIFETIME = 5.0
+
+
+def export_tflite(keras_path: str, output_dir: str) -> str:
+    """Convert a Keras model in a subprocess, keeping TensorFlow's runtime out of the supervisor"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "export_model.py")
+    subprocess.run([sys.executable, script, "--model", keras_path, "--formats", "tflite", "--output-dir", output_dir],
+                   check=True)
+    return os.path.join(output_dir, os.path.basename(DEFAULT_MODEL_PATHS["tflite"]))
+
+
+def stage_shared_model(tflite_path: str, keras_path: str) -> str:
+    """Copy the TFLite model into SHARED_MODEL_DIR, exporting it from the Keras model first if needed"""
+    with tempfile.TemporaryDirectory() as export_dir:
+        if not os.path.exists(tflite_path):
+            if not os.path.exists(keras_path):
+                raise FileNotFoundError(f"Neither {tflite_path} nor {keras_path} exists")
+            logger.info(f"{tflite_path} not found, exporting it from {keras_path}")
+            tflite_path = export_tflite(keras_path, export_dir)
+
+        # Named per supervisor, so two supervisors never remove each other's file
+        shared_path = os.path.join(SHARED_MODEL_DIR, f"kidney_model-{model_file_version(tflite_path)}-{os.getpid()}.tflite")
+        staging_path = shared_path + ".tmp"
+        shutil.copyfile(tflite_path, staging_path)
+        os.replace(staging_path, shared_path)
+    os.chmod(shared_path, 0o444)
+    logger.info(f"Staged shared model at {shared_path} ({os.path.getsize(shared_path) / 1e6:.1f} MB)")
+    return shared_path
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """Listening socket created once and inherited by every worker"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket, log_level: str):
+    """Body of a forked worker: serve the app on the inherited socket until told to stop"""
+    # Undo the supervisor's handlers; uvicorn installs its own for a graceful shutdown
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    config = uvicorn.Config(app, log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    """Forks and restarts workers; stops them all on SIGINT/SIGTERM"""
+
+    def __init__(self, app, sock: socket.socket, workers: int, log_level: str = "info"):
+        self.app = app
+        self.sock = sock
+        self.num_workers = workers
+        self.log_level = log_level
+        self.workers: Dict[int, float] = {}  # pid -> start time
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                run_worker(self.app, self.sock, self.log_level)
+            except BaseException:
+                logger.exception("Worker crashed")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        self.workers[pid] = time.monotonic()
+        logger.info(f"Started worker {pid}")
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        for _ in range(self.num_workers):
+            self.spawn()
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            started = self.workers.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            logger.warning(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting it")
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            if not self.stopping:
+                self.spawn()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API from preforked workers sharing one model file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--app", default="main", help="Module holding the FastAPI app (main or main_optimized)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--tflite-model", default=DEFAULT_MODEL_PATHS["tflite"], help="TFLite model to serve")
+    parser.add_argument("--keras-model", default=DEFAULT_MODEL_PATHS["keras"],
+                        help="Keras model exported to TFLite when --tflite-model does not exist")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    shared_path = stage_shared_model(args.tflite_model, args.keras_model)
+    try:
+        # The app reads its backend configuration at import time
+        os.environ["MODEL_BACKEND"] = "tflite"
+        os.environ["MODEL_PATH"] = shared_path
+        app = importlib.import_module(args.app).app
+        # The app imports OpenCV and its inference runtime lazily; import them here so the workers share them
+        importlib.import_module("cv2")
+        load_tflite_interpreter()
+
+        # Objects created so far are never freed; keep the collector from touching
+        # (and so copying) their pages in every worker
+        gc.collect()
+        gc.freeze()
+
+        sock = bind_socket(args.host, args.port)
+        logger.info(f"Serving {args.app}:app on {args.host}:{args.port} with {args.workers} workers")
+        Supervisor(app, sock, args.workers, args.log_level).run()
+    finally:
+        os.remove(shared_path)
+
+
+if __name__ == "__main__":
+    main()
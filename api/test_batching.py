@@ -0,0 +1,144 @@
+"""Behaviour of the micro-batching scheduler (batching.py)"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+
+from batching import BatchScheduler
+
+IMAGE_SHAPE = (4, 4, 3)
+
+
+def rows_with_version(batch):
+    """predict_fn as main.py's run_model: one (row, version) per image"""
+    return [(row.mean(axis=(0, 1)), "v1") for row in batch]
+
+
+@pytest.fixture
+def make_scheduler():
+    schedulers = []
+
+    def make(predict_fn=rows_with_version, **kwargs):
+        scheduler = BatchScheduler(predict_fn, **kwargs)
+        scheduler.start()
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield make
+    for scheduler in schedulers:
+        scheduler.stop()
+
+
+def image(value: float) -> np.ndarray:
+    return np.full(IMAGE_SHAPE, value, dtype=np.float32)
+
+
+def test_each_caller_gets_its_own_row(make_scheduler):
+    scheduler = make_scheduler(max_batch_size=8, max_wait_ms=20)
+    futures = [scheduler.submit(image(i)) for i in range(5)]
+    for i, future in enumerate(futures):
+        row, version = future.result(timeout=5)
+        assert version == "v1"
+        np.testing.assert_allclose(row, [i, i, i])
+    assert scheduler.images_processed == 5
+
+
+def test_async_predict(make_scheduler):
+    scheduler = make_scheduler()
+    row, version = asyncio.run(scheduler.predict(image(2)))
+    np.testing.assert_allclose(row, [2, 2, 2])
+    assert version == "v1"
+
+
+def test_cancelled_request_is_dropped_and_worker_survives(make_scheduler):
+    started = threading.Event()
+    release = threading.Event()
+    batches = []
+
+    def blocking_predict(batch):
+        batches.append(len(batch))
+        started.set()
+        release.wait(5)
+        return rows_with_version(batch)
+
+    scheduler = make_scheduler(blocking_predict, max_batch_size=4, max_wait_ms=1)
+    first = scheduler.submit(image(0))
+    assert started.wait(5)
+    # Queued behind the running batch, then cancelled as a disconnecting client would
+    cancelled = scheduler.submit(image(1))
+    assert cancelled.cancel()
+    release.set()
+    first.result(timeout=5)
+
+    row, _ = scheduler.submit(image(3)).result(timeout=5)
+    np.testing.assert_allclose(row, [3, 3, 3])
+    assert scheduler._worker.is_alive()
+    assert sum(batches) == 2
+
+
+def test_running_request_can_no_longer_be_cancelled(make_scheduler):
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking_predict(batch):
+        started.set()
+        release.wait(5)
+        return rows_with_version(batch)
+
+    scheduler = make_scheduler(blocking_predict)
+    future = scheduler.submit(image(1))
+    assert started.wait(5)
+    assert not future.cancel()
+    release.set()
+    future.result(timeout=5)
+    assert scheduler._worker.is_alive()
+
+
+def test_inference_error_fails_the_batch_only(make_scheduler):
+    calls = []
+
+    def failing_once(batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise ValueError("model exploded")
+        return rows_with_version(batch)
+
+    scheduler = make_scheduler(failing_once)
+    with pytest.raises(ValueError, match="model exploded"):
+        scheduler.submit(image(1)).result(timeout=5)
+    scheduler.submit(image(2)).result(timeout=5)
+
+
+def test_too_few_rows_fail_every_request(make_scheduler):
+    scheduler = make_scheduler(lambda batch: rows_with_version(batch)[:-1], max_batch_size=4, max_wait_ms=50)
+    futures = [scheduler.submit(image(i)) for i in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="rows for a batch"):
+            future.result(timeout=5)
+    assert scheduler._worker.is_alive()
+
+
+def test_stop_fails_queued_requests():
+    release = threading.Event()
+
+    def blocking_predict(batch):
+        release.wait(5)
+        return rows_with_version(batch)
+
+    scheduler = BatchScheduler(blocking_predict, max_batch_size=1)
+    scheduler.start()
+    scheduler.submit(image(0))
+    queued: Future = scheduler.submit(image(1))
+    stopper = threading.Thread(target=scheduler.stop)
+    stopper.start()
+    while scheduler._running:
+        threading.Event().wait(0.001)
+    release.set()
+    stopper.join(10)
+    with pytest.raises(RuntimeError):
+        queued.result(timeout=5)
+    with pytest.raises(RuntimeError, match="not running"):
+        scheduler.submit(image(2))
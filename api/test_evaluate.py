@@ -0,0 +1,114 @@
+"""Metrics and the promotion gate of the evaluation script (evaluate.py)"""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from dataset import CLASSES
+from evaluate import Evaluation, gate, promote, read_metadata
+from kidney_model import METADATA_FORMAT
+from preprocessing import PREPROCESSING_VERSION
+
+METADATA = {"format": METADATA_FORMAT, "classes": CLASSES, "preprocessing": {"version": PREPROCESSING_VERSION}}
+
+
+def results_for(labels, predicted) -> dict:
+    """Evaluation results of confident predictions"""
+    evaluation = Evaluation()
+    probabilities = np.full((len(labels), len(CLASSES)), 0.02, np.float32)
+    probabilities[np.arange(len(labels)), predicted] = 0.94
+    evaluation.update(probabilities, np.array(labels))
+    return evaluation.results()
+
+
+# 8 images, two per class; one Stone scan taken for a Tumor
+LABELS = [0, 0, 1, 1, 2, 2, 3, 3]
+PREDICTED = [0, 0, 1, 1, 2, 3, 3, 3]
+
+
+def check(results, metadata=METADATA, metadata_error=None, require_metadata=True, min_accuracy=None,
+          min_recall=None, baseline=None, max_accuracy_drop=0.0):
+    return gate(results, metadata, metadata_error, require_metadata, min_accuracy, min_recall, baseline,
+                max_accuracy_drop)
+
+
+def test_metrics():
+    results = results_for(LABELS, PREDICTED)
+    assert results["images"] == 8
+    assert results["accuracy"] == pytest.approx(7 / 8)
+    assert results["per_class"]["Stone"] == {"precision": 1.0, "recall": 0.5, "f1": pytest.approx(2 / 3),
+                                             "support": 2}
+    assert results["per_class"]["Tumor"]["precision"] == pytest.approx(2 / 3)
+    assert results["confusion_matrix"][2] == [0, 0, 1, 1]
+    assert results["log_loss"] == pytest.approx((7 * -np.log(0.94) - np.log(0.02)) / 8, rel=1e-5)
+
+
+def test_batches_add_up_to_the_whole():
+    whole = Evaluation()
+    batched = Evaluation()
+    rng = np.random.default_rng(0)
+    probabilities = rng.dirichlet(np.ones(len(CLASSES)), 100)
+    labels = rng.integers(0, len(CLASSES), 100)
+    whole.update(probabilities, labels)
+    for start in range(0, 100, 32):
+        batched.update(probabilities[start:start + 32], labels[start:start + 32])
+    expected, actual = whole.results(), batched.results()
+    assert actual["confusion_matrix"] == expected["confusion_matrix"]
+    assert actual["per_class"] == expected["per_class"]
+    assert actual["log_loss"] == pytest.approx(expected["log_loss"])
+    assert actual["calibration"]["confidence"]["count"] == expected["calibration"]["confidence"]["count"]
+    assert actual["calibration"]["expected_calibration_error"] == pytest.approx(
+        expected["calibration"]["expected_calibration_error"])
+
+
+def test_good_model_passes():
+    assert check(results_for(LABELS, PREDICTED), min_accuracy=0.85, min_recall=0.5,
+                 baseline={"accuracy": 0.9}, max_accuracy_drop=0.03) == []
+
+
+def test_thresholds():
+    results = results_for(LABELS, PREDICTED)
+    assert len(check(results, min_accuracy=0.9)) == 1
+    failures = check(results, min_recall=0.75)
+    assert len(failures) == 1 and failures[0].startswith("Stone recall")
+    assert len(check(results, baseline={"accuracy": 1.0}, max_accuracy_drop=0.1)) == 1
+
+
+def test_no_images_fails():
+    assert check(Evaluation().results()) == ["no images were evaluated"]
+
+
+def test_metadata_checks():
+    results = results_for(LABELS, PREDICTED)
+    assert check(results, None, "no metadata sidecar") == ["no metadata sidecar"]
+    assert check(results, None, "no metadata sidecar", require_metadata=False) == []
+    assert len(check(results, {**METADATA, "format": METADATA_FORMAT + 1})) == 1
+    assert len(check(results, {**METADATA, "classes": CLASSES[::-1]})) == 1
+    assert len(check(results, {**METADATA, "preprocessing": {"version": "1"}})) == 1
+
+
+def test_read_metadata(tmp_path):
+    model = str(tmp_path / "candidate.h5")
+    metadata, error = read_metadata(model)
+    assert metadata is None and "no metadata sidecar" in error
+    (tmp_path / "candidate.json").write_text("{not json")
+    metadata, error = read_metadata(model)
+    assert metadata is None and "unreadable" in error
+    (tmp_path / "candidate.json").write_text("[]")
+    assert read_metadata(model)[0] is None
+    (tmp_path / "candidate.json").write_text(json.dumps(METADATA))
+    assert read_metadata(model) == (METADATA, None)
+
+
+def test_promote_copies_model_and_metadata(tmp_path):
+    (tmp_path / "candidate.h5").write_bytes(b"new model")
+    (tmp_path / "candidate.json").write_text(json.dumps(METADATA))
+    serving = tmp_path / "serving"
+    os.makedirs(serving)
+    (serving / "kidney_model.h5").write_bytes(b"old model")
+    promote(str(tmp_path / "candidate.h5"), str(serving / "kidney_model.h5"))
+    assert (serving / "kidney_model.h5").read_bytes() == b"new model"
+    assert json.loads((serving / "kidney_model.json").read_text()) == METADATA
+    assert sorted(os.listdir(serving)) == ["kidney_model.h5", "kidney_model.json"]
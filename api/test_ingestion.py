@@ -0,0 +1,94 @@
+"""Request body limits and payload decoding (ingestion.py)"""
+
+import base64
+import io
+
+import pytest
+from fastapi import FastAPI, HTTPException, Request, UploadFile
+from fastapi.testclient import TestClient
+
+from ingestion import BodySizeLimitMiddleware, decode_base64_payload, read_body, upload_buffer
+
+LIMIT = 100
+BATCH_LIMIT = 1000
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.add_middleware(BodySizeLimitMiddleware, max_body_bytes=LIMIT, path_limits={"/predict-batch": BATCH_LIMIT})
+    app.state.endpoint_calls = 0
+
+    async def echo_size(request: Request):
+        app.state.endpoint_calls += 1
+        return {"size": len(await read_body(request, limit=10 * BATCH_LIMIT))}
+
+    app.post("/predict")(echo_size)
+    app.post("/predict-batch")(echo_size)
+    with TestClient(app) as client:
+        client.app_state = app.state
+        yield client
+
+
+def chunks(size: int, chunk_size: int = 16):
+    for start in range(0, size, chunk_size):
+        yield b"x" * min(chunk_size, size - start)
+
+
+def test_body_within_limit(client):
+    response = client.post("/predict", content=b"x" * LIMIT)
+    assert response.status_code == 200 and response.json() == {"size": LIMIT}
+
+
+def test_content_length_over_limit_is_rejected_before_the_endpoint(client):
+    response = client.post("/predict", content=b"x" * (LIMIT + 1))
+    assert response.status_code == 413
+    assert str(LIMIT) in response.json()["detail"]
+    assert client.app_state.endpoint_calls == 0
+
+
+def test_chunked_body_over_limit(client):
+    # No Content-Length: the limit is enforced on the bytes received
+    response = client.post("/predict", content=chunks(LIMIT + 1))
+    assert response.status_code == 413
+    assert client.post("/predict", content=chunks(LIMIT)).json() == {"size": LIMIT}
+
+
+def test_per_path_limit(client):
+    assert client.post("/predict-batch", content=b"x" * BATCH_LIMIT).status_code == 200
+    assert client.post("/predict-batch", content=chunks(BATCH_LIMIT + 1)).status_code == 413
+
+
+def test_read_body_limit():
+    app = FastAPI()
+
+    @app.post("/predict")
+    async def predict(request: Request):
+        return {"size": len(await read_body(request, limit=LIMIT))}
+
+    with TestClient(app) as client:
+        assert client.post("/predict", content=chunks(LIMIT)).json() == {"size": LIMIT}
+        assert client.post("/predict", content=chunks(LIMIT + 1)).status_code == 413
+
+
+def test_upload_buffer_limit():
+    upload = UploadFile(io.BytesIO(b"x" * (LIMIT + 1)), filename="scan.jpg")
+    with pytest.raises(HTTPException) as error:
+        upload_buffer(upload, limit=LIMIT)
+    assert error.value.status_code == 413
+    assert bytes(upload_buffer(upload, limit=LIMIT + 1)) == b"x" * (LIMIT + 1)
+
+
+def test_decode_base64_payload():
+    encoded = base64.b64encode(b"\xff\xd8image").decode()
+    assert bytes(decode_base64_payload(bytearray(f'{{"image": "{encoded}"}}'.encode()))) == b"\xff\xd8image"
+    # Not in the fast path's layout: parsed as JSON
+    assert bytes(decode_base64_payload(bytearray(f'{{"id": 1, "image": "{encoded}"}}'.encode()))) == b"\xff\xd8image"
+
+
+@pytest.mark.parametrize("body", [b"not json", b"\xff\xfe", b"[1, 2]", b'{"id": 1}', b'{"image": "abcde"}',
+                                  '{"image": "café"}'.encode()])
+def test_malformed_base64_payload_is_a_400(body):
+    with pytest.raises(HTTPException) as error:
+        decode_base64_payload(bytearray(body))
+    assert error.value.status_code == 400
@@ -0,0 +1,117 @@
+"""Saving, validating and loading the model's .npz weights (kidney_model.py)"""
+
+import numpy as np
+import pytest
+
+from kidney_model import (CLASSES, INPUT_SHAPE, NUM_CLASSES, WEIGHTS_FORMAT, WeightsMismatch, architecture_digest,
+                          check_model, load_model, load_weights, save_weights, weight_shapes)
+
+
+class Weights:
+    """Stands in for a Keras model in save_weights and check_model"""
+
+    def __init__(self, weights, input_shape=(None,) + INPUT_SHAPE, output_shape=(None, NUM_CLASSES)):
+        self.weights = weights
+        self.input_shape = input_shape
+        self.output_shape = output_shape
+
+    def get_weights(self):
+        return self.weights
+
+
+@pytest.fixture(scope="module")
+def weights():
+    rng = np.random.default_rng(0)
+    return [rng.normal(0, 0.01, shape).astype(np.float32) for shape in weight_shapes()]
+
+
+def write_npz(path, weights, **fields):
+    arrays = {f"weight_{index:03d}": array for index, array in enumerate(weights)}
+    header = {"format": np.array(WEIGHTS_FORMAT), "architecture": np.array(architecture_digest()),
+              "classes": np.array(CLASSES)}
+    header.update(fields)
+    np.savez(path, **{**header, **arrays})
+    return str(path)
+
+
+def test_weight_shapes():
+    shapes = weight_shapes()
+    assert shapes[0] == (3, 3, 3, 32)
+    assert shapes[6] == (14 * 14 * 128, 256)
+    assert shapes[-1] == (NUM_CLASSES,)
+
+
+def test_round_trip(tmp_path, weights):
+    path = str(tmp_path / "kidney_model.npz")
+    save_weights(Weights(weights), path)
+    for saved, loaded in zip(weights, load_weights(path)):
+        np.testing.assert_array_equal(saved, loaded)
+    assert [p.name for p in tmp_path.iterdir()] == ["kidney_model.npz"]
+
+
+def test_save_rejects_other_shapes(tmp_path, weights):
+    with pytest.raises(WeightsMismatch):
+        save_weights(Weights(weights[:-1]), str(tmp_path / "kidney_model.npz"))
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.mark.parametrize("fields, message", [
+    ({"format": np.array(WEIGHTS_FORMAT + 1)}, "not a kidney model weights file"),
+    ({"classes": np.array(CLASSES[::-1])}, "made for classes"),
+    ({"architecture": np.array("0" * 16)}, "another architecture"),
+])
+def test_rejects_other_files(tmp_path, weights, fields, message):
+    with pytest.raises(WeightsMismatch, match=message):
+        load_weights(write_npz(tmp_path / "kidney_model.npz", weights, **fields))
+
+
+def test_rejects_files_without_a_header(tmp_path, weights):
+    path = tmp_path / "kidney_model.npz"
+    np.savez(path, *weights)
+    with pytest.raises(WeightsMismatch, match="not a kidney model weights file"):
+        load_weights(str(path))
+
+
+def test_rejects_missing_or_reshaped_weights(tmp_path, weights):
+    with pytest.raises(WeightsMismatch, match="Expected"):
+        load_weights(write_npz(tmp_path / "missing.npz", weights[:-2]))
+    reshaped = list(weights)
+    reshaped[0] = np.zeros((5, 5, 3, 32), np.float32)
+    with pytest.raises(WeightsMismatch, match="Weight 0 has shape"):
+        load_weights(write_npz(tmp_path / "reshaped.npz", reshaped))
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda array: array.astype(np.float64),
+    lambda array: np.where(np.arange(array.size).reshape(array.shape) == 0, np.nan, array).astype(np.float32),
+    lambda array: np.full_like(array, np.inf),
+])
+def test_rejects_non_finite_or_non_float32_weights(tmp_path, weights, corrupt):
+    corrupted = list(weights)
+    corrupted[-1] = corrupt(weights[-1])
+    with pytest.raises(WeightsMismatch, match="not finite float32"):
+        load_weights(write_npz(tmp_path / "kidney_model.npz", corrupted))
+
+
+def test_rejects_pickled_arrays(tmp_path, weights):
+    path = write_npz(tmp_path / "kidney_model.npz", weights, classes=np.array(CLASSES, dtype=object))
+    with pytest.raises(ValueError):
+        load_weights(path)
+
+
+def test_check_model():
+    check_model(Weights([]))
+    with pytest.raises(WeightsMismatch):
+        check_model(Weights([], output_shape=(None, NUM_CLASSES + 1)))
+    with pytest.raises(WeightsMismatch):
+        check_model(Weights([], input_shape=(None, 224, 224, 3)))
+
+
+def test_load_model_sets_the_weights(tmp_path, weights):
+    path = write_npz(tmp_path / "kidney_model.npz", weights)
+    model = load_model(path)
+    for expected, actual in zip(weights, model.get_weights()):
+        np.testing.assert_array_equal(expected, actual)
+    probabilities = model.predict(np.zeros((2,) + INPUT_SHAPE, np.float32), verbose=0)
+    assert probabilities.shape == (2, NUM_CLASSES)
+    np.testing.assert_allclose(probabilities.sum(axis=1), 1.0, rtol=1e-5)
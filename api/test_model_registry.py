@@ -0,0 +1,158 @@
+"""Version loading, swapping, pinning and eviction of the model registry (model_registry.py)"""
+
+import os
+
+import numpy as np
+import pytest
+
+import model_registry
+from model_registry import ModelRegistry, version_sort_key
+
+MODEL_FILENAME = "kidney_model.h5"
+
+
+class FakeBackend:
+    """Stands in for an inference backend: the model file's text is its version, "broken" fails to load"""
+
+    loads = 0
+
+    def __init__(self, model_path: str, **kwargs):
+        with open(model_path) as f:
+            content = f.read()
+        if content == "broken":
+            raise ValueError(f"Cannot load {model_path}")
+        FakeBackend.loads += 1
+        self.version = content
+        self.warmed_up = False
+
+    def warmup(self):
+        self.warmed_up = True
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return np.zeros((len(batch), 4), np.float32)
+
+
+@pytest.fixture(autouse=True)
+def fake_backend(monkeypatch):
+    FakeBackend.loads = 0
+    monkeypatch.setattr(model_registry, "create_backend", lambda name, path, **kwargs: FakeBackend(path, **kwargs))
+
+
+def publish(model_dir, version: str, content: str = None):
+    os.makedirs(model_dir / version, exist_ok=True)
+    (model_dir / version / MODEL_FILENAME).write_text(content or f"digest-{version}")
+
+
+def make_registry(model_dir, **kwargs) -> ModelRegistry:
+    return ModelRegistry("keras", model_dir=str(model_dir), poll_seconds=0, **kwargs)
+
+
+def test_versions_sort_naturally():
+    assert sorted(["v10", "v9", "v1", "2024-06-12", "2024-05-01"], key=version_sort_key) == [
+        "2024-05-01", "2024-06-12", "v1", "v9", "v10"]
+
+
+def test_newest_version_is_served(tmp_path):
+    for version in ("v1", "v2", "v10"):
+        publish(tmp_path, version)
+    os.makedirs(tmp_path / ".v11")  # Unpublished
+    os.makedirs(tmp_path / "v12")  # No model file yet
+    registry = make_registry(tmp_path)
+    model = registry.load_initial()
+    assert (model.version, model.digest) == ("v10", "digest-v10")
+    assert model.backend.warmed_up
+    assert registry.available_versions() == ["v1", "v2", "v10"]
+
+
+def test_falls_back_to_an_older_version(tmp_path):
+    publish(tmp_path, "v1")
+    publish(tmp_path, "v2", "broken")
+    registry = make_registry(tmp_path)
+    assert registry.load_initial().version == "v1"
+    assert "v2" in registry.failures
+
+
+def test_no_loadable_version(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        make_registry(tmp_path).load_initial()
+    publish(tmp_path, "v1", "broken")
+    with pytest.raises(RuntimeError):
+        make_registry(tmp_path).load_initial()
+
+
+def test_poll_swaps_in_new_versions_only(tmp_path):
+    publish(tmp_path, "v1")
+    registry = make_registry(tmp_path)
+    first = registry.load_initial()
+    assert registry.poll() is None
+    publish(tmp_path, "v2")
+    assert registry.poll().version == "v2"
+    assert registry.active.version == "v2" and registry.swaps == 2
+    # A request that started on v1 still holds a working model
+    assert first.backend.predict(np.zeros((1, 128, 128, 3))).shape == (1, 4)
+    # Never rolls back on its own
+    publish(tmp_path, "v0")
+    assert registry.poll() is None and registry.active.version == "v2"
+
+
+def test_failed_version_keeps_serving_and_is_retried_when_replaced(tmp_path):
+    publish(tmp_path, "v1")
+    registry = make_registry(tmp_path)
+    registry.load_initial()
+    publish(tmp_path, "v2", "broken")
+    assert registry.poll() is None
+    assert registry.active.version == "v1" and "v2" in registry.failures
+    assert registry.poll() is None  # Not retried while the file is unchanged
+    publish(tmp_path, "v2")
+    path = tmp_path / "v2" / MODEL_FILENAME
+    os.utime(path, (os.path.getmtime(path) + 10,) * 2)
+    assert registry.poll().version == "v2"
+    assert "v2" not in registry.failures
+
+
+def test_old_versions_are_evicted(tmp_path):
+    evicted = []
+    registry = make_registry(tmp_path, keep_versions=2, on_evict=evicted.append)
+    for version in ("v1", "v2", "v3"):
+        publish(tmp_path, version)
+        registry.activate(version)
+    assert [model.version for model in evicted] == ["v1"]
+    assert registry.get("v1") is None and registry.get("v2") is not None
+    # Rolling back to a resident version does not reload it
+    loads = FakeBackend.loads
+    assert registry.activate("v2") is registry.get("v2")
+    assert FakeBackend.loads == loads
+
+
+def test_active_version_is_never_evicted(tmp_path):
+    registry = make_registry(tmp_path, keep_versions=1)
+    for version in ("v1", "v2"):
+        publish(tmp_path, version)
+    registry.activate("v2")
+    registry.activate("v1")
+    assert registry.active.version == "v1"
+    assert registry.get("v2") is None
+
+
+def test_pinned_versions_stay_loaded_and_are_not_served(tmp_path):
+    evicted = []
+    registry = make_registry(tmp_path, keep_versions=1, on_evict=evicted.append)
+    for version in ("v1", "v2", "v3"):
+        publish(tmp_path, version)
+    registry.activate("v1")
+    pinned = registry.pin("v3")
+    registry.activate("v2")
+    assert registry.active.version == "v2"
+    assert registry.get("v3") is pinned
+    assert [model.version for model in evicted] == ["v1"]
+    assert registry.stats()["pinned"] == ["v3"]
+
+
+def test_pin_requires_a_model_dir(tmp_path):
+    path = tmp_path / MODEL_FILENAME
+    path.write_text("digest-single")
+    registry = ModelRegistry("keras", model_path=str(path), poll_seconds=0)
+    # Single-file mode: the content hash is the version
+    assert registry.load_initial().version == "digest-single"
+    with pytest.raises(ValueError):
+        registry.pin("v1")
@@ -0,0 +1,141 @@
+"""Expiry, eviction and counters of the prediction cache (prediction_cache.py)"""
+
+import os
+import threading
+import time
+
+import pytest
+
+import prediction_cache
+from prediction_cache import FileCacheBackend, MemoryCacheBackend, PredictionCache, create_prediction_cache
+
+RESULT = {"disease": "Cyst", "confidence": 0.9, "timestamp": "2024-01-01T00:00:00"}
+
+
+class Clock:
+    """Stands in for the time module, so TTL tests don't sleep"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(prediction_cache, "time", clock)
+    return clock
+
+
+def test_disabled_and_memory_backend_by_default():
+    assert create_prediction_cache(0, 60, None) is None
+    assert isinstance(create_prediction_cache(4, 60, None).backend, MemoryCacheBackend)
+
+
+def test_key_is_per_model_version():
+    assert PredictionCache.key(b"image", "v1") == PredictionCache.key_from_hash(prediction_cache.hash_image(b"image"),
+                                                                                "v1")
+    assert PredictionCache.key(b"image", "v1") != PredictionCache.key(b"image", "v2")
+    assert PredictionCache.key(b"image", "v1") != PredictionCache.key(b"other", "v1")
+
+
+def test_timestamp_is_not_cached():
+    cache = create_prediction_cache(4, 0, None)
+    key = PredictionCache.key(b"image", "v1")
+    cache.set(key, RESULT)
+    assert cache.get(key) == {"disease": "Cyst", "confidence": 0.9}
+
+
+def test_memory_ttl_expiry(clock):
+    cache = create_prediction_cache(4, 60, None)
+    cache.set("v1:a", RESULT)
+    clock.now += 59
+    assert cache.get("v1:a") is not None
+    clock.now += 2
+    assert cache.get("v1:a") is None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["entries"] == 0
+
+
+def test_memory_lru_eviction():
+    cache = create_prediction_cache(2, 0, None)
+    cache.set("v1:a", RESULT)
+    cache.set("v1:b", RESULT)
+    cache.get("v1:a")  # Most recently used now, so b goes first
+    cache.set("v1:c", RESULT)
+    assert cache.get("v1:b") is None
+    assert cache.get("v1:a") is not None and cache.get("v1:c") is not None
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["evictions"] == 1
+
+
+def test_hit_and_miss_counters():
+    cache = create_prediction_cache(4, 0, None)
+    cache.set("v1:a", RESULT)
+    cache.get("v1:a")
+    cache.get("v1:a")
+    cache.get("v1:b")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+    assert stats["hit_rate"] == pytest.approx(2 / 3)
+    assert create_prediction_cache(4, 0, None).stats()["hit_rate"] == 0.0
+
+
+def test_counters_are_exact_across_threads():
+    cache = create_prediction_cache(4, 0, None)
+    cache.set("v1:a", RESULT)
+
+    def lookups():
+        for _ in range(2000):
+            cache.get("v1:a")
+            cache.get("v1:missing")
+
+    threads = [threading.Thread(target=lookups) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (cache.hits, cache.misses) == (16000, 16000)
+
+
+@pytest.mark.parametrize("directory", [False, True])
+def test_invalidate_drops_one_model_version(directory, tmp_path):
+    cache = create_prediction_cache(8, 0, str(tmp_path) if directory else None)
+    for key in ("v1:a", "v1:b", "v2:a"):
+        cache.set(key, RESULT)
+    assert cache.invalidate("v1") == 2
+    assert cache.get("v1:a") is None and cache.get("v2:a") is not None
+    assert cache.stats()["entries"] == 1
+
+
+def test_file_backend_is_shared_between_instances(tmp_path):
+    writer = create_prediction_cache(4, 0, str(tmp_path))
+    reader = create_prediction_cache(4, 0, str(tmp_path))
+    assert isinstance(writer.backend, FileCacheBackend)
+    writer.set("v1:a", RESULT)
+    assert reader.get("v1:a") == {"disease": "Cyst", "confidence": 0.9}
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_file_ttl_expiry(tmp_path):
+    backend = FileCacheBackend(str(tmp_path), 4, ttl_seconds=60)
+    backend.set("v1:a", RESULT)
+    assert backend.get("v1:a") is not None
+    old = time.time() - 61
+    os.utime(backend._path("v1:a"), (old, old))
+    assert backend.get("v1:a") is None
+    assert backend.evictions == 1 and len(backend) == 0
+
+
+def test_file_prune_removes_the_oldest_entries(tmp_path):
+    backend = FileCacheBackend(str(tmp_path), 2, prune_every=4)
+    for i, key in enumerate(("v1:a", "v1:b", "v1:c")):
+        backend.set(key, RESULT)
+        os.utime(backend._path(key), (1000 + i, 1000 + i))
+    assert len(backend) == 3  # Not pruned until the 4th write
+    backend.set("v1:d", RESULT)
+    assert len(backend) == 2 and backend.evictions == 2
+    assert backend.get("v1:a") is None and backend.get("v1:b") is None
+    assert backend.get("v1:d") is not None
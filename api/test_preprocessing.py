@@ -0,0 +1,44 @@
+"""Parity of the serving preprocessing with the notebook's training transform (see check_preprocessing.py)"""
+
+import numpy as np
+import pytest
+
+from check_preprocessing import is_draft_decoded, write_synthetic_cases
+from preprocessing import (allocate_batch, decode_image, preprocess_batch, preprocess_image, resize_uint8,
+                           to_model_input, training_transform)
+
+# Mean absolute difference (0-255 scale) allowed for JPEGs large enough to be draft-decoded
+DRAFT_TOLERANCE = 2.0
+
+
+@pytest.fixture(scope="module")
+def cases(tmp_path_factory):
+    return write_synthetic_cases(str(tmp_path_factory.mktemp("preprocessing")))
+
+
+def assert_matches_training(name: str, path: str, served: np.ndarray):
+    reference = training_transform(path)
+    assert served.shape == reference.shape and served.dtype == np.float32
+    difference = np.abs(served - reference)
+    if is_draft_decoded(path):
+        assert difference.mean() <= DRAFT_TOLERANCE, f"{name}: mean diff {difference.mean():.3f}"
+    else:
+        assert difference.max() == 0, f"{name}: max diff {difference.max():.0f}"
+
+
+def test_preprocess_batch_matches_training_transform(cases):
+    # One reused, oversized buffer, as the batch callers use it
+    batch = preprocess_batch([path for _, path in cases], out=allocate_batch(len(cases) + 8))
+    assert len(batch) == len(cases)
+    for (name, path), served in zip(cases, batch):
+        assert_matches_training(name, path, served)
+        np.testing.assert_array_equal(preprocess_image(path)[0], served)
+
+
+def test_uploaded_bytes_match_training_transform(cases):
+    # The API's path: decode the upload, resize to uint8 BGR, stack into the float32 model input
+    for name, path in cases:
+        with open(path, "rb") as f:
+            resized = resize_uint8(decode_image(f.read()))
+        assert resized.dtype == np.uint8
+        assert_matches_training(name, path, to_model_input([resized])[0])
@@ -0,0 +1,81 @@
+"""Decisions of the kidney-scan validator (validation.py) on known images"""
+
+import numpy as np
+import pytest
+
+from validation import (GRAYSCALE_RESULT, LOW_COLOR_VARIATION_RESULT, MEDICAL_CHARACTERISTICS_RESULT,
+                        NOT_A_SCAN_RESULT, VALIDATION_STRIDE, is_kidney_scan_image, validate_batch)
+
+SIZE = 128
+
+
+def original_decision(rgb_pixels: np.ndarray) -> dict:
+    """The validator this replaced, on a given set of (N, 3) uint8 RGB pixels instead of a random sample"""
+    r, g, b = rgb_pixels[:, 0], rgb_pixels[:, 1], rgb_pixels[:, 2]
+    color_variance = np.std(r - g) + np.std(g - b) + np.std(r - b)
+    if color_variance < 20:
+        return LOW_COLOR_VARIATION_RESULT
+    brightness = np.mean(rgb_pixels)
+    contrast = np.std(rgb_pixels)
+    if 50 < brightness < 200 and 20 < contrast < 100:
+        return MEDICAL_CHARACTERISTICS_RESULT
+    return NOT_A_SCAN_RESULT
+
+
+def bgr(rgb: np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(rgb[..., ::-1])
+
+
+def gray_scan(seed: int = 0) -> np.ndarray:
+    """A CT-like image: equal channels, mid brightness and contrast"""
+    gray = np.random.default_rng(seed).normal(120, 40, (SIZE, SIZE)).clip(0, 255).astype(np.uint8)
+    return np.repeat(gray[..., np.newaxis], 3, axis=2)
+
+
+def test_grayscale_array():
+    assert is_kidney_scan_image(np.zeros((SIZE, SIZE), np.uint8)) == GRAYSCALE_RESULT
+
+
+def test_gray_scan_is_accepted():
+    assert is_kidney_scan_image(gray_scan()) == LOW_COLOR_VARIATION_RESULT
+
+
+def test_bright_colorful_photo_is_rejected():
+    photo = np.random.default_rng(1).integers(150, 256, (SIZE, SIZE, 3), dtype=np.uint8)
+    assert is_kidney_scan_image(photo) == NOT_A_SCAN_RESULT
+
+
+def test_tinted_scan_has_medical_characteristics():
+    # Strong, varying tint (high color variance), brightness and contrast in the medical range
+    rng = np.random.default_rng(2)
+    rgb = np.stack([rng.normal(mean, 30, (SIZE, SIZE)) for mean in (160, 100, 60)], axis=2)
+    assert is_kidney_scan_image(bgr(rgb.clip(0, 255).astype(np.uint8))) == MEDICAL_CHARACTERISTICS_RESULT
+
+
+def test_uint8_wraparound_is_kept():
+    # Red one level below green on some pixels: r - g wraps to 255 in uint8, as in the original validator
+    rgb = gray_scan(3).astype(np.int16)
+    rgb[:, ::8, 0] -= 1
+    rgb = rgb.clip(0, 255).astype(np.uint8)
+    assert original_decision(rgb.reshape(-1, 3)) == MEDICAL_CHARACTERISTICS_RESULT
+    assert is_kidney_scan_image(bgr(rgb)) == MEDICAL_CHARACTERISTICS_RESULT
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_same_decisions_as_the_original_validator(seed):
+    rng = np.random.default_rng(seed)
+    # Around the thresholds: a gray base of random brightness and contrast, with per-channel noise and tint
+    low = rng.integers(0, 200)
+    base = rng.integers(low, low + rng.integers(20, 120), (SIZE, SIZE, 1))
+    noise = rng.normal(rng.uniform(-20, 20, 3), rng.uniform(0, 12), (SIZE, SIZE, 3))
+    rgb = (base + noise).clip(0, 255).astype(np.uint8)
+    sampled = rgb[::VALIDATION_STRIDE, ::VALIDATION_STRIDE].reshape(-1, 3)
+    assert is_kidney_scan_image(bgr(rgb)) == original_decision(sampled)
+
+
+def test_deterministic_and_batch_matches_single_images():
+    rng = np.random.default_rng(4)
+    images = np.stack([gray_scan(5), rng.integers(0, 256, (SIZE, SIZE, 3), dtype=np.uint8), gray_scan(6)])
+    first = validate_batch(images)
+    assert validate_batch(images) == first
+    assert [is_kidney_scan_image(image) for image in images] == first
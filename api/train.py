@@ -0,0 +1,304 @@
+"""
+Train the kidney classification model on the CT dataset.
+
+Trains the notebook's architecture (``create_kidney_model``) on the
+``<split>/<Class>/`` layout through the streaming input pipeline of
+training_data.py (or a cache compiled by dataset_cache.py), and writes:
+
+    kidney_model.h5      # the trained model, float32, ready to serve (or .npz weights, see kidney_model.py)
+    kidney_model.json    # metadata: classes, input shape, preprocessing, metrics
+
+Training is reproducible: the weights, dropout and shuffling are seeded with
+``--seed``, and ``--deterministic`` also makes every op deterministic (at some
+cost in speed). With early stopping the weights of the epoch with the lowest
+validation loss are saved, whether or not it stopped the run (with
+``--patience 0`` the last epoch's weights are saved), and
+``--checkpoint-dir`` keeps the best weights and a backup of the last epoch, so
+an interrupted run resumes where it stopped.
+
+CPU options:
+- ``--intra-op-threads`` / ``--inter-op-threads`` size TensorFlow's thread pools
+- ``--xla`` compiles the training step with XLA
+- ``--mixed-precision`` computes in bfloat16 (fast on CPUs with AVX512-BF16 or
+  AMX) while keeping float32 weights; the saved model is float32
+- ``--replicas N`` trains data-parallel on N replicas of the model
+  (MirroredStrategy over N logical CPU devices); ``--replicas 0`` uses one per
+  core. Each replica computes the gradients of its share of every batch and
+  they are averaged, so ``--batch-size`` is the global batch size (not
+  combinable with ``--xla``)
+
+The model is only written if training completes; it is staged next to the
+output and renamed into place, so a server watching the file never sees a
+partial model.
+
+Usage:
+    python train.py CT-Dataset
+    python train.py CT-Dataset --compiled-dir ct-cache --replicas 0 --mixed-precision
+    python train.py CT-Dataset --compiled-dir ct-cache --xla --intra-op-threads 16 --inter-op-threads 2
+    python train.py CT-Dataset --epochs 50 --patience 5 --checkpoint-dir checkpoints --output models/v2/kidney_model.h5
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Optional
+
+import tensorflow as tf
+
+from dataset import CLASSES
+from kidney_model import METADATA_FORMAT, create_kidney_model, metadata_path, save_weights
+from preprocessing import INPUT_SHAPE, PREPROCESSING_VERSION
+from training_data import SHUFFLE_SEED, ImagesPerSecond, load_split
+
+# What the model expects as input (see preprocessing.py)
+PREPROCESSING_SPEC = {
+    "version": PREPROCESSING_VERSION,
+    "input_shape": list(INPUT_SHAPE),
+    "channel_order": "BGR",
+    "resize": "bilinear",
+    "dtype": "float32",
+    "range": [0, 255],
+}
+
+
+def configure_runtime(intra_op_threads: int = 0, inter_op_threads: int = 0, replicas: int = 1,
+                      mixed_precision: bool = False, deterministic: bool = False,
+                      seed: int = SHUFFLE_SEED) -> tf.distribute.Strategy:
+    """
+    Set up TensorFlow for training and return the distribution strategy.
+    Must run before TensorFlow executes anything (thread pools and logical
+    devices are fixed once the runtime is initialized).
+    """
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    tf.keras.utils.set_random_seed(seed)
+    if deterministic:
+        tf.config.experimental.enable_op_determinism()
+    if mixed_precision:
+        tf.keras.mixed_precision.set_global_policy("mixed_bfloat16")
+
+    replicas = replicas or os.cpu_count() or 1
+    if replicas == 1:
+        return tf.distribute.get_strategy()
+    cpu = tf.config.list_physical_devices("CPU")[0]
+    tf.config.set_logical_device_configuration(cpu, [tf.config.LogicalDeviceConfiguration()] * replicas)
+    devices = [device.name for device in tf.config.list_logical_devices("CPU")]
+    return tf.distribute.MirroredStrategy(devices, cross_device_ops=tf.distribute.ReductionToOneDevice())
+
+
+def build_model(learning_rate: float, xla: bool) -> tf.keras.Model:
+    """The notebook architecture, compiled for training"""
+    model = create_kidney_model()
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate), loss="sparse_categorical_crossentropy",
+                  metrics=["accuracy"], jit_compile=xla)
+    return model
+
+
+def float32_copy(model: tf.keras.Model) -> tf.keras.Model:
+    """The same weights in a float32 model, for serving a model trained with mixed precision"""
+    policy = tf.keras.mixed_precision.global_policy()
+    tf.keras.mixed_precision.set_global_policy("float32")
+    try:
+        copy = create_kidney_model()
+    finally:
+        tf.keras.mixed_precision.set_global_policy(policy)
+    # Mixed precision keeps the variables in float32, so this is exact
+    copy.set_weights(model.get_weights())
+    return copy
+
+
+def save_model(model: tf.keras.Model, path: str, metadata: Dict[str, Any]):
+    """Write the model and its metadata, each staged next to the target and renamed into place"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(path)[1], dir=directory, delete=False) as f:
+        staged_model = f.name
+    with tempfile.NamedTemporaryFile("w", suffix=".json", dir=directory, delete=False) as f:
+        json.dump(metadata, f, indent=2)
+        staged_metadata = f.name
+    try:
+        if path.endswith(".npz"):
+            save_weights(model, staged_model)
+        else:
+            model.save(staged_model)
+        # Metadata first: whoever sees the new model also finds its description
+        os.replace(staged_metadata, metadata_path(path))
+        os.replace(staged_model, path)
+    finally:
+        for staged in (staged_model, staged_metadata):
+            if os.path.exists(staged):
+                os.remove(staged)
+
+
+class BestWeights(tf.keras.callbacks.Callback):
+    """
+    Keeps the weights of the epoch with the lowest validation loss and sets them
+    back when training ends. EarlyStopping's restore_best_weights does not do
+    this in every Keras version (Keras 2 restores only when it stops the run).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.best_loss = float("inf")
+        self.best_epoch: Optional[int] = None
+        self.best_weights = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        loss = (logs or {}).get("val_loss")
+        if loss is not None and loss < self.best_loss:
+            self.best_loss, self.best_epoch = loss, epoch
+            self.best_weights = self.model.get_weights()
+
+    def on_train_end(self, logs=None):
+        if self.best_weights is not None:
+            self.model.set_weights(self.best_weights)
+
+
+def checkpoint_callbacks(checkpoint_dir: Optional[str]) -> list:
+    if not checkpoint_dir:
+        return []
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    return [
+        tf.keras.callbacks.ModelCheckpoint(os.path.join(checkpoint_dir, "best.weights.h5"), monitor="val_loss",
+                                           save_best_only=True, save_weights_only=True),
+        # Resumes an interrupted run from its last completed epoch
+        tf.keras.callbacks.BackupAndRestore(os.path.join(checkpoint_dir, "backup")),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the kidney classification model")
+    parser.add_argument("data_dir", help="Dataset root holding <split>/<Class>/ folders (e.g. CT-Dataset)")
+    parser.add_argument("--compiled-dir", help="Read the splits compiled by dataset_cache.py in this directory")
+    parser.add_argument("--cache-dir", help="Cache decoded images in this directory (without --compiled-dir)")
+    parser.add_argument("--train-split", default="train")
+    parser.add_argument("--validation-split", default="test",
+                        help="Split for early stopping and checkpointing (the notebook validates on test; "
+                             "use a separate val split to keep test untouched)")
+    parser.add_argument("--test-split", default="test", help="Split evaluated after training ('' to skip)")
+    parser.add_argument("--output", default="kidney_model.h5")
+    parser.add_argument("--epochs", type=int, default=25)
+    parser.add_argument("--batch-size", type=int, default=32, help="Global batch size, split between replicas")
+    parser.add_argument("--learning-rate", type=float, default=0.001)
+    parser.add_argument("--patience", type=int, default=5,
+                        help="Stop after this many epochs without a lower validation loss, and save the best "
+                             "epoch's weights (0 disables both: the last epoch's weights are saved)")
+    parser.add_argument("--checkpoint-dir", help="Keep the best weights and resume interrupted runs from here")
+    parser.add_argument("--seed", type=int, default=SHUFFLE_SEED)
+    parser.add_argument("--deterministic", action="store_true", help="Make every op deterministic (slower)")
+    parser.add_argument("--intra-op-threads", type=int, default=0, help="Threads per op (0: TensorFlow default)")
+    parser.add_argument("--inter-op-threads", type=int, default=0,
+                        help="Ops run concurrently (0: TensorFlow default)")
+    parser.add_argument("--xla", action="store_true", help="Compile the training step with XLA")
+    parser.add_argument("--mixed-precision", action="store_true", help="Compute in bfloat16, keep float32 weights")
+    parser.add_argument("--replicas", type=int, default=1,
+                        help="Data-parallel replicas on this machine (0: one per CPU core)")
+    args = parser.parse_args()
+    if args.xla and args.replicas != 1:
+        # XLA cannot compile a step that reads the variables of other (logical) devices
+        parser.error("--xla needs --replicas 1")
+
+    strategy = configure_runtime(args.intra_op_threads, args.inter_op_threads, args.replicas,
+                                 args.mixed_precision, args.deterministic, args.seed)
+    source = {"compiled_dir": args.compiled_dir} if args.compiled_dir else {"cache_dir": args.cache_dir}
+    try:
+        train_ds, train_images = load_split(args.data_dir, args.train_split, args.batch_size, seed=args.seed,
+                                            **source)
+        validation_ds, validation_images = load_split(args.data_dir, args.validation_split, args.batch_size,
+                                                      training=False, **source)
+        test_ds, test_images = (load_split(args.data_dir, args.test_split, args.batch_size, training=False,
+                                           **source) if args.test_split else (None, 0))
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if not train_images:
+        print(f"Error: fewer than --batch-size {args.batch_size} images in the {args.train_split} split")
+        sys.exit(1)
+    # Upper bounds: corrupt images are only found, and skipped, while decoding
+    print(f"Training on up to {train_images} images per epoch, validating on up to {validation_images}, "
+          f"{strategy.num_replicas_in_sync} replica(s)")
+
+    with strategy.scope():
+        model = build_model(args.learning_rate, args.xla)
+    callbacks = [ImagesPerSecond(args.batch_size)] + checkpoint_callbacks(args.checkpoint_dir)
+    best_weights = BestWeights() if args.patience else None
+    if best_weights is not None:
+        callbacks += [tf.keras.callbacks.EarlyStopping(monitor="val_loss", patience=args.patience), best_weights]
+
+    started = time.perf_counter()
+    history = model.fit(train_ds, validation_data=validation_ds, epochs=args.epochs, callbacks=callbacks, verbose=2)
+    training_seconds = time.perf_counter() - started
+    # The epochs run are those of this invocation: a resumed run starts after the epochs restored from the backup
+    epochs_run = history.epoch
+    # History keeps numpy scalars
+    history = {name: [float(value) for value in values] for name, values in history.history.items()}
+    if not epochs_run:
+        print(f"Nothing to train: the run in {args.checkpoint_dir} already completed {args.epochs} epochs")
+        sys.exit(1)
+    initial_epoch = epochs_run[0]
+    # BestWeights restored the best epoch of this run; without it the model holds the last epoch's
+    if best_weights is not None and best_weights.best_epoch in epochs_run:
+        saved = epochs_run.index(best_weights.best_epoch)
+    else:
+        saved = len(epochs_run) - 1
+
+    if args.mixed_precision:
+        model = float32_copy(model)
+        model.compile(loss="sparse_categorical_crossentropy", metrics=["accuracy"])
+    metrics = {
+        "epoch": epochs_run[saved] + 1,
+        "val_loss": history["val_loss"][saved],
+        "val_accuracy": history["val_accuracy"][saved],
+        "images_per_second": sum(history["images_per_second"]) / len(history["images_per_second"]),
+    }
+    if test_ds is not None:
+        # Evaluated with the weights that are saved (in float32)
+        test_loss, test_accuracy = model.evaluate(test_ds, verbose=0)
+        metrics.update(test_loss=float(test_loss), test_accuracy=float(test_accuracy), test_images=test_images)
+
+    metadata = {
+        "format": METADATA_FORMAT,
+        "classes": CLASSES,
+        "input_shape": list(INPUT_SHAPE),
+        "preprocessing": PREPROCESSING_SPEC,
+        "metrics": metrics,
+        "history": history,
+        "training": {
+            "data_dir": os.path.abspath(args.data_dir),
+            "compiled_dir": os.path.abspath(args.compiled_dir) if args.compiled_dir else None,
+            "splits": {"train": args.train_split, "validation": args.validation_split, "test": args.test_split},
+            # As counted by ImagesPerSecond in the last epoch
+            "train_images": int(history["images"][-1]),
+            "epochs": args.epochs,
+            "initial_epoch": initial_epoch,
+            "epochs_run": len(epochs_run),
+            "batch_size": args.batch_size,
+            "learning_rate": args.learning_rate,
+            "patience": args.patience,
+            "seed": args.seed,
+            "deterministic": args.deterministic,
+            "xla": args.xla,
+            "mixed_precision": args.mixed_precision,
+            "replicas": strategy.num_replicas_in_sync,
+            "intra_op_threads": args.intra_op_threads,
+            "inter_op_threads": args.inter_op_threads,
+            "seconds": training_seconds,
+            "tensorflow": tf.__version__,
+            "finished_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+    }
+    save_model(model, args.output, metadata)
+
+    print(f"\nSaved the weights of epoch {metrics['epoch']}: val_loss {metrics['val_loss']:.4f}, "
+          f"val_accuracy {metrics['val_accuracy']:.4f}")
+    if test_ds is not None:
+        print(f"Test accuracy {metrics['test_accuracy']:.4f} on {test_images} images")
+    print(f"Trained in {training_seconds:.0f}s, {metrics['images_per_second']:.0f} images/s")
+    print(f"Model saved as {args.output}, metadata as {metadata_path(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Streaming tf.data input pipeline for training on the CT dataset.
+
+The notebook decodes every image with cv2 in a serial Python loop and keeps
+the whole dataset in numpy arrays, so memory grows with the dataset and
+loading uses a single core. This pipeline streams the images instead:
+
+- only the list of file paths is held in memory; images are read, decoded and
+  resized by TensorFlow ops on tf.data's thread pool (``AUTOTUNE`` parallel
+  calls), so decoding runs on every core outside the GIL
+- batches are prefetched while the model trains on the previous one
+- decoded images can be cached to disk (``cache_dir``), so later epochs skip
+  decoding without holding the dataset in RAM
+- ``num_shards`` / ``shard_index`` give each worker of a multi-worker job its
+  own subset of the files
+
+A dataset compiled with dataset_cache.py (``compiled_dir``) skips decoding
+altogether: batches are gathered from its memory-mapped arrays.
+
+Memory is bounded by the shuffle buffer and the prefetched batches, whatever
+the size of the dataset. The transform reproduces the notebook's
+``cv2.imread`` + ``cv2.resize`` (BGR, bilinear, float32 in 0-255) to within
+one grey level; ``--check`` measures the difference.
+
+Usage:
+    python training_data.py CT-Dataset --epochs 3
+    python training_data.py CT-Dataset --cache-dir /tmp/ct-cache --serial --check 200
+    python training_data.py CT-Dataset --compiled-dir ct-cache
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import tensorflow as tf
+
+from dataset import list_split
+from dataset_cache import CompiledSplit, open_split
+from preprocessing import IMGSIZE, training_transform
+
+logger = logging.getLogger(__name__)
+
+# Formats tf.io can decode; other files of the dataset (TIFF) are left out of training
+TF_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+
+# Decoded images (128x128x3 float32, 192 KB each) held for shuffling; ~200 MB
+SHUFFLE_BUFFER = 1024
+SHUFFLE_SEED = 42
+
+
+def decode_and_resize(path: tf.Tensor) -> tf.Tensor:
+    """Read, decode and resize one image file to the model input: IMGSIZE x IMGSIZE BGR float32 in 0-255"""
+    data = tf.io.read_file(path)
+    # Accurate IDCT, as libjpeg uses for cv2.imread; decode_image's default differs by a few grey levels
+    image = tf.cond(
+        tf.io.is_jpeg(data),
+        lambda: tf.io.decode_jpeg(data, channels=3, dct_method="INTEGER_ACCURATE"),
+        lambda: tf.io.decode_image(data, channels=3, expand_animations=False),
+    )
+    # Half-pixel bilinear without antialiasing, like cv2.resize(INTER_LINEAR); rounded as cv2 rounds uint8
+    image = tf.image.resize(tf.cast(image, tf.float32), (IMGSIZE, IMGSIZE), method="bilinear", antialias=False)
+    image = tf.clip_by_value(tf.round(image), 0.0, 255.0)
+    # cv2 channel order
+    return tf.reverse(image, axis=[-1])
+
+
+def cache_path(cache_dir: str, paths: Sequence[str], shard_index: int, num_shards: int) -> str:
+    """Cache file prefix, keyed by the file list so a changed dataset is never served from a stale cache"""
+    digest = hashlib.sha1("\n".join(paths).encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, f"images-{IMGSIZE}-{digest}-{shard_index}of{num_shards}")
+
+
+def decodable_files(paths: Sequence[str], labels: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """The paths (and their labels) in a format tf.io can decode; the others are logged and left out"""
+    paths = np.asarray(paths, dtype=str)
+    labels = np.asarray(labels, dtype=np.int64)
+    decodable = np.array([path.lower().endswith(TF_IMAGE_EXTENSIONS) for path in paths], dtype=bool)
+    if not decodable.all():
+        logger.warning(f"Skipping {int((~decodable).sum())} images in formats tf.io cannot decode "
+                       f"(e.g. {paths[~decodable][0]})")
+    return paths[decodable], labels[decodable]
+
+
+def make_dataset(paths: Sequence[str], labels: Sequence[int], batch_size: int = 32, training: bool = True,
+                 shuffle_buffer: int = SHUFFLE_BUFFER, cache_dir: Optional[str] = None, num_shards: int = 1,
+                 shard_index: int = 0, seed: int = SHUFFLE_SEED) -> tf.data.Dataset:
+    """
+    Batched (images, labels) dataset streamed from image files.
+
+    Training datasets are shuffled every epoch and drop the last partial batch;
+    evaluation datasets keep the file order and every image. Files tf.io cannot
+    decode are skipped with a warning rather than failing the epoch.
+    """
+    paths, labels = decodable_files(paths, labels)
+    if training:
+        # The dataset layout is sorted by class; one full permutation of the (small) file list up front, with
+        # the same seed on every worker so the shards stay disjoint
+        order = np.random.default_rng(seed).permutation(len(paths))
+        paths, labels = paths[order], labels[order]
+
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    if num_shards > 1:
+        # Before decoding, so a worker only reads its own files
+        dataset = dataset.shard(num_shards, shard_index)
+    if training and not cache_dir:
+        # Shuffling file names is cheap: a full reshuffle every epoch
+        dataset = dataset.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+
+    dataset = dataset.map(lambda path, label: (decode_and_resize(path), label),
+                          num_parallel_calls=tf.data.AUTOTUNE, deterministic=not training)
+    # A truncated or corrupt file is logged and dropped (before caching, so it is not cached either)
+    dataset = dataset.ignore_errors(log_warning=True)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        dataset = dataset.cache(cache_path(cache_dir, paths.tolist(), shard_index, num_shards))
+        if training:
+            # Cached images come back in a fixed order; a bounded buffer reshuffles them
+            dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+
+    dataset = dataset.batch(batch_size, drop_remainder=training, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def make_compiled_dataset(compiled: CompiledSplit, batch_size: int = 32, training: bool = True,
+                          num_shards: int = 1, shard_index: int = 0, seed: int = SHUFFLE_SEED) -> tf.data.Dataset:
+    """
+    Batched (images, labels) dataset read from a compiled split (see dataset_cache.py).
+
+    Evaluation batches are consecutive rows, i.e. views of the memory map;
+    training batches gather a fresh random permutation every epoch.
+    """
+    rows = np.arange(shard_index, len(compiled.labels), num_shards)
+    rng = np.random.default_rng(seed)
+
+    def batches():
+        order = rng.permutation(rows) if training else rows
+        stop = len(order) - len(order) % batch_size if training else len(order)
+        for start in range(0, stop, batch_size):
+            batch = order[start:start + batch_size]
+            if not training and num_shards == 1:
+                yield compiled.images[batch[0]:batch[-1] + 1], compiled.labels[batch[0]:batch[-1] + 1]
+            else:
+                # Sorted, so the gather walks the file forwards
+                batch = np.sort(batch)
+                yield compiled.images[batch], compiled.labels[batch]
+
+    dataset = tf.data.Dataset.from_generator(batches, output_signature=(
+        tf.TensorSpec((None, IMGSIZE, IMGSIZE, 3), tf.uint8), tf.TensorSpec((None,), tf.int64)))
+    dataset = dataset.map(lambda images, labels: (tf.cast(images, tf.float32), labels),
+                          num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def load_split(data_dir: str, split: str, batch_size: int = 32, training: Optional[bool] = None,
+               num_shards: int = 1, shard_index: int = 0, compiled_dir: Optional[str] = None,
+               **kwargs) -> Tuple[tf.data.Dataset, int]:
+    """
+    Dataset of one split of the CT-Dataset layout (see dataset.py), read from the
+    image files or from the split compiled in compiled_dir, and the number of
+    images it yields per epoch. From image files that number is an upper bound:
+    images that turn out to be corrupt are skipped while decoding.
+    """
+    training = split == "train" if training is None else training
+    if compiled_dir:
+        compiled = open_split(compiled_dir, split)
+        num_files = len(compiled.labels)
+        dataset = make_compiled_dataset(compiled, batch_size, training, num_shards, shard_index,
+                                        seed=kwargs.get("seed", SHUFFLE_SEED))
+    else:
+        paths, labels = decodable_files(*list_split(data_dir, split))
+        if not len(paths):
+            raise FileNotFoundError(f"No images in {os.path.join(data_dir, split)}")
+        num_files = len(paths)
+        dataset = make_dataset(paths, labels, batch_size, training, num_shards=num_shards, shard_index=shard_index,
+                               **kwargs)
+    num_images = len(range(shard_index, num_files, num_shards))
+    if training:
+        num_images -= num_images % batch_size
+    return dataset, num_images
+
+
+class ImagesPerSecond(tf.keras.callbacks.Callback):
+    """
+    Reports the images trained on in each epoch and the throughput, and adds both
+    to the logs (and so to the History). Images are counted from the batches
+    actually run, so corrupt images skipped while decoding are not counted.
+    """
+
+    def __init__(self, batch_size: int):
+        super().__init__()
+        # Training batches are full (drop_remainder), so every batch holds batch_size images
+        self.batch_size = batch_size
+        self.batches = 0
+        self.epoch_started = 0.0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.batches = 0
+        self.epoch_started = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        # The index of the last batch run (callbacks may only see every steps_per_execution-th)
+        self.batches = batch + 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        images = self.batches * self.batch_size
+        images_per_second = images / (time.perf_counter() - self.epoch_started)
+        if logs is not None:
+            logs["images"] = images
+            logs["images_per_second"] = images_per_second
+        print(f"Epoch {epoch + 1}: {images} images, {images_per_second:.0f} images/s")
+
+
+def time_epochs(dataset: tf.data.Dataset, epochs: int) -> List[Tuple[int, float]]:
+    """(images, seconds) for each full pass over a dataset, without a model"""
+    timings = []
+    for _ in range(epochs):
+        started = time.perf_counter()
+        images = sum(int(labels.shape[0]) for _, labels in dataset)
+        timings.append((images, time.perf_counter() - started))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the throughput of the streaming training input pipeline")
+    parser.add_argument("data_dir", help="Dataset root holding <split>/<Class>/ folders")
+    parser.add_argument("--split", default="train")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--cache-dir", help="Cache decoded images in this directory")
+    parser.add_argument("--compiled-dir", help="Read the split compiled by dataset_cache.py in this directory")
+    parser.add_argument("--serial", action="store_true", help="Also time the notebook's serial cv2 loading")
+    parser.add_argument("--check", type=int, default=0, metavar="N",
+                        help="Compare N images against the notebook's cv2 transform")
+    args = parser.parse_args()
+
+    if args.compiled_dir:
+        dataset, num_images = load_split(args.data_dir, args.split, args.batch_size, compiled_dir=args.compiled_dir)
+    else:
+        dataset, num_images = load_split(args.data_dir, args.split, args.batch_size, cache_dir=args.cache_dir)
+    print(f"{num_images} images per epoch from {os.path.join(args.data_dir, args.split)}")
+    for epoch, (images, seconds) in enumerate(time_epochs(dataset, args.epochs), start=1):
+        print(f"Epoch {epoch}: {images} images in {seconds:.2f}s, {images / seconds:.0f} images/s")
+
+    paths, _ = list_split(args.data_dir, args.split)
+    if args.serial:
+        started = time.perf_counter()
+        np.array([training_transform(path) for path in paths])
+        seconds = time.perf_counter() - started
+        print(f"Notebook loading (serial cv2, in RAM): {len(paths)} images in {seconds:.2f}s, "
+              f"{len(paths) / seconds:.0f} images/s")
+
+    if args.check:
+        differences = []
+        for path in decodable_files(paths, [0] * len(paths))[0][:args.check]:
+            try:
+                differences.append(np.abs(decode_and_resize(tf.constant(path)).numpy() - training_transform(path)))
+            except (tf.errors.InvalidArgumentError, ValueError) as e:
+                print(f"Skipping {path}: {e}")
+        differences = np.stack(differences)
+        print(f"Difference to the notebook transform over {len(differences)} images: "
+              f"max {differences.max():.0f}, mean {differences.mean():.3f} grey levels")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Heuristic check that an upload looks like a kidney scan before it is classified.
+
+The validator works on the IMGSIZE x IMGSIZE uint8 array produced by
+preprocessing.resize_uint8 rather than on the full-resolution image. Statistics
+are taken over a fixed-stride grid of pixels (1024 of them at 128x128), so the
+same image always gets the same answer, and a whole batch is validated in one
+vectorized pass. The statistics use the original validator's arithmetic (RGB
+channel differences in uint8), so its thresholds keep their meaning.
+"""
+
+from typing import Any, Dict, List
+
+import numpy as np
+
+# Every VALIDATION_STRIDE-th row and column is sampled
+VALIDATION_STRIDE = 4
+
+# Below this, the channels are close enough to call the image grayscale-like
+MAX_COLOR_VARIANCE = 20
+BRIGHTNESS_RANGE = (50, 200)
+CONTRAST_RANGE = (20, 100)
+
+GRAYSCALE_RESULT = {
+    "is_kidney_scan": True,
+    "confidence": 0.8,
+    "reason": "Grayscale medical image detected"
+}
+LOW_COLOR_VARIATION_RESULT = {
+    "is_kidney_scan": True,
+    "confidence": 0.8,
+    "reason": "Medical scan-like image detected (low color variation)"
+}
+MEDICAL_CHARACTERISTICS_RESULT = {
+    "is_kidney_scan": True,
+    "confidence": 0.7,
+    "reason": "Medical image characteristics detected"
+}
+NOT_A_SCAN_RESULT = {
+    "is_kidney_scan": False,
+    "confidence": 0.9,
+    "reason": "Image does not appear to be a medical scan"
+}
+
+
+def validate_batch(images: np.ndarray) -> List[Dict[str, Any]]:
+    """
+    Validate a batch of BGR uint8 images of shape (N, H, W, 3) (as made by
+    preprocessing.resize_uint8), or (N, H, W) for grayscale. Returns one result
+    dict per image.
+    """
+    images = np.asarray(images)
+    if images.ndim == 3:
+        return [dict(GRAYSCALE_RESULT) for _ in range(len(images))]
+
+    sample = images[:, ::VALIDATION_STRIDE, ::VALIDATION_STRIDE].reshape(len(images), -1, images.shape[-1])
+    sample = sample.astype(np.uint8, copy=False)
+
+    # As the original validator: RGB differences taken in uint8, so they wrap around (10 - 20 = 246)
+    b, g, r = sample[..., 0], sample[..., 1], sample[..., 2]
+    color_variance = np.std(r - g, axis=1) + np.std(g - b, axis=1) + np.std(r - b, axis=1)
+    brightness = sample.mean(axis=(1, 2))
+    contrast = sample.std(axis=(1, 2))
+
+    low_color = color_variance < MAX_COLOR_VARIANCE
+    medical = ((BRIGHTNESS_RANGE[0] < brightness) & (brightness < BRIGHTNESS_RANGE[1])
+               & (CONTRAST_RANGE[0] < contrast) & (contrast < CONTRAST_RANGE[1]))
+
+    results = []
+    for is_low_color, is_medical in zip(low_color, medical):
+        if is_low_color:
+            results.append(dict(LOW_COLOR_VARIATION_RESULT))
+        elif is_medical:
+            results.append(dict(MEDICAL_CHARACTERISTICS_RESULT))
+        else:
+            results.append(dict(NOT_A_SCAN_RESULT))
+    return results
+
+
+def is_kidney_scan_image(img_resized: np.ndarray) -> Dict[str, Any]:
+    """Validate one resized image of shape (H, W, 3) or (H, W)"""
+    try:
+        return validate_batch(img_resized[np.newaxis])[0]
+    except Exception as e:
+        return {
+            "is_kidney_scan": False,
+            "confidence": 0.5,
+            "reason": f"Error validating image: {str(e)}"
+        }
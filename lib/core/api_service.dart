@@ -1,6 +1,14 @@
 import 'dart:convert';
 import 'dart:io';
 import 'package:http/http.dart' as http;
+import 'package:http_parser/http_parser.dart';
+
+// Response format with integer codes instead of English text; see api/responses.py
+const String compactJsonMediaType = 'application/vnd.kidney.compact+json';
+
+// Code tables of the compact format (indices match api/responses.py)
+const List<String> predictionClasses = ['Cyst', 'Normal', 'Stone', 'Tumor'];
+const List<String> predictionSeverities = ['None', 'Low', 'Medium', 'High'];
 
 class PredictionResult {
   final String disease;
@@ -10,6 +18,14 @@ class PredictionResult {
   final List<String> recommendations;
   final double timestamp;
   final bool validationError;
+  // Only set for compact responses; the UI localizes these instead of the text fields
+  final int? messageCode;
+  final List<int> recommendationCodes;
+  final List<double> probabilities;
+  // Version of the model that produced the prediction
+  final String? modelVersion;
+  // Why the image was rejected, for invalid images
+  final String? reason;
 
   PredictionResult({
     required this.disease,
@@ -19,6 +35,11 @@ class PredictionResult {
     required this.recommendations,
     required this.timestamp,
     this.validationError = false,
+    this.messageCode,
+    this.recommendationCodes = const [],
+    this.probabilities = const [],
+    this.modelVersion,
+    this.reason,
   });
 
   factory PredictionResult.fromJson(Map<String, dynamic> json) {
@@ -30,6 +51,35 @@ class PredictionResult {
       recommendations: List<String>.from(json['recommendations'] ?? []),
       timestamp: (json['timestamp'] ?? 0.0).toDouble(),
       validationError: json['validation_error'] ?? false,
+      modelVersion: json['model_version'],
+      reason: json['reason'],
+    );
+  }
+
+  factory PredictionResult.fromCompactJson(Map<String, dynamic> json) {
+    final int classIndex = json['c'] ?? -1;
+    final int severityIndex = json['s'] ?? 0;
+    return PredictionResult(
+      disease:
+          classIndex >= 0 && classIndex < predictionClasses.length
+              ? predictionClasses[classIndex]
+              : 'Invalid Image',
+      confidence: (json['conf'] ?? 0.0).toDouble(),
+      severity:
+          severityIndex < predictionSeverities.length
+              ? predictionSeverities[severityIndex]
+              : 'Unknown',
+      message: '',
+      recommendations: const [],
+      timestamp: (json['t'] ?? 0.0).toDouble(),
+      validationError: classIndex < 0,
+      messageCode: json['m'],
+      recommendationCodes: List<int>.from(json['r'] ?? []),
+      probabilities: List<double>.from(
+        (json['p'] ?? []).map((p) => (p as num).toDouble()),
+      ),
+      modelVersion: json['v'],
+      reason: json['rs'],
     );
   }
 }
@@ -108,25 +158,39 @@ class ApiService {
     File imageFile,
   ) async {
     try {
-      // Convert image to base64
+      // Send the raw image bytes (no base64) and ask for the compact response
       List<int> imageBytes = await imageFile.readAsBytes();
-      String base64Image = base64Encode(imageBytes);
 
-      print('Sending request to: $url/predict-base64');
+      print('Sending request to: $url/predict');
 
       // Prepare request
-      final response = await http
+      http.Response response = await http
           .post(
-            Uri.parse('$url/predict-base64'),
-            headers: {'Content-Type': 'application/json'},
-            body: jsonEncode({'image': base64Image}),
+            Uri.parse('$url/predict'),
+            headers: {
+              'Content-Type': 'application/octet-stream',
+              'Accept': compactJsonMediaType,
+            },
+            body: imageBytes,
           )
           .timeout(const Duration(seconds: 30));
 
       print('Response status: ${response.statusCode}');
 
+      // Older servers only take a multipart upload on /predict
+      if (response.statusCode == 415 || response.statusCode == 422) {
+        print('Raw upload not supported, retrying as multipart');
+        response = await _postMultipart(url, imageFile.path, imageBytes);
+        print('Response status: ${response.statusCode}');
+      }
+
       if (response.statusCode == 200) {
         final Map<String, dynamic> data = jsonDecode(response.body);
+        // Older servers ignore Accept and answer with the full JSON response
+        final contentType = response.headers['content-type'] ?? '';
+        if (contentType.startsWith(compactJsonMediaType)) {
+          return PredictionResult.fromCompactJson(data);
+        }
         return PredictionResult.fromJson(data);
       } else {
         throw Exception(
@@ -138,6 +202,33 @@ class ApiService {
     }
   }
 
+  static Future<http.Response> _postMultipart(
+    String url,
+    String path,
+    List<int> imageBytes,
+  ) async {
+    final fileExtension = path.split('.').last.toLowerCase();
+    final request =
+        http.MultipartRequest('POST', Uri.parse('$url/predict'))
+          ..headers['Accept'] = compactJsonMediaType
+          ..files.add(
+            http.MultipartFile.fromBytes(
+              'file',
+              imageBytes,
+              filename: path.split(Platform.pathSeparator).last,
+              // The server only accepts image/* uploads
+              contentType: MediaType(
+                'image',
+                const {'png', 'gif', 'bmp', 'webp'}.contains(fileExtension)
+                    ? fileExtension
+                    : 'jpeg',
+              ),
+            ),
+          );
+    final streamed = await request.send().timeout(const Duration(seconds: 30));
+    return http.Response.fromStream(streamed);
+  }
+
   static Future<bool> isApiAvailable() async {
     print('=== Checking API availability ===');
     print('Platform: ${Platform.operatingSystem}');
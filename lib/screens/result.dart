@@ -75,7 +75,10 @@ class _ResultState extends State<Result> {
                     if (result != null) ...[
                       _buildPredictionMessage(result),
                       SizedBox(height: 30.h),
-                      _buildRecommendations(result.recommendations, l10n),
+                      _buildRecommendations(
+                        _localizedRecommendations(result, l10n),
+                        l10n,
+                      ),
                       SizedBox(height: 20.h),
                     ] else ...[
                       Text(
@@ -150,6 +153,8 @@ class _ResultState extends State<Result> {
         return l10n.diseaseCyst;
       case 'tumor':
         return l10n.diseaseTumor;
+      case 'stone':
+        return l10n.diseaseStone;
       case 'normal':
         return l10n.diseaseNormal;
       case 'invalid image':
@@ -216,7 +221,10 @@ class _ResultState extends State<Result> {
     }
 
     final l10n = AppLocalizations.of(context)!;
-    String localizedMessage = _localizedMessage(result.message, l10n);
+    String localizedMessage =
+        result.messageCode != null
+            ? _messageForCode(result, l10n)
+            : _localizedMessage(result.message, l10n);
 
     return Container(
       padding: REdgeInsets.all(16.w),
@@ -233,6 +241,25 @@ class _ResultState extends State<Result> {
     );
   }
 
+  // Message codes of the compact response format (api/responses.py)
+  String _messageForCode(PredictionResult result, AppLocalizations l10n) {
+    final disease = _localizedDisease(result.disease, l10n);
+    switch (result.messageCode) {
+      case 0:
+        return l10n.msgNormal;
+      case 1:
+        return l10n.msgPossible(disease);
+      case 2:
+        return l10n.msgModerate(disease);
+      case 3:
+        return l10n.msgStrong(disease);
+      case 4:
+        return l10n.msgInvalidImage(result.reason ?? '');
+      default:
+        return result.message;
+    }
+  }
+
   String _localizedMessage(String message, AppLocalizations l10n) {
     switch (message.trim()) {
       case "Possible indication of cyst detected. Consider consulting a healthcare professional for further evaluation.":
@@ -265,7 +292,7 @@ class _ResultState extends State<Result> {
                     SizedBox(width: 8.w),
                     Expanded(
                       child: Text(
-                        _localizedRecommendation(recommendation, l10n),
+                        recommendation,
                         style: TextStyle(
                           fontSize: 16.sp,
                           color: Colors.black87,
@@ -282,6 +309,68 @@ class _ResultState extends State<Result> {
     );
   }
 
+  List<String> _localizedRecommendations(
+    PredictionResult result,
+    AppLocalizations l10n,
+  ) {
+    if (result.recommendationCodes.isNotEmpty) {
+      return result.recommendationCodes
+          .map((code) => _recommendationForCode(code, l10n))
+          .whereType<String>()
+          .toList();
+    }
+    return result.recommendations
+        .map((recommendation) => _localizedRecommendation(recommendation, l10n))
+        .toList();
+  }
+
+  // Recommendation codes of the compact response format (api/responses.py)
+  String? _recommendationForCode(int code, AppLocalizations l10n) {
+    switch (code) {
+      case 0:
+        return l10n.recHealthyLifestyle;
+      case 1:
+        return l10n.recStayHydrated;
+      case 2:
+        return l10n.recExerciseDiet;
+      case 3:
+        return l10n.recAnnualCheckups;
+      case 4:
+        return l10n.recConsultNephrologist;
+      case 5:
+        return l10n.recFollowUpTests;
+      case 6:
+        return l10n.recMonitorSymptoms;
+      case 7:
+        return l10n.recMaintainMeds;
+      case 8:
+        return l10n.recMonitorCystSize;
+      case 9:
+        return l10n.recAvoidTrauma;
+      case 10:
+        return l10n.recIncreaseWater;
+      case 11:
+        return l10n.recStoneDiet;
+      case 12:
+        return l10n.recSeekAttention;
+      case 13:
+        return l10n.recImagingBiopsy;
+      case 14:
+        return l10n.recUploadUltrasound;
+      case 15:
+        return l10n.recUseCtMri;
+      case 16:
+        return l10n.recShowKidney;
+      case 17:
+        return l10n.recAvoidNonMedical;
+      case 18:
+        return l10n.recWellLit;
+      default:
+        // Codes added to the server after this app was built
+        return null;
+    }
+  }
+
   String _localizedRecommendation(
     String recommendation,
     AppLocalizations l10n,